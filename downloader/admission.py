@@ -0,0 +1,146 @@
+import math
+from dataclasses import dataclass
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F
+from django.utils import timezone
+from .models import DownloadTask
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SERVICE_TIMES_CACHE_KEY = "admission:service_times"
+WORKER_SLOTS_CACHE_KEY = "admission:worker_slots"
+
+_broker_client = None
+
+
+@dataclass
+class Estimate:
+    queue_depth: int
+    in_progress: int
+    worker_slots: int
+    projected_wait: float
+    service_time: float
+
+    @property
+    def eta_seconds(self):
+        return math.ceil(self.projected_wait + self.service_time)
+
+    @property
+    def admitted(self):
+        return self.projected_wait <= settings.ADMISSION_MAX_WAIT_SECONDS
+
+    @property
+    def retry_after(self):
+        """Seconds until the backlog should have drained below the threshold."""
+        excess = self.projected_wait - settings.ADMISSION_MAX_WAIT_SECONDS
+        return max(math.ceil(excess), settings.ADMISSION_MIN_RETRY_AFTER)
+
+
+def broker_queue_depth():
+    global _broker_client
+    if _broker_client is None:
+        _broker_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _broker_client.llen(settings.ADMISSION_QUEUE_NAME)
+
+
+def queue_depth():
+    """
+    Tasks waiting for a worker: in the broker, still in client queues and
+    handed to the I/O workers but not yet picked up.
+    """
+    from .fairqueue import IO_QUEUE_KEY, backlog, get_redis
+
+    return broker_queue_depth() + backlog() + get_redis().llen(IO_QUEUE_KEY)
+
+
+def worker_slots():
+    """
+    Total prefork slots across live workers, plus the capacity of the asyncio
+    I/O workers when they are in use, cached briefly per process. Workers
+    advertise their capacity in Redis, see fairqueue.CapacityBeacon, so this
+    never waits on a broadcast to the workers.
+    """
+    slots = cache.get(WORKER_SLOTS_CACHE_KEY)
+    if slots is not None:
+        return slots
+
+    from .fairqueue import celery_worker_slots, io_worker_slots
+
+    slots = 0
+    try:
+        slots += celery_worker_slots()
+        if settings.DOWNLOAD_WORKER_MODE == "asyncio":
+            slots += io_worker_slots()
+    except redis.RedisError as e:
+        logger.info(f"Could not read worker capacity: {e}")
+    slots = slots or settings.ADMISSION_DEFAULT_WORKER_SLOTS
+    cache.set(WORKER_SLOTS_CACHE_KEY, slots, settings.ADMISSION_STATS_TTL)
+    return slots
+
+
+def service_times():
+    """Mean seconds from start to finish per resolution over the recent window."""
+    times = cache.get(SERVICE_TIMES_CACHE_KEY)
+    if times is not None:
+        return times
+
+    since = timezone.now() - timedelta(hours=settings.ADMISSION_HISTORY_HOURS)
+    rows = (
+        DownloadTask.objects.filter(
+            status="completed", started_at__isnull=False, finished_at__gte=since
+        )
+        .values("resolution")
+        .annotate(
+            mean=Avg(
+                ExpressionWrapper(
+                    F("finished_at") - F("started_at"), output_field=DurationField()
+                )
+            ),
+            samples=Count("id"),
+        )
+    )
+    times = {}
+    total, samples = 0.0, 0
+    for row in rows:
+        seconds = row["mean"].total_seconds()
+        times[row["resolution"]] = seconds
+        total += seconds * row["samples"]
+        samples += row["samples"]
+    times["*"] = (
+        total / samples if samples else settings.ADMISSION_DEFAULT_SERVICE_SECONDS
+    )
+    cache.set(SERVICE_TIMES_CACHE_KEY, times, settings.ADMISSION_STATS_TTL)
+    return times
+
+
+def estimate(resolution):
+    """
+    Project how long a new task for ``resolution`` would wait and take.
+
+    With a free worker slot there is no wait. Otherwise each queued task costs
+    the overall mean service time and each running task on average half of
+    it, spread over the worker slots.
+    """
+    times = service_times()
+    mean = times["*"]
+    depth = queue_depth()
+    in_progress = DownloadTask.objects.filter(status="in_progress").count()
+    slots = worker_slots()
+
+    if in_progress + depth < slots:
+        projected_wait = 0.0
+    else:
+        projected_wait = (depth * mean + in_progress * mean / 2) / slots
+    return Estimate(
+        queue_depth=depth,
+        in_progress=in_progress,
+        worker_slots=slots,
+        projected_wait=projected_wait,
+        service_time=times.get(resolution, mean),
+    )
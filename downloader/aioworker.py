@@ -0,0 +1,536 @@
+"""
+Asyncio I/O worker for the network-bound stages of full downloads.
+
+A prefork worker spends a whole process on each download, although most of
+that time is spent waiting on YouTube or the bucket. With DOWNLOAD_WORKER_MODE
+"asyncio", dispatch() hands full downloads to the IOWorker instead. It runs
+up to IO_WORKER_CONCURRENCY of them as coroutines in one process. All of
+them share one pooled aiohttp session:
+- Streams are fetched in ranges, the way pytubefix does it, and written to
+  scratch files in small chunks.
+- Uploads send presigned multipart PUTs straight from the file.
+- Progress goes to the channel layer as it does from download_video.
+
+pytubefix has no async API, so metadata and stream URLs are resolved on a
+bounded thread pool. The few blocking Redis and bucket calls run there too.
+ffmpeg merges run on a process pool of IO_WORKER_FFMPEG_PROCESSES. Clips and
+progressive downloads are ffmpeg end to end and stay on the prefork workers.
+
+The worker beats for its tasks like Heartbeat does, so reap_stuck_tasks
+covers it. It also advertises its capacity for admission control.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from . import fairqueue
+from .cancellation import TaskCancelled, cancel_key
+from .ffmpegpool import process_pool, run_ffmpeg_job
+from .models import DownloadTask
+from .reaper import HEARTBEATS_KEY, remove_scratch, sweep_orphans, worker_key
+from .storage import find_stored_object, record_upload, shard_client, shard_for
+from .tasks import (
+    build_merge_cmd,
+    describe_video,
+    finish_task,
+    open_video,
+    output_key,
+    progress_payload,
+    select_video_stream,
+    set_stage,
+    video_error_message,
+)
+from .uploads import plan_upload, record_upload_metrics
+from .webhooks import enqueue_webhook
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Attempts per range request or upload part before the task fails
+ATTEMPTS = 3
+
+
+# --- Blocking steps, run off the event loop ---
+
+
+def claim(task_id):
+    """
+    ``(task, started)``; the task is only started if it was not cancelled
+    while queued.
+    """
+    started = DownloadTask.objects.filter(id=task_id, status="pending").update(
+        status="in_progress", stage="fetching_metadata", started_at=timezone.now()
+    )
+    return DownloadTask.objects.get(id=task_id), bool(started)
+
+
+def fetch_metadata(task, original_payload):
+    yt = open_video(task.url)
+    key_name = output_key(yt.title, original_payload["resolution"], task.include_audio)
+    return yt, key_name, describe_video(yt, original_payload)
+
+
+def resolve_streams(yt, task):
+    """``(url, size)`` of the video stream and of the audio stream or None."""
+    video_stream = select_video_stream(yt, task.resolution)
+    audio_stream = yt.streams.get_audio_only() if task.include_audio else None
+    return (
+        (video_stream.url, video_stream.filesize),
+        (audio_stream.url, audio_stream.filesize) if audio_stream else None,
+    )
+
+
+def fail_task(task_id, error_message):
+    DownloadTask.objects.filter(id=task_id).update(
+        status="failed", stage="error", finished_at=timezone.now()
+    )
+    enqueue_webhook(
+        DownloadTask.objects.get(id=task_id), "task.failed", error_message=error_message
+    )
+
+
+def release_slot(task_id, client_id):
+    fairqueue.release(task_id, client_id)
+    fairqueue.dispatch()
+
+
+def off_loop(func):
+    """
+    ``func`` as a coroutine on the blocking thread pool. Stale database
+    connections are closed around it, as Celery does around each task.
+    """
+    return database_sync_to_async(func, thread_sensitive=False)
+
+
+class Transfer:
+    """A download running on the I/O worker."""
+
+    def __init__(self, task):
+        self.task = task
+        self.task_id = str(task.id)
+        self.metadata = None
+        self.paths = []
+        self.sent_at = 0.0
+        self.checked_at = 0.0
+
+    def scratch_file(self, suffix):
+        path = tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+        self.paths.append(path)
+        return path
+
+
+class IOWorker:
+    """Takes dispatched downloads from Redis and runs them concurrently."""
+
+    def __init__(self, concurrency=None, ffmpeg_processes=None):
+        self.concurrency = concurrency or settings.IO_WORKER_CONCURRENCY
+        self.ffmpeg_processes = ffmpeg_processes or settings.IO_WORKER_FFMPEG_PROCESSES
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.running = {}
+        self.pending = set()
+        self.stopping = False
+        self.stats = defaultdict(int)
+
+    async def run(self):
+        import aiohttp
+        import redis.asyncio as aioredis
+
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(
+            ThreadPoolExecutor(
+                settings.IO_WORKER_THREADS, thread_name_prefix="io-blocking"
+            )
+        )
+        self.ffmpeg_pool = process_pool(self.ffmpeg_processes)
+        self.redis = aioredis.from_url(
+            settings.TASK_STATE_REDIS_URL, decode_responses=True
+        )
+        self.channel_layer = get_channel_layer()
+        await asyncio.to_thread(sweep_orphans)
+        connector = aiohttp.TCPConnector(
+            limit=settings.IO_WORKER_CONNECTIONS,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=30, sock_read=settings.IO_WORKER_READ_TIMEOUT
+        )
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as self.session:
+            beater = asyncio.create_task(self.beat())
+            try:
+                while not self.stopping:
+                    await self.take_once()
+            finally:
+                # Running downloads are finished, nothing new is taken
+                if self.pending:
+                    await asyncio.gather(*self.pending, return_exceptions=True)
+                beater.cancel()
+                await self.redis.delete(fairqueue.capacity_key(self.worker_id))
+                await self.redis.aclose()
+                self.ffmpeg_pool.shutdown()
+
+    def stop(self):
+        self.stopping = True
+
+    async def take_once(self):
+        await self.slots.acquire()
+        popped = await self.redis.brpop(fairqueue.IO_QUEUE_KEY, timeout=1)
+        if not popped:
+            self.slots.release()
+            return
+        job = asyncio.create_task(self.process(json.loads(popped[1])))
+        self.pending.add(job)
+        job.add_done_callback(self.pending.discard)
+
+    async def beat(self):
+        """Advertise capacity and keep the running tasks' heartbeats fresh."""
+        while True:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.set(
+                    fairqueue.capacity_key(self.worker_id),
+                    self.concurrency,
+                    ex=int(settings.HEARTBEAT_TIMEOUT),
+                )
+                if self.running:
+                    now = time.time()
+                    pipe.zadd(
+                        HEARTBEATS_KEY, {task_id: now for task_id in self.running}
+                    )
+                await pipe.execute()
+            except redis.RedisError as e:
+                logger.info(f"I/O worker heartbeat failed: {e}")
+            await asyncio.sleep(settings.HEARTBEAT_INTERVAL)
+
+    async def track(self, transfer, **fields):
+        """Record what reap_stuck_tasks cleans up if this process dies."""
+        await self.redis.hset(
+            worker_key(transfer.task_id),
+            mapping={"paths": json.dumps(transfer.paths), **fields},
+        )
+
+    # --- Per-task pipeline ---
+
+    async def process(self, entry):
+        task_id = entry["task_id"]
+        task = transfer = None
+        try:
+            task, started = await off_loop(claim)(task_id)
+            if not started:
+                logger.info(f"Task {task_id} is no longer pending, skipping")
+                return
+            transfer = Transfer(task)
+            self.running[task_id] = transfer
+            await self.redis.zadd(HEARTBEATS_KEY, {task_id: time.time()})
+            await self.track(transfer, host=socket.gethostname(), pid=os.getpid())
+            logger.info(
+                f"Starting to process video with ID: {task_id}",
+                extra={"event": "stage", "task_id": task_id, "stage": "started"},
+            )
+            await self.download(transfer, entry["payload"])
+            self.stats["completed"] += 1
+
+        except TaskCancelled:
+            # cancel_task already updated the row and notified the clients
+            logger.info(f"Task {task_id} was cancelled, stopped processing")
+            self.stats["cancelled"] += 1
+
+        except Exception as e:
+            if transfer and await self.is_cancelled(transfer, force=True):
+                logger.info(f"Task {task_id} was cancelled, stopped processing")
+                self.stats["cancelled"] += 1
+                return
+
+            error_message = video_error_message(e) or str(e)
+            logger.error(
+                f"Error downloading video: {error_message}",
+                exc_info=True,
+                extra={"event": "error", "task_id": task_id},
+            )
+            self.stats["failed"] += 1
+            await self.notify(task_id, "error", "failed", error_message=error_message)
+            await off_loop(fail_task)(task_id, error_message)
+
+        finally:
+            self.slots.release()
+            if transfer is not None:
+                remove_scratch(transfer.paths)
+                self.running.pop(task_id, None)
+                try:
+                    pipe = self.redis.pipeline()
+                    pipe.zrem(HEARTBEATS_KEY, task_id)
+                    pipe.delete(worker_key(task_id))
+                    await pipe.execute()
+                except redis.RedisError as e:
+                    logger.info(f"Could not clear heartbeat of task {task_id}: {e}")
+            # Hand this slot to the next client in line
+            if task is not None:
+                try:
+                    await off_loop(release_slot)(task_id, task.client_id)
+                except Exception as e:
+                    logger.info(f"Fair queue dispatch after task {task_id} failed: {e}")
+
+    async def download(self, transfer, original_payload):
+        task = transfer.task
+        yt, key_name, metadata = await asyncio.to_thread(
+            fetch_metadata, task, original_payload
+        )
+        transfer.metadata = metadata
+
+        stored = await off_loop(find_stored_object)(key_name)
+        if stored is not None:
+            logger.info(f"Serving {key_name} from storage for task {task.id}")
+            shard, size = stored
+            await off_loop(finish_task)(
+                task, key_name, shard, size, self.channel_layer, metadata
+            )
+            return
+
+        await self.check_cancelled(transfer)
+        await off_loop(set_stage)(task, "downloading_video")
+        video, audio = await asyncio.to_thread(resolve_streams, yt, task)
+
+        video_filename = transfer.scratch_file(".mp4")
+        await self.track(transfer)
+        await self.fetch(transfer, *video, video_filename, "downloading_video")
+
+        if audio is not None:
+            await off_loop(set_stage)(task, "downloading_audio")
+            audio_filename = transfer.scratch_file(".mp3")
+            await self.track(transfer)
+            await self.fetch(transfer, *audio, audio_filename, "downloading_audio")
+
+            await off_loop(set_stage)(task, "merging")
+            output_filename = transfer.scratch_file(".mp4")
+            await self.track(transfer)
+            await asyncio.get_running_loop().run_in_executor(
+                self.ffmpeg_pool,
+                run_ffmpeg_job,
+                build_merge_cmd(video_filename, audio_filename, output_filename),
+                transfer.task_id,
+                metadata,
+            )
+        else:
+            output_filename = video_filename
+
+        await self.check_cancelled(transfer)
+        await off_loop(set_stage)(task, "uploading")
+        shard = await self.upload(transfer, output_filename, key_name)
+        await self.check_cancelled(transfer, force=True)
+
+        await off_loop(finish_task)(
+            task,
+            key_name,
+            shard,
+            os.path.getsize(output_filename),
+            self.channel_layer,
+            metadata,
+        )
+
+    async def fetch(self, transfer, url, size, path, stage):
+        """Download a stream in ranges; a failed range resumes where it stopped."""
+        import aiohttp
+
+        downloaded = 0
+        failures = 0
+        with open(path, "wb") as f:
+            while downloaded < size:
+                end = min(downloaded + settings.IO_WORKER_RANGE_SIZE, size) - 1
+                received = 0
+                try:
+                    async with self.session.get(
+                        f"{url}&range={downloaded}-{end}"
+                    ) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            # Page cache writes of one chunk, cheap enough here
+                            f.write(chunk)
+                            received += len(chunk)
+                            downloaded += len(chunk)
+                            await self.progress(transfer, stage, downloaded / size)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    failures += 1
+                    if failures >= ATTEMPTS:
+                        raise
+                    logger.info(f"Range request of task {transfer.task_id} failed: {e}")
+                    continue
+                if not received:
+                    raise Exception(f"Empty response for bytes {downloaded}-{end}")
+                failures = 0
+
+    async def upload(self, transfer, path, key_name):
+        """Multipart upload through presigned part URLs. Returns the shard."""
+        shard = shard_for(key_name)
+        await self.track(transfer, upload_key=key_name, shard=shard)
+        s3_client, bucket_name = await asyncio.to_thread(shard_client, shard)
+        file_size = os.path.getsize(path)
+        plan = await asyncio.to_thread(plan_upload, file_size)
+        await off_loop(record_upload)(key_name, file_size, shard)
+        uploaded = [0]
+
+        started = time.monotonic()
+        if plan.parts(file_size) == 1:
+            url = s3_client.generate_presigned_url(
+                "put_object",
+                Params={"Bucket": bucket_name, "Key": key_name},
+                ExpiresIn=settings.URL_EXPIRY_SECONDS,
+            )
+            await self.put(transfer, url, path, 0, file_size, uploaded, file_size)
+        else:
+            upload_id = (
+                await asyncio.to_thread(
+                    s3_client.create_multipart_upload, Bucket=bucket_name, Key=key_name
+                )
+            )["UploadId"]
+            try:
+                part_slots = asyncio.Semaphore(plan.concurrency)
+
+                async def send_part(number):
+                    offset = (number - 1) * plan.part_size
+                    length = min(plan.part_size, file_size - offset)
+                    url = s3_client.generate_presigned_url(
+                        "upload_part",
+                        Params={
+                            "Bucket": bucket_name,
+                            "Key": key_name,
+                            "UploadId": upload_id,
+                            "PartNumber": number,
+                        },
+                        ExpiresIn=settings.URL_EXPIRY_SECONDS,
+                    )
+                    async with part_slots:
+                        etag = await self.put(
+                            transfer, url, path, offset, length, uploaded, file_size
+                        )
+                    return {"ETag": etag, "PartNumber": number}
+
+                parts = await asyncio.gather(
+                    *(
+                        send_part(number)
+                        for number in range(1, plan.parts(file_size) + 1)
+                    )
+                )
+                await asyncio.to_thread(
+                    s3_client.complete_multipart_upload,
+                    Bucket=bucket_name,
+                    Key=key_name,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+            except BaseException:
+                # Don't leave the parts of an interrupted multipart upload behind
+                try:
+                    await asyncio.to_thread(
+                        s3_client.abort_multipart_upload,
+                        Bucket=bucket_name,
+                        Key=key_name,
+                        UploadId=upload_id,
+                    )
+                except Exception as abort_error:
+                    logger.info(f"Aborting multipart upload failed: {abort_error}")
+                raise
+        await asyncio.to_thread(
+            record_upload_metrics,
+            key_name,
+            file_size,
+            time.monotonic() - started,
+            plan,
+        )
+        return shard
+
+    async def put(self, transfer, url, path, offset, length, uploaded, total):
+        """PUT ``length`` bytes of ``path`` from ``offset``, streamed from disk."""
+        import aiohttp
+
+        for attempt in range(1, ATTEMPTS + 1):
+            sent = 0
+
+            async def body():
+                nonlocal sent
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    while sent < length:
+                        chunk = f.read(min(CHUNK_SIZE, length - sent))
+                        if not chunk:
+                            break
+                        sent += len(chunk)
+                        uploaded[0] += len(chunk)
+                        await self.progress(
+                            transfer, "upload_in_progress", uploaded[0] / total
+                        )
+                        yield chunk
+
+            try:
+                async with self.session.put(
+                    url, data=body(), headers={"Content-Length": str(length)}
+                ) as response:
+                    text = await response.text()
+                    if response.status < 300:
+                        return response.headers.get("ETag")
+                    error = Exception(f"Upload failed with {response.status}: {text}")
+                    if response.status < 500:
+                        raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Also how a cancellation raised from body() surfaces
+                await self.check_cancelled(transfer, force=True)
+                error = e
+            uploaded[0] -= sent
+            logger.info(f"Upload attempt {attempt} of task {transfer.task_id}: {error}")
+        raise error
+
+    # --- Progress and cancellation ---
+
+    async def is_cancelled(self, transfer, force=False):
+        now = time.monotonic()
+        if force or now - transfer.checked_at >= settings.CANCEL_CHECK_INTERVAL:
+            transfer.checked_at = now
+            try:
+                return bool(await self.redis.exists(cancel_key(transfer.task_id)))
+            except redis.RedisError as e:
+                logger.info(f"Could not check cancellation for {transfer.task_id}: {e}")
+        return False
+
+    async def check_cancelled(self, transfer, force=False):
+        if await self.is_cancelled(transfer, force):
+            raise TaskCancelled(f"Task {transfer.task_id} was cancelled")
+
+    async def progress(self, transfer, stage, fraction):
+        await self.check_cancelled(transfer)
+        now = time.monotonic()
+        if (
+            fraction < 1
+            and now - transfer.sent_at < settings.IO_WORKER_PROGRESS_INTERVAL
+        ):
+            return
+        transfer.sent_at = now
+        await self.notify(
+            transfer.task_id,
+            stage,
+            "in_progress",
+            metadata=transfer.metadata,
+            progress=fraction * 100,
+        )
+
+    async def notify(self, task_id, stage, status, **fields):
+        try:
+            await self.channel_layer.group_send(
+                f"task_{task_id}", progress_payload(stage, task_id, status, **fields)
+            )
+        except Exception as e:
+            logger.warning(f"Error sending payload to group: {e}")
@@ -0,0 +1,189 @@
+import time
+from datetime import timedelta
+
+import redis
+from asgiref.sync import async_to_sync
+from celery import shared_task
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from .models import DownloadTask
+from .webhooks import enqueue_webhook
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ["pending", "in_progress"]
+STATE_TTL = 86400
+
+_redis_client = None
+
+
+class TaskCancelled(Exception):
+    """Raised inside a worker once its task has been cancelled."""
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.TASK_STATE_REDIS_URL)
+    return _redis_client
+
+
+def cancel_key(task_id):
+    return f"task:{task_id}:cancelled"
+
+
+def watchers_key(task_id):
+    return f"task:{task_id}:watchers"
+
+
+def last_seen_key(task_id):
+    return f"task:{task_id}:last_seen"
+
+
+# --- Client activity tracking, used to detect abandoned tasks ---
+
+
+def touch(task_id):
+    """Record that a client looked at the task (status poll, socket, stream)."""
+    try:
+        get_redis().set(last_seen_key(task_id), time.time(), ex=STATE_TTL)
+    except redis.RedisError as e:
+        logger.info(f"Could not record activity for task {task_id}: {e}")
+
+
+def touch_many(task_ids):
+    """touch() for a batch of tasks in one round-trip."""
+    if not task_ids:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        now = time.time()
+        for task_id in task_ids:
+            pipe.set(last_seen_key(task_id), now, ex=STATE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.info(f"Could not record activity for {len(task_ids)} tasks: {e}")
+
+
+def add_watcher(task_id):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(watchers_key(task_id))
+        pipe.expire(watchers_key(task_id), STATE_TTL)
+        pipe.set(last_seen_key(task_id), time.time(), ex=STATE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.info(f"Could not register watcher for task {task_id}: {e}")
+
+
+def remove_watcher(task_id):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.decr(watchers_key(task_id))
+        pipe.set(last_seen_key(task_id), time.time(), ex=STATE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.info(f"Could not unregister watcher for task {task_id}: {e}")
+
+
+# --- Cancellation ---
+
+
+def cancel_task(task, reason="Cancelled by user"):
+    """
+    Mark an unfinished task cancelled, revoke it if it is still queued and
+    flag it so a running worker stops at its next progress callback.
+    Returns False if the task had already finished.
+    """
+    updated = DownloadTask.objects.filter(
+        id=task.id, status__in=ACTIVE_STATUSES
+    ).update(status="cancelled", stage="cancelled", finished_at=timezone.now())
+    if not updated:
+        return False
+    task.refresh_from_db()
+
+    get_redis().set(cancel_key(task.id), reason, ex=STATE_TTL)
+
+    from youtube_downloader.celery import app
+
+    # The Celery task id is the DownloadTask id, see start_download
+    app.control.revoke(str(task.id))
+
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"task_{task.id}",
+            {
+                "type": "progress.update",
+                "stage": "cancelled",
+                "status": "cancelled",
+                "task_id": str(task.id),
+                "progress": task.progress,
+                "download_url": None,
+                "error_message": reason,
+                "metadata": None,
+            },
+        )
+    except Exception as e:
+        logger.info(f"Error sending cancellation to group: {e}")
+    enqueue_webhook(task, "task.cancelled", error_message=reason)
+    logger.info(f"Cancelled task {task.id}: {reason}")
+    return True
+
+
+class CancellationToken:
+    """
+    Checked from a worker's progress callbacks; raises TaskCancelled once the
+    task has been cancelled. Redis is polled at most every ``interval`` seconds.
+    """
+
+    def __init__(self, task_id, interval=None):
+        self.task_id = task_id
+        self.interval = settings.CANCEL_CHECK_INTERVAL if interval is None else interval
+        self.cancelled = False
+        self._checked_at = 0.0
+
+    def is_cancelled(self, force=False):
+        now = time.monotonic()
+        if not self.cancelled and (force or now - self._checked_at >= self.interval):
+            self._checked_at = now
+            try:
+                self.cancelled = bool(get_redis().exists(cancel_key(self.task_id)))
+            except redis.RedisError as e:
+                logger.info(f"Could not check cancellation for {self.task_id}: {e}")
+        return self.cancelled
+
+    def check(self):
+        if self.is_cancelled():
+            raise TaskCancelled(f"Task {self.task_id} was cancelled")
+
+
+@shared_task
+def cancel_abandoned_tasks():
+    """
+    Cancel unfinished tasks nobody is watching: no open progress socket and no
+    status poll or stream read for ABANDON_AFTER_SECONDS. Tasks with a webhook
+    are left alone, their clients are not expected to watch, and so are
+    pre-warming tasks, which have no client at all.
+    """
+    threshold = time.time() - settings.ABANDON_AFTER_SECONDS
+    created_before = timezone.now() - timedelta(seconds=settings.ABANDON_AFTER_SECONDS)
+    candidates = DownloadTask.objects.filter(
+        status__in=ACTIVE_STATUSES,
+        webhook_url__isnull=True,
+        created_at__lt=created_before,
+    ).exclude(client_id=settings.PREWARM_CLIENT_ID)
+
+    client = get_redis()
+    cancelled = 0
+    for task in candidates.iterator():
+        watchers, last_seen = client.mget(watchers_key(task.id), last_seen_key(task.id))
+        if watchers is not None and int(watchers) > 0:
+            continue
+        if last_seen is not None and float(last_seen) > threshold:
+            continue
+        if cancel_task(task, reason="Cancelled because no client was watching"):
+            cancelled += 1
+    return cancelled
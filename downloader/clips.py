@@ -0,0 +1,190 @@
+import math
+import os
+import shlex
+import subprocess
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Boundary GOPs are re-encoded with settings close to the source so the
+# joins are not visible
+BOUNDARY_ENCODE_ARGS = "-c:v libx264 -preset veryfast -crf 18"
+AUDIO_ENCODE_ARGS = "-c:a aac -b:a 128k"
+KEYFRAME_PROBE_WINDOW = 20
+# Edge pieces shorter than this are left out
+MIN_PIECE_SECONDS = 0.001
+
+
+def parse_timestamp(value):
+    """
+    Parse seconds given as a number or as ``[[HH:]MM:]SS[.fff]``.
+    Raises ValueError for anything else, including negative values.
+    """
+    if isinstance(value, bool):
+        raise ValueError("Invalid timestamp")
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        parts = str(value).strip().split(":")
+        if not 1 <= len(parts) <= 3:
+            raise ValueError("Invalid timestamp")
+        seconds = 0.0
+        for part in parts:
+            # "-0:30" would otherwise parse as 30 seconds
+            if part.strip().startswith("-"):
+                raise ValueError("Invalid timestamp")
+            seconds = seconds * 60 + float(part)
+    if seconds < 0 or not math.isfinite(seconds):
+        raise ValueError("Invalid timestamp")
+    return seconds
+
+
+def clip_key_suffix(start, end, frame_accurate, include_audio):
+    """Storage key suffix so every clip variant is cached under its own object."""
+    suffix = f"_clip_{start:g}-{end:g}s"
+    if frame_accurate:
+        suffix += "_exact"
+    if not include_audio:
+        suffix += "_noaudio"
+    return suffix
+
+
+def format_time(seconds):
+    """
+    Seconds for ffmpeg at microsecond precision, its internal time base and
+    the precision ffprobe reports. Keyframe times pass through unchanged, so
+    a copy seek lands on the keyframe itself and not on the one before it.
+    """
+    return f"{seconds:.6f}"
+
+
+def seek_input(url, start, duration):
+    # -ss/-t before -i: ffmpeg seeks through the MP4 index and only requests
+    # the byte ranges of the window instead of downloading the whole stream
+    return f"-ss {format_time(start)} -t {format_time(duration)} -i {shlex.quote(url)}"
+
+
+def build_keyframe_clip_cmd(video_stream, audio_stream, start, end, output_filename):
+    """Cut at the keyframe at or before ``start`` and copy the video as is."""
+    duration = end - start
+    inputs = seek_input(video_stream.url, start, duration)
+    maps = "-map 0:v:0"
+    audio_args = ""
+    if audio_stream is not None:
+        inputs += " " + seek_input(audio_stream.url, start, duration)
+        maps += " -map 1:a:0"
+        audio_args = f"{AUDIO_ENCODE_ARGS} -shortest"
+    return (
+        f"ffmpeg -y {inputs} {maps} -c:v copy {audio_args} "
+        f"-avoid_negative_ts make_zero {shlex.quote(output_filename)}"
+    )
+
+
+def keyframe_times(url, start, end):
+    """Presentation times of the keyframes between ``start`` and ``end``."""
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-skip_frame",
+        "nokey",
+        "-show_entries",
+        "frame=pts_time",
+        "-of",
+        "csv=p=0",
+        "-read_intervals",
+        f"{format_time(start)}%{format_time(end)}",
+        url,
+    ]
+    output = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+    if output.returncode != 0:
+        logger.warning(f"ffprobe keyframe scan failed: {output.stderr.strip()}")
+        return []
+    times = []
+    for line in output.stdout.split():
+        try:
+            times.append(float(line.strip(",")))
+        except ValueError:
+            continue
+    return sorted(t for t in times if start <= t <= end)
+
+
+def find_copy_range(url, start, end):
+    """
+    First keyframe at or after ``start`` and last keyframe at or before ``end``;
+    only the probed windows near each boundary are read.
+    """
+    head = keyframe_times(url, start, min(start + KEYFRAME_PROBE_WINDOW, end))
+    tail = keyframe_times(url, max(end - KEYFRAME_PROBE_WINDOW, start), end)
+    if not head or not tail or tail[-1] <= head[0]:
+        return None
+    return head[0], tail[-1]
+
+
+def frame_accurate_pieces(start, end, first_key, last_key):
+    """
+    ``[(name, seek, duration, copy), ...]`` that cover ``start`` to ``end``
+    back to back: the re-encoded head up to the first keyframe, the copied
+    middle between the keyframes and the re-encoded tail from the last one.
+    Each piece starts exactly where the previous one ends, so no frame is
+    in two pieces.
+    """
+    pieces = []
+    if first_key - start > MIN_PIECE_SECONDS:
+        pieces.append(("head.ts", start, first_key - start, False))
+    pieces.append(("middle.ts", first_key, last_key - first_key, True))
+    if end - last_key > MIN_PIECE_SECONDS:
+        pieces.append(("tail.ts", last_key, end - last_key, False))
+    return pieces
+
+
+def build_frame_accurate_cmds(
+    video_stream, audio_stream, start, end, workdir, output_filename
+):
+    """
+    Commands that cut exactly at ``start``/``end``. Only the partial GOPs at
+    the edges are re-encoded; the keyframe-aligned middle is stream-copied.
+    The pieces are joined as MPEG-TS, which carries the H.264 parameter sets
+    in-band, then muxed with the trimmed audio.
+    """
+    duration = end - start
+    copy_range = None
+    if (getattr(video_stream, "video_codec", "") or "").startswith("avc1"):
+        copy_range = find_copy_range(video_stream.url, start, end)
+
+    audio_input = ""
+    audio_map = ""
+    audio_args = ""
+    if audio_stream is not None:
+        audio_input = seek_input(audio_stream.url, start, duration)
+        audio_map = "-map 1:a:0"
+        audio_args = f"{AUDIO_ENCODE_ARGS} -shortest"
+
+    if copy_range is None:
+        # No usable keyframes inside the window: a short clip, just re-encode it
+        return [
+            f"ffmpeg -y {seek_input(video_stream.url, start, duration)} {audio_input} "
+            f"-map 0:v:0 {audio_map} {BOUNDARY_ENCODE_ARGS} {audio_args} "
+            f"{shlex.quote(output_filename)}"
+        ]
+
+    commands = []
+    pieces = []
+    for name, seek, length, copy in frame_accurate_pieces(start, end, *copy_range):
+        path = os.path.join(workdir, name)
+        pieces.append(path)
+        codec = "-c:v copy -bsf:v h264_mp4toannexb" if copy else BOUNDARY_ENCODE_ARGS
+        commands.append(
+            f"ffmpeg -y {seek_input(video_stream.url, seek, length)} "
+            f"-an {codec} -f mpegts {shlex.quote(path)}"
+        )
+
+    joined = shlex.quote("concat:" + "|".join(pieces))
+    commands.append(
+        f"ffmpeg -y -i {joined} {audio_input} -map 0:v:0 {audio_map} "
+        f"-c:v copy {audio_args} {shlex.quote(output_filename)}"
+    )
+    return commands
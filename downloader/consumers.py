@@ -1,12 +1,14 @@
 import json
+import math
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from .cancellation import add_watcher, remove_watcher
+from .models import DownloadTask
 import logging
 
-logging.basicConfig()
-
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logging.info("Logger initialized for consumers.py", exc_info=True)
 
 
 class DownloadProgressConsumer(AsyncWebsocketConsumer):
@@ -17,32 +19,74 @@ class DownloadProgressConsumer(AsyncWebsocketConsumer):
         # Join the group for task-specific updates
         await self.channel_layer.group_add(self.task_group_name, self.channel_name)
         await self.accept()
+        await sync_to_async(add_watcher, thread_sensitive=False)(self.task_id)
         logger.info(
-            f"WebSocket connection established for task {self.task_id}", exc_info=True
+            f"WebSocket connection established for task {self.task_id}",
+            extra={"task_id": str(self.task_id)},
+        )
+        await self.send_initial_state()
+
+    async def send_initial_state(self):
+        """Tell a new subscriber where the task stands, including its ETA."""
+        task = await self.get_task()
+        if not task:
+            return
+        eta_seconds = None
+        if task.eta_at and task.status in ["pending", "in_progress"]:
+            remaining = (task.eta_at - timezone.now()).total_seconds()
+            eta_seconds = max(math.ceil(remaining), 0)
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "progress.update",
+                    "stage": task.stage,
+                    "status": task.status,
+                    "task_id": str(task.id),
+                    "progress": task.progress,
+                    "download_url": None,
+                    "error_message": None,
+                    "metadata": None,
+                    "eta_seconds": eta_seconds,
+                }
+            )
         )
 
+    @database_sync_to_async
+    def get_task(self):
+        # Sockets live for minutes with no request cycle around them; this
+        # drops a broken or expired connection before and after the query
+        return DownloadTask.objects.filter(id=self.task_id).first()
+
     async def disconnect(self, close_code):
         # Leave the group when WebSocket disconnects
         await self.channel_layer.group_discard(self.task_group_name, self.channel_name)
+        await sync_to_async(remove_watcher, thread_sensitive=False)(self.task_id)
         logger.info(
-            f"WebSocket connection closed for task {self.task_id}", exc_info=True
+            f"WebSocket connection closed for task {self.task_id}",
+            extra={"task_id": str(self.task_id), "close_code": close_code},
         )
 
     async def progress_update(self, event):
         try:
             logger.info(
-                f"Received event in WebSocket for task {self.task_id}: {event}",
-                exc_info=True,
+                f"Received event in WebSocket for task {self.task_id}",
+                extra={
+                    "event": "progress",
+                    "task_id": str(self.task_id),
+                    "stage": event.get("stage"),
+                    "progress": event.get("progress"),
+                },
             )
             await self.send(text_data=json.dumps(event))
 
             # Close socket on completion/failure
             if event["status"] in ["Completed", "Failed"] or event["stage"] in [
-                "error"
+                "error",
+                "cancelled",
             ]:
                 logger.info(
                     f"Closing WebSocket for task {self.task_id} due to status: {event['status']}",
-                    exc_info=True,
+                    extra={"task_id": str(self.task_id), "stage": event["stage"]},
                 )
                 await self.close()
         except Exception as e:
@@ -55,7 +99,8 @@ class DownloadProgressConsumer(AsyncWebsocketConsumer):
     async def websocket_close(self, event):
         try:
             logger.info(
-                f"WebSocket close requested for task {self.task_id}", exc_info=True
+                f"WebSocket close requested for task {self.task_id}",
+                extra={"task_id": str(self.task_id)},
             )
             await self.close()
         except Exception as e:
@@ -0,0 +1,47 @@
+"""
+Counts the database connections each Celery task opens and logs the count
+with event "db" when the task ends. With connection reuse in place a warm
+worker process should report 0 for almost every task.
+"""
+
+import threading
+
+from celery.signals import task_postrun, task_prerun
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_opened = 0
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    global _opened
+    with _lock:
+        _opened += 1
+
+
+@task_prerun.connect
+def reset_count(**kwargs):
+    global _opened
+    with _lock:
+        _opened = 0
+
+
+@task_postrun.connect
+def log_count(task_id=None, task=None, **kwargs):
+    with _lock:
+        opened = _opened
+    logger.info(
+        f"Task {task.name} opened {opened} database connections",
+        extra={
+            "event": "db",
+            "task_id": task_id,
+            "task_name": task.name,
+            "connections_opened": opened,
+        },
+    )
@@ -0,0 +1,143 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import StoredObject
+from .storage import shard_client
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+
+def eviction_score(obj, now, policy):
+    """
+    Higher scores are evicted first. Both policies weight by size, so one
+    large cold object goes before many small ones of the same coldness.
+    """
+    if policy == "lfu":
+        return obj.size / (obj.access_count + 1)
+    idle_seconds = max((now - obj.last_accessed_at).total_seconds(), 1)
+    return idle_seconds * obj.size
+
+
+def reconcile_bucket(shard):
+    """
+    Start tracking objects that exist in the shard's bucket but have no
+    StoredObject row yet, e.g. files uploaded before access tracking existed.
+    """
+    s3_client, bucket_name = shard_client(shard)
+    known = set(StoredObject.objects.values_list("key", flat=True))
+    added = 0
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for item in page.get("Contents", []):
+            key = item["Key"]
+            if key in known or key.startswith(settings.RETENTION_ARCHIVE_PREFIX):
+                continue
+            StoredObject.objects.get_or_create(
+                key=key,
+                defaults={
+                    "size": item["Size"],
+                    "shard": shard,
+                    "last_accessed_at": item["LastModified"],
+                },
+            )
+            added += 1
+    return added
+
+
+def select_victims(budget_bytes, policy, now=None):
+    """Return the objects to delete to bring tracked usage under ``budget_bytes``."""
+    now = now or timezone.now()
+    used = StoredObject.objects.aggregate(total=Sum("size"))["total"] or 0
+    excess = used - budget_bytes
+    if excess <= 0:
+        return [], used
+
+    candidates = StoredObject.objects.filter(
+        Q(pinned_until__isnull=True) | Q(pinned_until__lt=now)
+    ).only("key", "shard", "size", "last_accessed_at", "access_count")
+    ranked = sorted(
+        candidates, key=lambda obj: eviction_score(obj, now, policy), reverse=True
+    )
+
+    victims = []
+    for obj in ranked:
+        if excess <= 0:
+            break
+        victims.append(obj)
+        excess -= obj.size
+    return victims, used
+
+
+def evict(budget_bytes=None, policy=None, dry_run=False, reconcile=False):
+    budget_bytes = (
+        settings.STORAGE_BUDGET_BYTES if budget_bytes is None else budget_bytes
+    )
+    policy = policy or settings.STORAGE_EVICTION_POLICY
+    if policy not in EVICTION_POLICIES:
+        raise ValueError(f"Unknown eviction policy: {policy}")
+
+    if reconcile:
+        for shard in settings.STORAGE_SHARDS:
+            added = reconcile_bucket(shard)
+            logger.info(f"Started tracking {added} untracked objects in {shard}")
+
+    now = timezone.now()
+    victims, used = select_victims(budget_bytes, policy, now)
+    freed = 0
+    evicted = []
+    failed = []
+    for obj in victims:
+        if dry_run:
+            evicted.append(obj.key)
+            freed += obj.size
+            continue
+
+        # Only drop the row if nobody touched the object since it was ranked;
+        # a presigned URL issued in the meantime keeps it alive. The row is
+        # restored if the bucket refuses the delete, so the object stays
+        # tracked and is tried again on the next run.
+        try:
+            with transaction.atomic():
+                deleted, _ = (
+                    StoredObject.objects.filter(
+                        pk=obj.pk, last_accessed_at=obj.last_accessed_at
+                    )
+                    .filter(Q(pinned_until__isnull=True) | Q(pinned_until__lt=now))
+                    .delete()
+                )
+                if not deleted:
+                    continue
+                s3_client, bucket_name = shard_client(obj.shard)
+                s3_client.delete_object(Bucket=bucket_name, Key=obj.key)
+        except Exception as e:
+            logger.error(f"Could not evict {obj.key} from {obj.shard}: {e}")
+            failed.append(obj.key)
+            continue
+        evicted.append(obj.key)
+        freed += obj.size
+
+    summary = {
+        "policy": policy,
+        "budget_bytes": budget_bytes,
+        "used_bytes": used,
+        "freed_bytes": freed,
+        "evicted": evicted,
+        "failed": failed,
+        "dry_run": dry_run,
+    }
+    logger.info(
+        f"Storage eviction ({policy}) freed {freed} bytes from {len(evicted)} objects"
+    )
+    return summary
+
+
+@shared_task
+def evict_stored_objects():
+    """Keep the bucket under STORAGE_BUDGET_BYTES by evicting cold objects."""
+    return evict(reconcile=settings.STORAGE_EVICTION_RECONCILE)
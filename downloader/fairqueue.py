@@ -0,0 +1,344 @@
+"""
+Per-client fair queuing in front of the Celery queue.
+
+start_download parks each task in its client's own Redis list instead of
+sending it to Celery. dispatch() hands tasks over only while worker slots
+are free, so nothing piles up in the broker behind a heavy submitter.
+
+The next task comes from the client with the lowest virtual time. Each
+dispatch charges the client the expected service time of the job divided by
+its weight, so a client with a playlist of long 4K jobs gets its share and
+no more. A client never has more than FAIR_QUEUE_CLIENT_CONCURRENCY tasks
+dispatched at once.
+
+dispatch() runs after every submission, whenever a task finishes, and from
+beat as a fallback. With DOWNLOAD_WORKER_MODE "asyncio", full downloads go
+to the I/O workers' list (see downloader.aioworker) instead of Celery.
+"""
+
+import hmac
+import json
+import threading
+
+import redis
+from celery import shared_task
+from django.conf import settings
+from . import admission
+from .cancellation import ACTIVE_STATUSES
+from .models import DownloadTask
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TASK_NAME = "downloader.tasks.download_video"
+CLIENTS_KEY = "fair:clients"  # zset of clients with pending tasks by virtual time
+RUNNING_CLIENTS_KEY = "fair:running_clients"
+CLOCK_KEY = "fair:clock"
+LOCK_KEY = "fair:dispatch_lock"
+IO_QUEUE_KEY = "fair:io"  # dispatched tasks for the asyncio I/O workers
+
+# Queue a task; a client that had nothing pending starts at the current
+# virtual time, so idle periods do not bank credit
+ENQUEUE_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[2])
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    redis.call('ZADD', KEYS[2], tonumber(redis.call('GET', KEYS[3]) or '0'), ARGV[1])
+end
+"""
+
+# Pop a client's next task and advance its virtual time by the task's cost.
+# Done in one step so a concurrent enqueue cannot strand a client's list.
+POP_SCRIPT = """
+local entry = redis.call('LPOP', KEYS[1])
+if not entry then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    return nil
+end
+local start = tonumber(redis.call('ZSCORE', KEYS[2], ARGV[1]) or '0')
+redis.call('SET', KEYS[3], start)
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+else
+    redis.call('ZADD', KEYS[2], start + cjson.decode(entry)['cost'], ARGV[1])
+end
+return entry
+"""
+
+_redis_client = None
+_scripts = {}
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.TASK_STATE_REDIS_URL, decode_responses=True
+        )
+    return _redis_client
+
+
+def script(source):
+    if source not in _scripts:
+        _scripts[source] = get_redis().register_script(source)
+    return _scripts[source]
+
+
+def pending_key(client_id):
+    return f"fair:pending:{client_id}"
+
+
+def running_key(client_id):
+    return f"fair:running:{client_id}"
+
+
+def client_identity(request):
+    """
+    The name of a known API key if the request has one, otherwise the client
+    address. An unknown key counts for nothing, or anyone could get a fresh
+    queue per request by making keys up.
+    """
+    api_key = request.headers.get("X-API-Key", "")
+    for name, known_key in settings.FAIR_QUEUE_API_KEYS.items():
+        if api_key and hmac.compare_digest(api_key, known_key):
+            return f"key:{name}"
+    return f"ip:{client_address(request)}"
+
+
+def client_address(request):
+    """
+    The visitor's address as reported by the trusted proxies in front of us,
+    not the Cloudflare edge or nginx that forwarded the request.
+    """
+    if settings.FAIR_QUEUE_CLIENT_IP_HEADER:
+        address = request.headers.get(settings.FAIR_QUEUE_CLIENT_IP_HEADER, "")
+        if address.strip():
+            return address.strip()
+    # Each trusted proxy appends the address it saw to X-Forwarded-For
+    forwarded = [
+        hop.strip()
+        for hop in request.headers.get("X-Forwarded-For", "").split(",")
+        if hop.strip()
+    ]
+    hops = settings.FAIR_QUEUE_PROXY_HOPS
+    if hops and forwarded:
+        return forwarded[-min(hops, len(forwarded))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def weight(client_id):
+    return float(settings.FAIR_QUEUE_WEIGHTS.get(client_id, 1.0))
+
+
+def runs_on_io_worker(task):
+    """Clips and progressive streams are produced by ffmpeg end to end."""
+    return (
+        settings.DOWNLOAD_WORKER_MODE == "asyncio"
+        and not task.progressive
+        and task.clip_start is None
+    )
+
+
+def capacity_key(worker_id):
+    """Advertised capacity of an I/O worker, refreshed while it is alive."""
+    return f"io:worker:{worker_id}"
+
+
+def celery_capacity_key(hostname):
+    """Advertised pool size of a Celery worker, refreshed while it is alive."""
+    return f"celery:worker:{hostname}"
+
+
+def advertised_slots(pattern):
+    client = get_redis()
+    keys = list(client.scan_iter(pattern))
+    if not keys:
+        return 0
+    return sum(int(capacity) for capacity in client.mget(keys) if capacity)
+
+
+def io_worker_slots():
+    """Concurrent downloads the live I/O workers accept in total."""
+    return advertised_slots(capacity_key("*"))
+
+
+def celery_worker_slots():
+    """Prefork slots of the live Celery workers in total."""
+    return advertised_slots(celery_capacity_key("*"))
+
+
+class CapacityBeacon:
+    """
+    Advertises a Celery worker's pool size from a daemon thread in the worker's
+    main process, as the I/O workers do from their event loop. The key expires
+    HEARTBEAT_TIMEOUT after the worker stops refreshing it.
+    """
+
+    def __init__(self, hostname, slots, interval=None):
+        self.key = celery_capacity_key(hostname)
+        self.slots = slots
+        self.interval = settings.HEARTBEAT_INTERVAL if interval is None else interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def beat(self):
+        try:
+            get_redis().set(self.key, self.slots, ex=int(settings.HEARTBEAT_TIMEOUT))
+        except redis.RedisError as e:
+            logger.info(f"Could not advertise worker capacity: {e}")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.beat()
+
+    def start(self):
+        self.beat()
+        self._thread = threading.Thread(
+            target=self._run, name="capacity-beacon", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            get_redis().delete(self.key)
+        except redis.RedisError as e:
+            logger.info(f"Could not withdraw worker capacity: {e}")
+
+
+def enqueue(task, original_payload):
+    """Park ``task`` in its client's queue; dispatch() sends it to Celery."""
+    times = admission.service_times()
+    entry = {
+        "task_id": str(task.id),
+        "payload": original_payload,
+        "cost": times.get(task.resolution, times["*"]) / weight(task.client_id),
+        "io": runs_on_io_worker(task),
+    }
+    script(ENQUEUE_SCRIPT)(
+        keys=[pending_key(task.client_id), CLIENTS_KEY, CLOCK_KEY],
+        args=[task.client_id, json.dumps(entry)],
+    )
+
+
+def running_total(client):
+    clients = client.smembers(RUNNING_CLIENTS_KEY)
+    if not clients:
+        return 0
+    pipe = client.pipeline(transaction=False)
+    for client_id in clients:
+        pipe.scard(running_key(client_id))
+    return sum(pipe.execute())
+
+
+def dispatch():
+    """
+    Send queued tasks to Celery while worker slots are free. Returns how many
+    were sent; 0 if another process is dispatching right now.
+    """
+    from youtube_downloader.celery import app
+
+    client = get_redis()
+    lock = client.lock(LOCK_KEY, timeout=30)
+    if not lock.acquire(blocking=False):
+        return 0
+
+    sent = 0
+    try:
+        free = admission.worker_slots() - running_total(client)
+        capped = set()
+        while free > 0:
+            client_id = None
+            for candidate in client.zrange(CLIENTS_KEY, 0, -1):
+                if candidate in capped:
+                    continue
+                if (
+                    client.scard(running_key(candidate))
+                    >= settings.FAIR_QUEUE_CLIENT_CONCURRENCY
+                ):
+                    capped.add(candidate)
+                    continue
+                client_id = candidate
+                break
+            if client_id is None:
+                break
+
+            # Restored if the task can't be sent, so a failure costs no place
+            score = client.zscore(CLIENTS_KEY, client_id)
+            raw = script(POP_SCRIPT)(
+                keys=[pending_key(client_id), CLIENTS_KEY, CLOCK_KEY], args=[client_id]
+            )
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+
+            pipe = client.pipeline()
+            pipe.sadd(running_key(client_id), entry["task_id"])
+            pipe.sadd(RUNNING_CLIENTS_KEY, client_id)
+            pipe.execute()
+            try:
+                if entry.get("io"):
+                    client.lpush(IO_QUEUE_KEY, raw)
+                else:
+                    # The DownloadTask id doubles as the Celery task id for revoking
+                    app.send_task(
+                        DOWNLOAD_TASK_NAME,
+                        (entry["task_id"], entry["payload"]),
+                        task_id=entry["task_id"],
+                    )
+            except Exception:
+                # Put it back at the head of the client's queue and retry later
+                client.srem(running_key(client_id), entry["task_id"])
+                client.lpush(pending_key(client_id), raw)
+                client.zadd(CLIENTS_KEY, {client_id: score})
+                raise
+            sent += 1
+            free -= 1
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass
+    return sent
+
+
+def release(task_id, client_id):
+    """A dispatched task finished; free its client's slot."""
+    client = get_redis()
+    client.srem(running_key(client_id), str(task_id))
+
+
+def backlog():
+    """Tasks waiting in client queues, not yet sent to Celery."""
+    client = get_redis()
+    clients = client.zrange(CLIENTS_KEY, 0, -1)
+    if not clients:
+        return 0
+    pipe = client.pipeline(transaction=False)
+    for client_id in clients:
+        pipe.llen(pending_key(client_id))
+    return sum(pipe.execute())
+
+
+@shared_task
+def dispatch_fair_queue():
+    """
+    Fallback for missed dispatches. Drops slots held by tasks that finished
+    without releasing them (e.g. a killed worker), then dispatches.
+    """
+    client = get_redis()
+    for client_id in client.smembers(RUNNING_CLIENTS_KEY):
+        task_ids = client.smembers(running_key(client_id))
+        if not task_ids:
+            client.srem(RUNNING_CLIENTS_KEY, client_id)
+            continue
+        active = {
+            str(task_id)
+            for task_id in DownloadTask.objects.filter(
+                id__in=task_ids, status__in=ACTIVE_STATUSES
+            ).values_list("id", flat=True)
+        }
+        stale = task_ids - active
+        if stale:
+            client.srem(running_key(client_id), *stale)
+    return dispatch()
@@ -0,0 +1,46 @@
+"""
+ffmpeg merges of the asyncio I/O worker, run in a spawned process pool.
+
+A spawned child starts with a fresh interpreter and imports this module to
+unpickle the job, before the initializer has set Django up. Nothing here may
+import models, or modules that do, at load time.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+
+def process_pool(processes):
+    # spawn, forking a process with live threads and sockets is not safe
+    return ProcessPoolExecutor(
+        processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=setup_process,
+        initargs=(settings.DATABASES,),
+    )
+
+
+def setup_process(databases):
+    """
+    Pool initializer. Children connect to the same databases as the worker
+    that started them, whatever settings it ended up with.
+    """
+    import django
+
+    settings.DATABASES = databases
+    django.setup()
+
+
+def run_ffmpeg_job(cmd, task_id, metadata):
+    """Runs in the ffmpeg process pool; progress is sent from there."""
+    from channels.layers import get_channel_layer
+    from .cancellation import CancellationToken
+    from .models import DownloadTask
+    from .tasks import run_ffmpeg_with_progress
+
+    task = DownloadTask.objects.get(id=task_id)
+    return run_ffmpeg_with_progress(
+        cmd, task, get_channel_layer(), metadata, CancellationToken(task_id)
+    )
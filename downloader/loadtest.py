@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import resource
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from channels.layers import get_channel_layer
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def rss_bytes(pid=None):
+    """Current resident set size of ``pid`` (default: this process)."""
+    path = f"/proc/{pid or 'self'}/status"
+    if os.path.exists(path):
+        with open(path) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    # Not Linux: fall back to the peak RSS of this process
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+@dataclass
+class Subscriber:
+    task_id: str
+    received: set = field(default_factory=set)
+    latencies: list = field(default_factory=list)
+    connected: bool = False
+
+    def record(self, text, received_at):
+        event = json.loads(text)
+        probe = (event.get("metadata") or {}).get("loadtest")
+        if not probe:
+            # e.g. the initial state message sent on connect
+            return
+        self.received.add(probe["seq"])
+        self.latencies.append(received_at - probe["sent_at"])
+
+
+class InProcessConnection:
+    """A subscriber driven through the ASGI application inside this process."""
+
+    def __init__(self, application, task_id):
+        from channels.testing import WebsocketCommunicator
+
+        self.communicator = WebsocketCommunicator(
+            application, f"/ws/download/{task_id}/"
+        )
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        return connected
+
+    async def receive(self, timeout):
+        return await self.communicator.receive_from(timeout=timeout)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class RemoteConnection:
+    """A subscriber on a real socket to a running Daphne server."""
+
+    def __init__(self, session, base_url, task_id):
+        self.session = session
+        self.url = f"{base_url.rstrip('/')}/ws/download/{task_id}/"
+        self.socket = None
+
+    async def connect(self):
+        self.socket = await self.session.ws_connect(self.url, heartbeat=None)
+        return True
+
+    async def receive(self, timeout):
+        import aiohttp
+
+        message = await self.socket.receive(timeout=timeout)
+        if message.type != aiohttp.WSMsgType.TEXT:
+            raise ConnectionError(f"Socket closed: {message.type}")
+        return message.data
+
+    async def close(self):
+        await self.socket.close()
+
+
+class ProgressFanoutLoadTest:
+    """
+    Opens ``tasks * subscribers_per_task`` progress sockets, publishes
+    ``events_per_task`` synthetic progress events per task through the
+    channel layer at ``rate`` events per second per task, and reports
+    delivery latency percentiles, dropped messages and memory per connection.
+    """
+
+    def __init__(
+        self,
+        tasks=100,
+        subscribers_per_task=10,
+        events_per_task=50,
+        rate=5.0,
+        target=None,
+        server_pid=None,
+        connect_concurrency=200,
+        drain_timeout=5.0,
+    ):
+        self.tasks = tasks
+        self.subscribers_per_task = subscribers_per_task
+        self.events_per_task = events_per_task
+        self.rate = rate
+        self.target = target
+        self.server_pid = server_pid
+        self.connect_concurrency = connect_concurrency
+        self.drain_timeout = drain_timeout
+        self.connect_failures = 0
+
+    async def run(self):
+        task_ids = [str(uuid.uuid4()) for _ in range(self.tasks)]
+        subscribers = [
+            Subscriber(task_id)
+            for task_id in task_ids
+            for _ in range(self.subscribers_per_task)
+        ]
+
+        session = None
+        if self.target:
+            import aiohttp
+
+            session = aiohttp.ClientSession()
+            factory = lambda task_id: RemoteConnection(session, self.target, task_id)
+        else:
+            from youtube_downloader.asgi import application
+
+            factory = lambda task_id: InProcessConnection(application, task_id)
+
+        rss_before = rss_bytes(self.server_pid)
+        started = time.perf_counter()
+        connections = await self.connect_all(subscribers, factory)
+        connect_seconds = time.perf_counter() - started
+        rss_after = rss_bytes(self.server_pid)
+
+        readers = [
+            asyncio.create_task(self.read(subscriber, connection))
+            for subscriber, connection in connections
+        ]
+        publish_started = time.perf_counter()
+        await asyncio.gather(*(self.publish(task_id) for task_id in task_ids))
+        publish_seconds = time.perf_counter() - publish_started
+        await asyncio.gather(*readers, return_exceptions=True)
+
+        await asyncio.gather(
+            *(connection.close() for _, connection in connections),
+            return_exceptions=True,
+        )
+        if session is not None:
+            await session.close()
+
+        return self.report(
+            subscribers, connect_seconds, publish_seconds, rss_before, rss_after
+        )
+
+    async def connect_all(self, subscribers, factory):
+        gate = asyncio.Semaphore(self.connect_concurrency)
+
+        async def open_one(subscriber):
+            async with gate:
+                connection = factory(subscriber.task_id)
+                try:
+                    subscriber.connected = await connection.connect()
+                except Exception as e:
+                    logger.info(f"Connect failed: {e}")
+                    subscriber.connected = False
+                if not subscriber.connected:
+                    self.connect_failures += 1
+                    return None
+                return subscriber, connection
+
+        opened = await asyncio.gather(*(open_one(s) for s in subscribers))
+        return [pair for pair in opened if pair is not None]
+
+    async def publish(self, task_id):
+        channel_layer = get_channel_layer()
+        interval = 1.0 / self.rate if self.rate else 0
+        for seq in range(self.events_per_task):
+            await channel_layer.group_send(
+                f"task_{task_id}",
+                {
+                    "type": "progress.update",
+                    "stage": "downloading_video",
+                    "status": "in_progress",
+                    "task_id": task_id,
+                    "progress": 100 * seq / self.events_per_task,
+                    "download_url": None,
+                    "error_message": None,
+                    "metadata": {"loadtest": {"seq": seq, "sent_at": time.time()}},
+                },
+            )
+            if interval:
+                await asyncio.sleep(interval)
+
+    async def read(self, subscriber, connection):
+        while len(subscriber.received) < self.events_per_task:
+            try:
+                text = await connection.receive(timeout=self.drain_timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                return
+            subscriber.record(text, time.time())
+
+    def report(self, subscribers, connect_seconds, publish_seconds, before, after):
+        latencies = sorted(
+            latency for subscriber in subscribers for latency in subscriber.latencies
+        )
+        connected = [s for s in subscribers if s.connected]
+        expected = len(connected) * self.events_per_task
+        delivered = sum(len(s.received) for s in connected)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        return {
+            "target": self.target or "in-process",
+            "connections": len(connected),
+            "connect_failures": self.connect_failures,
+            "connect_seconds": round(connect_seconds, 2),
+            "events_published": self.tasks * self.events_per_task,
+            "publish_seconds": round(publish_seconds, 2),
+            "messages_expected": expected,
+            "messages_delivered": delivered,
+            "messages_dropped": expected - delivered,
+            "latency_ms": {
+                "p50": ms(percentile(latencies, 0.50)),
+                "p90": ms(percentile(latencies, 0.90)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "max": ms(latencies[-1] if latencies else None),
+            },
+            "rss_bytes_per_connection": (
+                round((after - before) / len(connected)) if connected else None
+            ),
+        }
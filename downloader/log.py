@@ -0,0 +1,136 @@
+"""
+Logging plumbing configured from settings.LOGGING.
+
+Records are formatted as one JSON object per line. Handlers run on a
+background QueueListener thread, so emitting a record only costs a queue
+put on the event loop or download thread. Progress records are sampled
+per task; stage changes, warnings and errors always get through.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+RESERVED_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+    "message",
+    "asctime",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ProgressSampleFilter(logging.Filter):
+    """
+    Lets through at most one ``event="progress"`` record per task every
+    ``interval`` seconds. The first record of a new stage for a task and any
+    record at WARNING or above always pass; other records are untouched.
+    """
+
+    def __init__(self, interval=5.0, max_tasks=10000):
+        super().__init__()
+        self.interval = float(interval)
+        self.max_tasks = max_tasks
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if getattr(record, "event", None) != "progress":
+            return True
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = getattr(record, "task_id", None)
+        stage = getattr(record, "stage", None)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._last.get(key)
+            if previous and previous[0] == stage and now - previous[1] < self.interval:
+                return False
+            self._last[key] = (stage, now)
+            self._last.move_to_end(key)
+            if len(self._last) > self.max_tasks:
+                self._last.popitem(last=False)
+        return True
+
+
+class NonBlockingHandler(QueueHandler):
+    """
+    QueueHandler that owns a QueueListener writing JSON lines to ``stream``.
+    Formatting and I/O happen on the listener thread.
+
+    The listener starts with the first record of each process. A forked
+    child, such as a Celery prefork worker, has no copy of its parent's
+    thread, so it gets a queue of its own and starts its own listener.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.target.setFormatter(JsonFormatter())
+        self.listener = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent's listener and anything it still had queued stay there
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self.listener is None:
+                listener = QueueListener(
+                    self.queue, self.target, respect_handler_level=False
+                )
+                listener.start()
+                self.listener = listener
+
+    def stop(self):
+        """Write out what is queued and stop this process's listener."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def enqueue(self, record):
+        if self.listener is None:
+            self.start()
+        super().enqueue(record)
+
+    def prepare(self, record):
+        # Resolve the message and traceback here; both may reference objects
+        # that change once the caller moves on. Keep the ``extra`` fields.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
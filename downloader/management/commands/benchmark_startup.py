@@ -0,0 +1,80 @@
+import json
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+# Each role's startup, run in a fresh interpreter. The probe reports wall
+# time, RSS and which heavy libraries ended up loaded. The worker probe builds
+# a real WorkController, which sends worker_init, then initialises a prefork
+# child in the same process, which sends worker_process_init. It stops short
+# of connecting to the broker.
+ROLE_IMPORTS = {
+    "web": (
+        "import django; django.setup()\n"
+        "import youtube_downloader.asgi\n"
+        "from django.urls import get_resolver; get_resolver().url_patterns\n"
+    ),
+    "worker": (
+        "from youtube_downloader.celery import app\n"
+        "from celery.concurrency.prefork import process_initializer\n"
+        "worker = app.WorkController(hostname='probe@localhost', concurrency=1)\n"
+        "process_initializer(app, worker.hostname)\n"
+    ),
+    "flower": (
+        "from youtube_downloader.celery import app\n"
+        "app.loader.import_default_modules()\n"
+        "import flower.app\n"
+    ),
+}
+
+PROBE = """
+import json, os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "youtube_downloader.settings")
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+rss = 0
+with open("/proc/self/status") as status:
+    for line in status:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+heavy = ["boto3", "botocore", "s3transfer", "pytubefix", "aiohttp"]
+print(json.dumps({{
+    "startup_seconds": round(elapsed, 3),
+    "rss_mb": round(rss / 2**20, 1),
+    "modules": len(sys.modules),
+    "heavy_loaded": [name for name in heavy if name in sys.modules],
+}}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure startup time and RSS of the web, worker and flower roles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--role", choices=sorted(ROLE_IMPORTS), action="append", dest="roles"
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        results = {}
+        for role in options["roles"] or sorted(ROLE_IMPORTS):
+            probe = PROBE.format(imports=ROLE_IMPORTS[role])
+            runs = []
+            for _ in range(options["repeat"]):
+                output = subprocess.run(
+                    [sys.executable, "-c", probe],
+                    capture_output=True,
+                    text=True,
+                )
+                if output.returncode != 0:
+                    self.stderr.write(output.stderr)
+                    break
+                runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+            if not runs:
+                continue
+            best = min(runs, key=lambda run: run["startup_seconds"])
+            results[role] = best
+        self.stdout.write(json.dumps(results, indent=2))
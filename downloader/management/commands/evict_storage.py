@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+from downloader.eviction import EVICTION_POLICIES, evict
+
+
+class Command(BaseCommand):
+    help = (
+        "Evict cold objects from the storage bucket until it fits the size budget. "
+        "Works against any S3-compatible endpoint, e.g. a local MinIO."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--budget", type=int, help="Budget in bytes.")
+        parser.add_argument("--policy", choices=EVICTION_POLICIES)
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            help="Track objects found in the bucket but not in the database first.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be evicted.",
+        )
+
+    def handle(self, *args, **options):
+        summary = evict(
+            budget_bytes=options["budget"],
+            policy=options["policy"],
+            dry_run=options["dry_run"],
+            reconcile=options["reconcile"],
+        )
+        self.stdout.write(json.dumps(summary, indent=2))
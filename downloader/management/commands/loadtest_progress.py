@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from django.core.management.base import BaseCommand, CommandError
+from downloader.loadtest import ProgressFanoutLoadTest
+
+
+class Command(BaseCommand):
+    help = (
+        "Open many ws/download/<task_id>/ subscribers, publish synthetic progress "
+        "events through the channel layer and report delivery latency, drops "
+        "and memory per connection."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, default=100)
+        parser.add_argument("--subscribers-per-task", type=int, default=10)
+        parser.add_argument("--events-per-task", type=int, default=50)
+        parser.add_argument(
+            "--rate", type=float, default=5.0, help="Events per second per task."
+        )
+        parser.add_argument(
+            "--target",
+            help="Base URL of a running server, e.g. ws://localhost:8000. "
+            "Without it the ASGI application is driven in-process.",
+        )
+        parser.add_argument(
+            "--layer",
+            choices=["configured", "memory"],
+            default="configured",
+            help="Channel layer to publish through; 'memory' is in-process only.",
+        )
+        parser.add_argument(
+            "--server-pid",
+            type=int,
+            help="PID of the Daphne process to measure RSS for (same host).",
+        )
+        parser.add_argument("--connect-concurrency", type=int, default=200)
+        parser.add_argument("--drain-timeout", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        if options["layer"] == "memory":
+            if options["target"]:
+                raise CommandError("The in-memory layer cannot reach a remote server.")
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+
+        load_test = ProgressFanoutLoadTest(
+            tasks=options["tasks"],
+            subscribers_per_task=options["subscribers_per_task"],
+            events_per_task=options["events_per_task"],
+            rate=options["rate"],
+            target=options["target"],
+            server_pid=options["server_pid"],
+            connect_concurrency=options["connect_concurrency"],
+            drain_timeout=options["drain_timeout"],
+        )
+        self.stdout.write(json.dumps(asyncio.run(load_test.run()), indent=2))
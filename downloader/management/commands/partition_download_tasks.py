@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from downloader.models import DownloadTask
+from downloader.retention import (
+    add_months,
+    create_partition,
+    ensure_partitions,
+    is_partitioned,
+    month_start,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the DownloadTask table into a PostgreSQL table range-partitioned "
+        "by month on created_at, so the retention job can drop old months whole."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.RETENTION_PARTITION_MONTHS_AHEAD,
+            help="Number of future monthly partitions to create.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported on PostgreSQL.")
+        if is_partitioned():
+            ensure_partitions(options["months_ahead"])
+            self.stdout.write("Table is already partitioned; partitions refreshed.")
+            return
+
+        table = DownloadTask._meta.db_table
+        legacy = f"{table}_legacy"
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(
+                "SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+                "AND indexname <> %s",
+                [table, f"{table}_pkey"],
+            )
+            index_defs = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'SELECT MIN(created_at) FROM "{table}"')
+            oldest = cursor.fetchone()[0]
+
+            cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+            cursor.execute(
+                f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS) '
+                "PARTITION BY RANGE (created_at)"
+            )
+            # A partitioned table's primary key has to include the partition key.
+            cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, created_at)')
+            cursor.execute(
+                f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT'
+            )
+
+            # Create every monthly partition before copying the rows, so none of
+            # them land in the default partition.
+            current = month_start(oldest or timezone.now())
+            last = add_months(month_start(timezone.now()), options["months_ahead"])
+            while current <= last:
+                create_partition(cursor, current)
+                current = add_months(current, 1)
+
+            cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{legacy}"')
+            cursor.execute(f'DROP TABLE "{legacy}"')
+            for index_def in index_defs:
+                cursor.execute(index_def)
+
+        self.stdout.write(self.style.SUCCESS(f"Partitioned {table} by month."))
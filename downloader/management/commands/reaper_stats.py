@@ -0,0 +1,11 @@
+import json
+
+from django.core.management.base import BaseCommand
+from downloader.reaper import reaper_stats
+
+
+class Command(BaseCommand):
+    help = "Show running task heartbeats and how many stuck tasks were reaped."
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(reaper_stats(), indent=2))
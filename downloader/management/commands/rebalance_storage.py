@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand
+from downloader.rebalance import rebalance
+
+
+class Command(BaseCommand):
+    help = (
+        "Move stored objects to the shard the consistent hash ring assigns them, "
+        "after adding a storage shard or changing shard weights."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Move at most this many objects.")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be moved.",
+        )
+
+    def handle(self, *args, **options):
+        summary = rebalance(limit=options["limit"], dry_run=options["dry_run"])
+        self.stdout.write(json.dumps(summary, indent=2))
@@ -0,0 +1,32 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+from downloader.aioworker import IOWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run downloads handed to the asyncio I/O worker (DOWNLOAD_WORKER_MODE "
+        "asyncio) until interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int)
+        parser.add_argument("--ffmpeg-processes", type=int)
+
+    def handle(self, *args, **options):
+        worker = IOWorker(
+            concurrency=options["concurrency"],
+            ffmpeg_processes=options["ffmpeg_processes"],
+        )
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, worker.stop)
+            await worker.run()
+
+        self.stdout.write("I/O worker started.")
+        asyncio.run(main())
+        self.stdout.write(f"I/O worker stopped: {dict(worker.stats)}")
@@ -0,0 +1,35 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+from downloader.webhooks import WebhookDispatcher
+
+
+class Command(BaseCommand):
+    help = "Deliver queued task completion webhooks until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int)
+        parser.add_argument("--per-host", type=int)
+        parser.add_argument(
+            "--name",
+            help="Identifies this dispatcher's in-progress list across restarts "
+            "(default: the hostname).",
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = WebhookDispatcher(
+            concurrency=options["concurrency"],
+            per_host=options["per_host"],
+            name=options["name"],
+        )
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, dispatcher.stop)
+            await dispatcher.run()
+
+        self.stdout.write("Webhook dispatcher started.")
+        asyncio.run(main())
+        self.stdout.write(f"Webhook dispatcher stopped: {dict(dispatcher.stats)}")
@@ -0,0 +1,11 @@
+import json
+
+from django.core.management.base import BaseCommand
+from downloader.uploads import upload_stats
+
+
+class Command(BaseCommand):
+    help = "Show throughput of recent uploads to the bucket and the current tuning."
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(upload_stats(), indent=2))
@@ -0,0 +1,21 @@
+# Generated by Django 5.1 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0004_downloadtask_file_size_downloadtask_stage_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='downloadtask',
+            index=models.Index(fields=['url', 'status'], name='downloadtask_url_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadtask',
+            index=models.Index(fields=['status', 'created_at'], name='downloadtask_status_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-19 17:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0005_downloadtask_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=1024, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('access_count', models.PositiveIntegerField(default=0)),
+                ('pinned_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
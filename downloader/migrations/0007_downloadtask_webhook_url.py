@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-19 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0006_storedobject'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='webhook_url',
+            field=models.URLField(blank=True, max_length=1024, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-19 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0007_downloadtask_webhook_url"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtask",
+            name="progressive",
+            field=models.BooleanField(default=False),
+        ),
+    ]
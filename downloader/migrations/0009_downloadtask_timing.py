@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-19 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0008_downloadtask_progressive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtask",
+            name="eta_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="downloadtask",
+            name="finished_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="downloadtask",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1 on 2026-10-19 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0009_downloadtask_timing"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="downloadtask",
+            name="stage",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("fetching_metadata", "Fetching Metadata"),
+                    ("downloading_video", "Downloading Video"),
+                    ("downloading_audio", "Downloading Audio"),
+                    ("merging", "Merging Video and Audio"),
+                    ("uploading", "Uploading to Storage"),
+                    ("completed", "Completed"),
+                    ("error", "Error"),
+                    ("cancelled", "Cancelled"),
+                ],
+                default="queued",
+                max_length=50,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="downloadtask",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("in_progress", "In Progress"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                    ("cancelled", "Cancelled"),
+                ],
+                default="pending",
+                max_length=50,
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0010_downloadtask_cancelled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtask",
+            name="clip_end",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="downloadtask",
+            name="clip_start",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="downloadtask",
+            name="frame_accurate",
+            field=models.BooleanField(default=False),
+        ),
+    ]
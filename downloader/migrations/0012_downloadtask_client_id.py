@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-19 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0011_downloadtask_clip"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtask",
+            name="client_id",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-19 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0012_downloadtask_client_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtask",
+            name="storage_shard",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="storedobject",
+            name="shard",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
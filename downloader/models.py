@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 
 
 class DownloadTask(models.Model):
@@ -8,6 +9,7 @@ class DownloadTask(models.Model):
         ("in_progress", "In Progress"),
         ("completed", "Completed"),
         ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
     ]
 
     STAGE_CHOICES = [
@@ -19,19 +21,44 @@ class DownloadTask(models.Model):
         ("uploading", "Uploading to Storage"),
         ("completed", "Completed"),
         ("error", "Error"),
+        ("cancelled", "Cancelled"),
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     url = models.URLField()
     resolution = models.CharField(max_length=18)
     include_audio = models.BooleanField(default=True)
+    # Serve the output while it is produced, see downloader.progressive
+    progressive = models.BooleanField(default=False)
+    # Only the [clip_start, clip_end) window in seconds, see downloader.clips
+    clip_start = models.FloatField(null=True, blank=True)
+    clip_end = models.FloatField(null=True, blank=True)
+    frame_accurate = models.BooleanField(default=False)
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default="pending")
     stage = models.CharField(max_length=50, choices=STAGE_CHOICES, default="queued")
     progress = models.FloatField(default=0.0)
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Estimated completion time from admission control at submission
+    eta_at = models.DateTimeField(null=True, blank=True)
     callback_url = models.URLField(null=True, blank=True)
+    webhook_url = models.URLField(max_length=1024, null=True, blank=True)
+    # API key hash or address of the submitter, see downloader.fairqueue
+    client_id = models.CharField(max_length=64, blank=True, default="")
     file = models.FileField(upload_to="downloads/", null=True, blank=True)
     file_size = models.BigIntegerField(null=True, blank=True)
+    # Storage shard holding ``file``, blank for the default bucket
+    storage_shard = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # Duplicate check in start_download and the retention sweep
+            models.Index(fields=["url", "status"], name="downloadtask_url_status_idx"),
+            models.Index(
+                fields=["status", "created_at"], name="downloadtask_status_ts_idx"
+            ),
+        ]
 
     def to_dict(
         self,
@@ -42,11 +69,37 @@ class DownloadTask(models.Model):
             "url": self.url,
             "resolution": self.resolution,
             "include_audio": self.include_audio,
+            "progressive": self.progressive,
+            "clip_start": self.clip_start,
+            "clip_end": self.clip_end,
+            "frame_accurate": self.frame_accurate,
             "status": self.status,
             "stage": self.stage,
             "progress": self.progress,
             "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "eta_at": self.eta_at,
             "callback_url": self.callback_url,
+            "webhook_url": self.webhook_url,
             "file": self.file.name,
             "file_size": self.file_size,
+            "storage_shard": self.storage_shard,
         }
+
+
+class StoredObject(models.Model):
+    """An output file in the storage bucket, with the access history used for eviction."""
+
+    key = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField(default=0)
+    # See settings.STORAGE_SHARDS; blank for the default bucket
+    shard = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    access_count = models.PositiveIntegerField(default=0)
+    # Objects being uploaded or behind a still-valid presigned URL are never evicted
+    pinned_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.key
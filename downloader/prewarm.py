@@ -0,0 +1,188 @@
+"""
+Pre-processing of popular videos during off-peak hours.
+
+Videos are ranked by how often they were requested over the last
+PREWARM_WINDOW_HOURS. The top PREWARM_TOP_N that are not already in storage
+are queued at the resolutions most requested for them. They go through the
+fair queue as their own client, so they only take idle worker slots. Each
+run stops at the CPU (expected processing seconds) and bandwidth (expected
+output bytes) budgets. start_download then answers later requests for these
+videos straight from storage.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db.models import Avg, Count
+from django.utils import timezone
+from . import admission, fairqueue
+from .cancellation import ACTIVE_STATUSES
+from .models import DownloadTask
+from .storage import find_stored_object
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def stored_output(url, resolution, include_audio):
+    """
+    The latest finished full download of this request whose output is still
+    in its bucket.
+    """
+    task = (
+        DownloadTask.objects.filter(
+            url=url,
+            status="completed",
+            resolution=resolution,
+            include_audio=include_audio,
+            clip_start__isnull=True,
+        )
+        .exclude(file="")
+        .order_by("-finished_at")
+        .first()
+    )
+    if task is None:
+        return None
+    # The row is not proof the object is still there, nor on the same shard
+    stored = find_stored_object(task.file.name)
+    if stored is None:
+        return None
+    task.storage_shard = stored[0]
+    return task
+
+
+def rank_candidates(now=None):
+    """
+    ``[(url, [(resolution, include_audio), ...]), ...]`` for the most
+    requested videos, most popular first.
+    """
+    now = now or timezone.now()
+    since = now - timedelta(hours=settings.PREWARM_WINDOW_HOURS)
+    rows = (
+        DownloadTask.objects.filter(created_at__gte=since, clip_start__isnull=True)
+        .exclude(client_id=settings.PREWARM_CLIENT_ID)
+        .values("url", "resolution", "include_audio")
+        .annotate(requests=Count("id"))
+    )
+
+    totals = defaultdict(int)
+    variants = defaultdict(list)
+    for row in rows:
+        totals[row["url"]] += row["requests"]
+        variants[row["url"]].append(
+            (row["requests"], row["resolution"], row["include_audio"])
+        )
+
+    ranked = sorted(totals, key=totals.get, reverse=True)[: settings.PREWARM_TOP_N]
+    return [
+        (
+            url,
+            [
+                (resolution, include_audio)
+                for _, resolution, include_audio in sorted(
+                    variants[url], key=lambda variant: variant[0], reverse=True
+                )[: settings.PREWARM_RESOLUTIONS_PER_VIDEO]
+            ],
+        )
+        for url in ranked
+        if totals[url] >= settings.PREWARM_MIN_REQUESTS
+    ]
+
+
+def expected_size(url, resolution, sizes):
+    """Output size from earlier runs of this video, else the resolution mean."""
+    size = (
+        DownloadTask.objects.filter(
+            url=url, resolution=resolution, file_size__isnull=False
+        )
+        .order_by("-finished_at")
+        .values_list("file_size", flat=True)
+        .first()
+    )
+    return size or sizes.get(resolution) or 0
+
+
+def workers_idle():
+    """Leave the run alone unless user work is fully served."""
+    if admission.queue_depth():
+        return False
+    in_progress = DownloadTask.objects.filter(status="in_progress").count()
+    return in_progress < admission.worker_slots() * settings.PREWARM_MAX_SLOT_SHARE
+
+
+def prewarm(dry_run=False):
+    if not workers_idle():
+        logger.info("Skipping pre-warming, workers are busy")
+        return {"queued": [], "skipped": "busy"}
+
+    times = admission.service_times()
+    sizes = dict(
+        DownloadTask.objects.filter(status="completed", file_size__isnull=False)
+        .values_list("resolution")
+        .annotate(mean=Avg("file_size"))
+    )
+    cpu_left = settings.PREWARM_CPU_SECONDS
+    bytes_left = settings.PREWARM_BANDWIDTH_BYTES
+    queued = []
+    skipped = None
+
+    variants = (
+        (url, resolution, include_audio)
+        for url, requested in rank_candidates()
+        for resolution, include_audio in requested
+    )
+    for url, resolution, include_audio in variants:
+        if stored_output(url, resolution, include_audio):
+            continue
+        if DownloadTask.objects.filter(
+            url=url,
+            resolution=resolution,
+            include_audio=include_audio,
+            clip_start__isnull=True,
+            status__in=ACTIVE_STATUSES,
+        ).exists():
+            continue
+
+        cpu = times.get(resolution, times["*"])
+        size = expected_size(url, resolution, sizes)
+        if cpu > cpu_left or size > bytes_left:
+            logger.info(f"Pre-warming budget used up after {len(queued)} tasks")
+            skipped = "budget"
+            break
+        cpu_left -= cpu
+        bytes_left -= size
+        queued.append({"url": url, "resolution": resolution})
+        if dry_run:
+            continue
+
+        task = DownloadTask.objects.create(
+            url=url,
+            resolution=resolution,
+            include_audio=include_audio,
+            client_id=settings.PREWARM_CLIENT_ID,
+            status="pending",
+            stage="queued",
+        )
+        fairqueue.enqueue(
+            task,
+            {
+                "url": url,
+                "resolution": resolution,
+                "include_audio": include_audio,
+            },
+        )
+
+    # Also after running out of budget, the tasks queued so far go out now
+    if queued and not dry_run:
+        fairqueue.dispatch()
+    logger.info(f"Queued {len(queued)} videos for pre-warming")
+    return {"queued": queued, "skipped": skipped}
+
+
+@shared_task
+def prewarm_popular_videos():
+    """Beat job, scheduled for the off-peak PREWARM_HOURS."""
+    return prewarm()
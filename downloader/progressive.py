@@ -0,0 +1,110 @@
+import asyncio
+import os
+import shlex
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .cancellation import touch
+from .models import DownloadTask
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FRAGMENTED_MP4_FLAGS = "-movflags frag_keyframe+empty_moov+default_base_moof"
+
+
+def scratch_path(task_id):
+    """Where the worker writes a progressive task's output while it is produced."""
+    os.makedirs(settings.PROGRESSIVE_SCRATCH_DIR, exist_ok=True)
+    return os.path.join(settings.PROGRESSIVE_SCRATCH_DIR, f"{task_id}.mp4")
+
+
+def done_marker(path):
+    return f"{path}.done"
+
+
+def build_stream_cmd(video_stream, audio_stream, output_filename):
+    """
+    FFmpeg command that reads the YouTube streams directly over HTTP and writes
+    a fragmented MP4, so every finished fragment is playable right away.
+    """
+    inputs = f"-i {shlex.quote(video_stream.url)}"
+    maps = "-map 0:v:0"
+    audio_args = ""
+    if audio_stream is not None:
+        inputs += f" -i {shlex.quote(audio_stream.url)}"
+        maps += " -map 1:a:0"
+        audio_args = "-c:a aac -b:a 128k -shortest"
+
+    # Avoid a re-encode when the source is already H.264
+    if (getattr(video_stream, "video_codec", "") or "").startswith("avc1"):
+        video_args = "-c:v copy"
+    else:
+        video_args = "-c:v libx264 -preset veryfast -crf 23"
+
+    return (
+        f"ffmpeg -y {inputs} {video_args} {audio_args} {maps} "
+        f"{FRAGMENTED_MP4_FLAGS} -f mp4 {shlex.quote(output_filename)}"
+    )
+
+
+async def stream_scratch_file(task_id):
+    """
+    Yield the scratch file as it grows and stop once the worker marks it done,
+    the task fails, or no new bytes arrive for PROGRESSIVE_IDLE_TIMEOUT.
+    """
+    path = scratch_path(task_id)
+    marker = done_marker(path)
+    loop = asyncio.get_running_loop()
+    interval = settings.PROGRESSIVE_POLL_INTERVAL
+    idle = 0.0
+
+    # The worker may still be fetching metadata when the client connects.
+    while not os.path.exists(path):
+        status = await task_status(task_id)
+        if (
+            status not in ("pending", "in_progress")
+            or idle >= settings.PROGRESSIVE_IDLE_TIMEOUT
+        ):
+            return
+        await asyncio.sleep(interval)
+        idle += interval
+
+    with open(path, "rb") as source:
+        idle = 0.0
+        while True:
+            chunk = await loop.run_in_executor(
+                None, source.read, settings.PROGRESSIVE_CHUNK_SIZE
+            )
+            if chunk:
+                idle = 0.0
+                yield chunk
+                continue
+
+            if os.path.exists(marker):
+                # Marker is written after ffmpeg exits; drain what is left.
+                while True:
+                    chunk = await loop.run_in_executor(
+                        None, source.read, settings.PROGRESSIVE_CHUNK_SIZE
+                    )
+                    if not chunk:
+                        return
+                    yield chunk
+            if await task_status(task_id) != "in_progress":
+                return
+            if idle >= settings.PROGRESSIVE_IDLE_TIMEOUT:
+                logger.info(f"Progressive stream for task {task_id} went idle")
+                return
+            await asyncio.sleep(interval)
+            idle += interval
+
+
+async def task_status(task_id):
+    # A client still reading the stream keeps the task from being abandoned
+    await sync_to_async(touch, thread_sensitive=False)(task_id)
+    return (
+        await DownloadTask.objects.filter(id=task_id)
+        .values_list("status", flat=True)
+        .afirst()
+    )
@@ -0,0 +1,332 @@
+"""
+Worker heartbeats and the reaper for tasks whose worker died.
+
+download_video beats every HEARTBEAT_INTERVAL seconds from a background
+thread while it runs. It records its scratch files and the key of the
+upload in progress next to the beat. A task whose last beat is older than
+HEARTBEAT_TIMEOUT had its worker killed. reap_stuck_tasks then:
+- removes the dead worker's scratch files, or leaves them to a worker on
+  the dead worker's host if that is another machine or container
+- aborts its multipart upload
+- frees its fair queue slot
+- re-queues the task, up to REAPER_MAX_REQUEUES times, and fails it after
+  that
+
+in_progress rows without any heartbeat, e.g. from before heartbeats existed,
+are reaped once they have been running for REAPER_UNTRACKED_AFTER seconds.
+"""
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from datetime import timedelta
+
+import redis
+from asgiref.sync import async_to_sync
+from celery import shared_task
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from . import fairqueue
+from .cancellation import STATE_TTL
+from .models import DownloadTask
+from .progressive import done_marker, scratch_path
+from .storage import abort_multipart_uploads, shard_client
+from .webhooks import enqueue_webhook
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEARTBEATS_KEY = "heartbeats"  # zset of running task ids by time of last beat
+STATS_KEY = "reaper:stats"
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.TASK_STATE_REDIS_URL, decode_responses=True
+        )
+    return _redis_client
+
+
+def worker_key(task_id):
+    return f"task:{task_id}:worker"
+
+
+def requeues_key(task_id):
+    return f"task:{task_id}:requeues"
+
+
+def orphans_key(host):
+    return f"reaper:orphans:{host}"
+
+
+class Heartbeat:
+    """
+    Beats for a running task from a daemon thread, so long downloads and
+    ffmpeg runs keep beating. The thread dies with the worker process.
+    """
+
+    def __init__(self, task_id, interval=None):
+        self.task_id = str(task_id)
+        self.interval = settings.HEARTBEAT_INTERVAL if interval is None else interval
+        self.paths = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def beat(self):
+        try:
+            pipe = get_redis().pipeline()
+            pipe.zadd(HEARTBEATS_KEY, {self.task_id: time.time()})
+            pipe.expire(worker_key(self.task_id), STATE_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Heartbeat for task {self.task_id} failed: {e}")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.beat()
+
+    def start(self):
+        try:
+            get_redis().hset(
+                worker_key(self.task_id),
+                mapping={"host": socket.gethostname(), "pid": os.getpid()},
+            )
+        except redis.RedisError as e:
+            logger.info(f"Could not register worker for task {self.task_id}: {e}")
+        self.beat()
+        self._thread = threading.Thread(
+            target=self._run, name=f"heartbeat-{self.task_id}", daemon=True
+        )
+        self._thread.start()
+
+    def track(self, *paths):
+        """Scratch files or directories the reaper removes if the worker dies."""
+        self.paths.extend(paths)
+        try:
+            get_redis().hset(worker_key(self.task_id), "paths", json.dumps(self.paths))
+        except redis.RedisError as e:
+            logger.info(f"Could not track scratch files of {self.task_id}: {e}")
+
+    def track_upload(self, key, shard):
+        try:
+            get_redis().hset(
+                worker_key(self.task_id), mapping={"upload_key": key, "shard": shard}
+            )
+        except redis.RedisError as e:
+            logger.info(f"Could not track upload of {self.task_id}: {e}")
+
+    def stop(self):
+        """Called once the task is over and its own cleanup has run."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        try:
+            pipe = get_redis().pipeline()
+            pipe.zrem(HEARTBEATS_KEY, self.task_id)
+            pipe.delete(worker_key(self.task_id))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.info(f"Could not clear heartbeat of task {self.task_id}: {e}")
+
+
+# --- Reaping ---
+
+
+def remove_scratch(paths):
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.info(f"Could not remove scratch file {path}: {e}")
+
+
+def sweep_orphans():
+    """
+    Remove the scratch files of dead workers on this host that a reaper on
+    another host could not reach. Runs when a worker starts and with every
+    reaper run.
+    """
+    key = orphans_key(socket.gethostname())
+    try:
+        client = get_redis()
+        paths = client.smembers(key)
+        if paths:
+            client.srem(key, *paths)
+    except redis.RedisError as e:
+        logger.info(f"Could not load orphaned scratch files: {e}")
+        return 0
+    remove_scratch(paths)
+    return len(paths)
+
+
+def notify(task, error_message=None):
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"task_{task.id}",
+            {
+                "type": "progress.update",
+                "stage": task.stage,
+                "status": task.status,
+                "task_id": str(task.id),
+                "progress": task.progress,
+                "download_url": None,
+                "error_message": error_message,
+                "metadata": None,
+            },
+        )
+    except Exception as e:
+        logger.info(f"Error sending reaper update to group: {e}")
+
+
+def reap(task_id, worker):
+    """
+    Clean up after the dead worker of ``task_id`` and re-queue or fail the
+    task. Returns "requeued", "failed" or None if the task was no longer
+    running.
+    """
+    client = get_redis()
+    paths = json.loads(worker.get("paths", "[]"))
+    host = worker.get("host")
+    if paths and host and host != socket.gethostname():
+        # Temp files only exist on the dead worker's host; its workers sweep them
+        pipe = client.pipeline()
+        pipe.sadd(orphans_key(host), *paths)
+        pipe.expire(orphans_key(host), STATE_TTL)
+        pipe.execute()
+        paths = []
+    task = DownloadTask.objects.filter(id=task_id).first()
+    # Progressive output is on the volume shared by all containers
+    if task is not None and task.progressive:
+        path = scratch_path(task_id)
+        paths += [path, done_marker(path)]
+    remove_scratch(paths)
+
+    if worker.get("upload_key"):
+        try:
+            abort_multipart_uploads(
+                worker["upload_key"], *shard_client(worker.get("shard"))
+            )
+        except Exception as e:
+            logger.info(f"Aborting the upload of task {task_id} failed: {e}")
+
+    if task is None:
+        return None
+    fairqueue.release(task_id, task.client_id)
+    if task.status != "in_progress":
+        return None
+
+    if client.incr(requeues_key(task_id)) <= settings.REAPER_MAX_REQUEUES:
+        client.expire(requeues_key(task_id), STATE_TTL)
+        # Conditional, a task that finished or was cancelled meanwhile stays
+        requeued = DownloadTask.objects.filter(id=task_id, status="in_progress").update(
+            status="pending", stage="queued", progress=0.0, started_at=None
+        )
+        if not requeued:
+            return None
+        task.refresh_from_db()
+        fairqueue.enqueue(
+            task,
+            {
+                "url": task.url,
+                "resolution": task.resolution,
+                "include_audio": task.include_audio,
+            },
+        )
+        notify(task)
+        return "requeued"
+
+    error_message = "The worker processing this task stopped responding"
+    failed = DownloadTask.objects.filter(id=task_id, status="in_progress").update(
+        status="failed", stage="error", finished_at=timezone.now()
+    )
+    if not failed:
+        return None
+    task.refresh_from_db()
+    notify(task, error_message)
+    enqueue_webhook(task, "task.failed", error_message=error_message)
+    return "failed"
+
+
+@shared_task
+def reap_stuck_tasks():
+    sweep_orphans()
+    client = get_redis()
+    expired = client.zrangebyscore(
+        HEARTBEATS_KEY, "-inf", time.time() - settings.HEARTBEAT_TIMEOUT
+    )
+    beating = set(client.zrange(HEARTBEATS_KEY, 0, -1))
+    untracked = [
+        str(task_id)
+        for task_id in DownloadTask.objects.filter(
+            status="in_progress",
+            started_at__lt=timezone.now()
+            - timedelta(seconds=settings.REAPER_UNTRACKED_AFTER),
+        ).values_list("id", flat=True)
+        if str(task_id) not in beating
+    ]
+
+    outcomes = {"requeued": 0, "failed": 0}
+    for task_id in expired + untracked:
+        # Only one reaper gets to remove the entry; untracked ones have none
+        if task_id in beating and not client.zrem(HEARTBEATS_KEY, task_id):
+            continue
+        worker = client.hgetall(worker_key(task_id))
+        client.delete(worker_key(task_id))
+        outcome = reap(task_id, worker)
+        if outcome:
+            outcomes[outcome] += 1
+            logger.warning(
+                f"Reaped stuck task {task_id} ({outcome}), "
+                f"last worker {worker.get('host', 'unknown')}",
+                extra={"event": "reaper", "task_id": task_id, "outcome": outcome},
+            )
+
+    pipe = client.pipeline()
+    for outcome, count in outcomes.items():
+        pipe.hincrby(STATS_KEY, f"{outcome}_total", count)
+    pipe.hset(STATS_KEY, "last_run", time.time())
+    pipe.execute()
+    if outcomes["requeued"]:
+        fairqueue.dispatch()
+
+    logger.info(
+        "Reaper run finished",
+        extra={
+            "event": "reaper",
+            "running": len(beating) - len(expired),
+            "stale": len(expired) + len(untracked),
+            **outcomes,
+        },
+    )
+    return outcomes
+
+
+def reaper_stats():
+    """Heartbeat and reaper counters, for dashboards."""
+    client = get_redis()
+    now = time.time()
+    stats = client.hgetall(STATS_KEY)
+    return {
+        "running": client.zcount(
+            HEARTBEATS_KEY, now - settings.HEARTBEAT_TIMEOUT, "+inf"
+        ),
+        "stale": client.zcount(
+            HEARTBEATS_KEY, "-inf", now - settings.HEARTBEAT_TIMEOUT
+        ),
+        "requeued_total": int(stats.get("requeued_total", 0)),
+        "failed_total": int(stats.get("failed_total", 0)),
+        "last_run": float(stats["last_run"]) if "last_run" in stats else None,
+    }
@@ -0,0 +1,127 @@
+"""
+Moves stored objects to the shard the hash ring assigns them now, after a
+shard was added or a weight changed. Only keys whose owner changed move,
+roughly the share of the weight that changed hands. To bring a shard in
+gradually, give it a small weight, rebalance, then raise it and repeat.
+
+A source copy that a presigned URL still points at is kept until the URL
+expires and deleted by the first run after that.
+"""
+
+import json
+import time
+from collections import Counter
+
+import redis
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import DownloadTask, StoredObject
+from .storage import DEFAULT_SHARD, shard_client, shard_for, shard_options
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# zset of [shard, key] source copies to delete, scored by when they may go
+LEFT_BEHIND_KEY = "rebalance:left_behind"
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.TASK_STATE_REDIS_URL, decode_responses=True
+        )
+    return _redis_client
+
+
+def same_account(source, target):
+    a, b = shard_options(source), shard_options(target)
+    return a["endpoint_url"] == b["endpoint_url"] and a["access_key"] == b["access_key"]
+
+
+def move_object(key, source, target):
+    """Copy ``key`` from ``source`` to ``target``; the source copy is kept."""
+    source_client, source_bucket = shard_client(source)
+    target_client, target_bucket = shard_client(target)
+    if same_account(source, target):
+        # Server-side copy, multipart for large objects
+        target_client.copy({"Bucket": source_bucket, "Key": key}, target_bucket, key)
+    else:
+        body = source_client.get_object(Bucket=source_bucket, Key=key)["Body"]
+        target_client.upload_fileobj(body, target_bucket, key)
+
+
+def delete_left_behind(dry_run=False):
+    """Delete kept source copies whose URLs have expired. Returns how many."""
+    client = get_redis()
+    deleted = 0
+    for member in client.zrangebyscore(LEFT_BEHIND_KEY, "-inf", time.time()):
+        shard, key = json.loads(member)
+        if dry_run:
+            deleted += 1
+            continue
+        # Moved back onto that shard since, the copy is live again
+        if not StoredObject.objects.filter(key=key, shard=shard).exists():
+            source_client, source_bucket = shard_client(shard)
+            source_client.delete_object(Bucket=source_bucket, Key=key)
+            deleted += 1
+        client.zrem(LEFT_BEHIND_KEY, member)
+    return deleted
+
+
+def rebalance(limit=None, dry_run=False):
+    now = timezone.now()
+    unpinned = Q(pinned_until__isnull=True) | Q(pinned_until__lt=now)
+    moves = Counter()
+    moved_bytes = 0
+    left_behind = []
+    deleted_left_behind = delete_left_behind(dry_run)
+
+    for obj in StoredObject.objects.filter(unpinned).only("key", "shard", "size"):
+        source = obj.shard or DEFAULT_SHARD
+        target = shard_for(obj.key)
+        if source == target:
+            continue
+        if limit is not None and sum(moves.values()) >= limit:
+            break
+        moves[f"{source}->{target}"] += 1
+        moved_bytes += obj.size
+        if dry_run:
+            continue
+
+        move_object(obj.key, source, target)
+        # Point new presigned URLs at the new copy before removing the old one
+        StoredObject.objects.filter(pk=obj.pk).update(shard=target)
+        DownloadTask.objects.filter(file=obj.key).update(storage_shard=target)
+
+        # A URL issued while copying still points at the source; keep it then
+        pinned_until = (
+            StoredObject.objects.filter(pk=obj.pk)
+            .values_list("pinned_until", flat=True)
+            .first()
+        )
+        if pinned_until is None or pinned_until < now:
+            source_client, source_bucket = shard_client(source)
+            source_client.delete_object(Bucket=source_bucket, Key=obj.key)
+        else:
+            get_redis().zadd(
+                LEFT_BEHIND_KEY,
+                {json.dumps([source, obj.key]): pinned_until.timestamp()},
+            )
+            left_behind.append(f"{source}:{obj.key}")
+
+    summary = {
+        "moves": dict(moves),
+        "moved_bytes": moved_bytes,
+        "left_behind": left_behind,
+        "deleted_left_behind": deleted_left_behind,
+        "dry_run": dry_run,
+    }
+    logger.info(
+        f"Storage rebalance moved {sum(moves.values())} objects ({moved_bytes} bytes)"
+    )
+    return summary
@@ -0,0 +1,222 @@
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django_celery_results.models import GroupResult, TaskResult
+from .cancellation import ACTIVE_STATUSES
+from .models import DownloadTask
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ["completed", "failed", "cancelled"]
+ARCHIVE_FIELDS = [
+    "id",
+    "url",
+    "resolution",
+    "include_audio",
+    "progressive",
+    "clip_start",
+    "clip_end",
+    "frame_accurate",
+    "status",
+    "stage",
+    "progress",
+    "created_at",
+    "started_at",
+    "finished_at",
+    "callback_url",
+    "webhook_url",
+    "client_id",
+    "file",
+    "file_size",
+    "storage_shard",
+]
+
+
+def archive_rows(rows, label):
+    """
+    Write rows as gzipped JSON lines to the default storage and return the key.
+    """
+    buffer = "".join(json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows)
+    key = f"{settings.RETENTION_ARCHIVE_PREFIX}/{timezone.now():%Y/%m/%d}/{label}.jsonl.gz"
+    return default_storage.save(key, ContentFile(gzip.compress(buffer.encode())))
+
+
+def purge_in_batches(queryset, batch_size, archive=False):
+    """
+    Delete the rows of ``queryset`` one primary-key batch at a time, so each
+    transaction only holds row locks for ``batch_size`` rows.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+
+        batch = queryset.model.objects.filter(pk__in=ids)
+        if archive:
+            rows = list(batch.order_by("created_at").values(*ARCHIVE_FIELDS))
+            archive_rows(rows, f"{rows[0]['created_at']:%Y%m%dT%H%M%S}_{rows[0]['id']}")
+
+        with transaction.atomic():
+            count, _ = batch.delete()
+        deleted += count
+
+        if settings.RETENTION_BATCH_PAUSE:
+            time.sleep(settings.RETENTION_BATCH_PAUSE)
+
+
+# --- Partition maintenance (only used once partition_download_tasks has run) ---
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return f"{DownloadTask._meta.db_table}_p{start:%Y%m}"
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [DownloadTask._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def create_partition(cursor, start):
+    end = add_months(start, 1)
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(start)}" '
+        f'PARTITION OF "{DownloadTask._meta.db_table}" '
+        "FOR VALUES FROM (%s) TO (%s)",
+        [start, end],
+    )
+
+
+def ensure_partitions(months_ahead):
+    """Create the monthly partitions for the current month and the next ones."""
+    current = month_start(timezone.now())
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            create_partition(cursor, add_months(current, offset))
+
+
+def expired_partitions(cutoff):
+    """Return the names of monthly partitions that end on or before ``cutoff``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND c.relname LIKE %s",
+            [DownloadTask._meta.db_table, f"{DownloadTask._meta.db_table}_p%"],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    limit = month_start(cutoff).replace(tzinfo=None)
+    expired = []
+    for name in names:
+        start = datetime.strptime(name.rsplit("_p", 1)[1], "%Y%m")
+        if add_months(start, 1) <= limit:
+            expired.append(name)
+    return sorted(expired)
+
+
+def drop_partition(name, batch_size):
+    """
+    Archive every row in a partition, then drop the whole partition at once.
+    A partition that still holds pending or running tasks is kept for a
+    later run. Returns whether it was dropped.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT(*) FROM "{name}" WHERE status = ANY(%s)', [ACTIVE_STATUSES]
+        )
+        active = cursor.fetchone()[0]
+        if active:
+            logger.warning(
+                f"Keeping expired partition {name}, {active} of its tasks are unfinished"
+            )
+            return False
+        cursor.execute(f'SELECT MIN(created_at), MAX(created_at) FROM "{name}"')
+        low, high = cursor.fetchone()
+
+    if low is not None:
+        rows = DownloadTask.objects.filter(created_at__gte=low, created_at__lte=high)
+        last_pk = None
+        while True:
+            batch = rows.order_by("pk")
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.values(*ARCHIVE_FIELDS)[:batch_size])
+            if not batch:
+                break
+            archive_rows(batch, f"{name}_{batch[0]['id']}")
+            last_pk = batch[-1]["id"]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+    logger.info(f"Dropped expired partition {name}")
+    return True
+
+
+@shared_task
+def purge_expired_records():
+    """
+    Archive and delete finished download tasks and stored Celery results that
+    are older than the configured retention windows.
+    """
+    now = timezone.now()
+    task_cutoff = now - timedelta(days=settings.DOWNLOAD_TASK_RETENTION_DAYS)
+    result_cutoff = now - timedelta(days=settings.TASK_RESULT_RETENTION_DAYS)
+    batch_size = settings.RETENTION_BATCH_SIZE
+
+    dropped_partitions = []
+    if is_partitioned():
+        ensure_partitions(settings.RETENTION_PARTITION_MONTHS_AHEAD)
+        for name in expired_partitions(task_cutoff):
+            if drop_partition(name, batch_size):
+                dropped_partitions.append(name)
+
+    deleted_tasks = purge_in_batches(
+        DownloadTask.objects.filter(
+            status__in=FINISHED_STATUSES, created_at__lt=task_cutoff
+        ),
+        batch_size,
+        archive=True,
+    )
+    deleted_results = purge_in_batches(
+        TaskResult.objects.filter(date_done__lt=result_cutoff), batch_size
+    )
+    deleted_results += purge_in_batches(
+        GroupResult.objects.filter(date_done__lt=result_cutoff), batch_size
+    )
+
+    summary = {
+        "download_tasks": deleted_tasks,
+        "task_results": deleted_results,
+        "dropped_partitions": dropped_partitions,
+    }
+    logger.info(f"Retention sweep finished: {summary}")
+    return summary
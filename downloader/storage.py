@@ -0,0 +1,204 @@
+import bisect
+import hashlib
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import StoredObject
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Objects tracked before sharding have a blank shard and live here
+DEFAULT_SHARD = "default"
+
+_ring = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(storage_options=None):
+    """Build an S3 client for the R2 bucket (or any S3-compatible endpoint)."""
+    # boto3 is imported here so the web process only pays for it when it presigns
+    import boto3
+
+    storage_options = storage_options or settings.CLOUDFLARE_R2_CONFIG_OPTIONS
+    return boto3.client(
+        "s3",
+        endpoint_url=storage_options["endpoint_url"],
+        aws_access_key_id=storage_options["access_key"],
+        aws_secret_access_key=storage_options["secret_key"],
+        config=boto3.session.Config(signature_version="s3v4"),
+    )
+
+
+# --- Shards: several buckets/endpoints placed by consistent hashing ---
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring over the shards. Each shard gets virtual nodes in
+    proportion to its weight, so adding a shard or raising its weight only
+    moves keys onto that shard. A shard with weight 0 receives no new keys.
+    """
+
+    def __init__(self, weights, vnodes=None):
+        vnodes = vnodes or settings.STORAGE_RING_VNODES
+        points = []
+        for name, weight in weights.items():
+            if weight <= 0:
+                continue
+            for i in range(max(1, round(vnodes * weight))):
+                points.append((ring_hash(f"{name}#{i}"), name))
+        if not points:
+            raise ValueError("No storage shard has a positive weight")
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def locate(self, key):
+        index = bisect.bisect(self._hashes, ring_hash(key)) % len(self._hashes)
+        return self._names[index]
+
+
+def get_ring():
+    global _ring
+    if _ring is None:
+        _ring = HashRing(
+            {
+                name: float(options.get("weight", 1))
+                for name, options in settings.STORAGE_SHARDS.items()
+            }
+        )
+    return _ring
+
+
+def shard_for(key):
+    """Shard a new object with ``key`` is written to."""
+    return get_ring().locate(key)
+
+
+def shard_options(shard):
+    return settings.STORAGE_SHARDS[shard or DEFAULT_SHARD]
+
+
+def shard_client(shard):
+    """S3 client and bucket name of ``shard``; clients are shared per process."""
+    shard = shard or DEFAULT_SHARD
+    options = shard_options(shard)
+    with _clients_lock:
+        if shard not in _clients:
+            _clients[shard] = get_s3_client(options)
+    return _clients[shard], options["bucket_name"]
+
+
+def tracked_shard(key):
+    """Shard recorded for ``key``, or None if the object is not tracked."""
+    shard = StoredObject.objects.filter(key=key).values_list("shard", flat=True).first()
+    if shard is None:
+        return None
+    return shard or DEFAULT_SHARD
+
+
+# --- Access tracking ---
+
+
+def record_upload(key, size, shard=DEFAULT_SHARD):
+    """
+    Track an object that is about to be written, pinning it for the upload
+    and for the lifetime of the presigned URL handed out right after.
+    """
+    now = timezone.now()
+    StoredObject.objects.update_or_create(
+        key=key,
+        defaults={
+            "size": size,
+            "shard": shard,
+            "last_accessed_at": now,
+            "pinned_until": now + timedelta(seconds=settings.URL_EXPIRY_SECONDS),
+        },
+    )
+
+
+def record_access(key):
+    """
+    Count a presigned URL issued for ``key`` and pin it until the URL expires.
+    Untracked keys are left alone: a row without size or shard would count
+    as a zero-byte object that may not exist at all. Objects that do exist
+    are picked up by reconcile_bucket.
+    """
+    now = timezone.now()
+    StoredObject.objects.filter(key=key).update(
+        access_count=F("access_count") + 1,
+        last_accessed_at=now,
+        pinned_until=now + timedelta(seconds=settings.URL_EXPIRY_SECONDS),
+    )
+
+
+def generate_s3_signed_url(file_name: str, shard=None) -> str:
+    """
+    Generate a pre-signed URL for S3 storage that forces a download. Pass the
+    shard recorded on the task to skip looking it up.
+    """
+    from botocore.exceptions import NoCredentialsError
+
+    try:
+        shard = shard or tracked_shard(file_name) or DEFAULT_SHARD
+        s3_client, bucket_name = shard_client(shard)
+        presigned_url = s3_client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": bucket_name,
+                "Key": file_name,
+                "ResponseContentDisposition": f'attachment; filename="{os.path.basename(file_name)}"',
+            },
+            ExpiresIn=settings.URL_EXPIRY_SECONDS,
+        )
+        record_access(file_name)
+        return presigned_url
+    except NoCredentialsError:
+        logger.info("Credentials not available for S3.")
+        return None
+
+
+def find_stored_object(key):
+    """
+    ``(shard, size)`` if ``key`` is tracked and actually in its bucket,
+    else None.
+    """
+    from botocore.exceptions import ClientError
+
+    # The row is written before the upload starts, so confirm with the bucket
+    shard = tracked_shard(key)
+    if shard is None:
+        return None
+    s3_client, bucket_name = shard_client(shard)
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError:
+        return None
+    return shard, response["ContentLength"]
+
+
+def abort_multipart_uploads(key, s3_client=None, bucket_name=None):
+    """Abort unfinished multipart uploads of ``key`` so their parts stop billing."""
+    if s3_client is None:
+        s3_client, bucket_name = shard_client(tracked_shard(key))
+    aborted = 0
+    response = s3_client.list_multipart_uploads(Bucket=bucket_name, Prefix=key)
+    for upload in response.get("Uploads", []):
+        if upload["Key"] != key:
+            continue
+        s3_client.abort_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload["UploadId"]
+        )
+        aborted += 1
+    return aborted
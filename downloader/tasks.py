@@ -1,57 +1,77 @@
 import os
+import shutil
 import tempfile
+import threading
+import time
 import re  # For sanitizing filenames
 from celery import shared_task
-from pytubefix import YouTube
 from django.core.files import File
 from .models import DownloadTask
+from .storage import (
+    abort_multipart_uploads,
+    find_stored_object,
+    generate_s3_signed_url,
+    record_upload,
+    shard_client,
+    shard_for,
+)
+from .uploads import plan_upload, record_upload_metrics
+from .clips import build_frame_accurate_cmds, build_keyframe_clip_cmd, clip_key_suffix
+from .progressive import build_stream_cmd, done_marker, scratch_path
+from .webhooks import enqueue_webhook
+from .cancellation import CancellationToken, TaskCancelled
+from . import fairqueue
+from .reaper import Heartbeat
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.core.signing import TimestampSigner
 from django.conf import settings
+from django.utils import timezone
 import urllib.parse
+import signal
 import subprocess
-import boto3
-from botocore.exceptions import NoCredentialsError
-from boto3.s3.transfer import TransferConfig
-from pytubefix.exceptions import (
-    VideoUnavailable,
-    AgeRestrictedError,
-    VideoPrivate,
-    LiveStreamError,
-    MembersOnly,
-    VideoRegionBlocked,
-    UnknownVideoError,
-    RecordingUnavailable,
-)
 
 import logging
 
-logging.basicConfig()
-
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 signer = TimestampSigner()
 
 
 class ProgressPercentage:
-    def __init__(self, filename, task_id, channel_layer, metadata):
+    """
+    s3transfer callback, invoked from every upload thread for each chunk read.
+    Progress is sent at most every UPLOAD_PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, filename, task_id, channel_layer, metadata, cancel_token=None):
         self._filename = filename
         self._size = float(os.path.getsize(filename))
         self._seen_so_far = 0
+        self._sent_at = 0.0
+        self._lock = threading.Lock()
         self.task_id = task_id
         self.channel_layer = channel_layer
         self.metadata = metadata
+        self.cancel_token = cancel_token
 
     def __call__(self, bytes_amount):
-        self._seen_so_far += bytes_amount
-        percentage = (self._seen_so_far / self._size) * 100
+        if self.cancel_token:
+            self.cancel_token.check()
+        with self._lock:
+            self._seen_so_far += bytes_amount
+            now = time.monotonic()
+            done = self._seen_so_far >= self._size
+            if not done and now - self._sent_at < settings.UPLOAD_PROGRESS_INTERVAL:
+                return
+            self._sent_at = now
+            percentage = (self._seen_so_far / self._size) * 100
         notify_progress_update(
             "upload_in_progress",
             self.task_id,
             self.channel_layer,
             self.metadata,
             progress=percentage,
+            status="in_progress",
         )
 
 
@@ -61,30 +81,52 @@ def sanitize_filename(filename):
 
 
 def upload_file_with_progress(
-    file_path, bucket_name, key_name, storage_options, task_id, channel_layer, metadata
+    file_path,
+    key_name,
+    task_id,
+    channel_layer,
+    metadata,
+    cancel_token=None,
 ):
     """
-    Upload a file to S3 with progress tracking.
+    Upload a file to the storage shard its key hashes to, with progress
+    tracking. Returns the shard name.
     """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=storage_options["access_key"],
-        aws_secret_access_key=storage_options["secret_key"],
-        endpoint_url=storage_options["endpoint_url"],
-    )
+    from boto3.s3.transfer import TransferConfig
 
-    # Transfer configuration for progress tracking
+    shard = shard_for(key_name)
+    s3_client, bucket_name = shard_client(shard)
+    file_size = os.path.getsize(file_path)
+
+    # Part size and threads from the throughput measured on earlier uploads
+    plan = plan_upload(file_size)
     config = TransferConfig(
-        multipart_threshold=1024 * 25, max_concurrency=10, multipart_chunksize=1024 * 25
+        multipart_threshold=plan.part_size,
+        multipart_chunksize=plan.part_size,
+        max_concurrency=plan.concurrency,
     )
 
     # Initialize the progress tracker
-    progress = ProgressPercentage(file_path, task_id, channel_layer, metadata)
+    progress = ProgressPercentage(
+        file_path, task_id, channel_layer, metadata, cancel_token
+    )
+    record_upload(key_name, file_size, shard)
 
     # Upload the file with the progress tracker
-    s3_client.upload_file(
-        file_path, bucket_name, key_name, Config=config, Callback=progress
-    )
+    try:
+        started = time.monotonic()
+        s3_client.upload_file(
+            file_path, bucket_name, key_name, Config=config, Callback=progress
+        )
+        record_upload_metrics(key_name, file_size, time.monotonic() - started, plan)
+    except Exception:
+        # Don't leave the parts of an interrupted multipart upload behind
+        try:
+            abort_multipart_uploads(key_name, s3_client, bucket_name)
+        except Exception as abort_error:
+            logger.info(f"Aborting multipart upload failed: {abort_error}")
+        raise
+    return shard
 
 
 def generate_signed_url(filename: str) -> str:
@@ -96,45 +138,109 @@ def generate_signed_url(filename: str) -> str:
     return f"{settings.DOMAIN}/download/{signed_filename}"
 
 
-def generate_s3_signed_url(file_name: str) -> str:
-    """Generate a pre-signed URL for S3 storage that forces a download."""
-    try:
-        s3_client = boto3.client(
-            "s3",
-            endpoint_url=settings.CLOUDFLARE_R2_CONFIG_OPTIONS["endpoint_url"],
-            aws_access_key_id=settings.CLOUDFLARE_R2_CONFIG_OPTIONS["access_key"],
-            aws_secret_access_key=settings.CLOUDFLARE_R2_CONFIG_OPTIONS["secret_key"],
-            config=boto3.session.Config(signature_version="s3v4"),
-        )
-        bucket_name = settings.CLOUDFLARE_R2_CONFIG_OPTIONS["bucket_name"]
-        presigned_url = s3_client.generate_presigned_url(
-            "get_object",
-            Params={
-                "Bucket": bucket_name,
-                "Key": file_name,
-                "ResponseContentDisposition": f'attachment; filename="{os.path.basename(file_name)}"',
-            },
-            ExpiresIn=3600,
+def open_video(url):
+    """pytubefix handle for ``url``, authenticated with the cached OAuth token."""
+    # Loaded on first use so processes that only import this module stay light
+    from pytubefix import YouTube
+
+    return YouTube(
+        url,
+        use_oauth=True,
+        allow_oauth_cache=True,
+        token_file=os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "tokens.json",
+        ),
+    )
+
+
+def describe_video(yt, original_payload):
+    """Metadata sent to clients with every progress update."""
+    return {
+        "title": yt.title,
+        "views": yt.views,
+        "channel_name": yt.author,
+        "thumbnail": yt.thumbnail_url,
+        "duration": yt.length,
+        "original_payload": original_payload,
+    }
+
+
+def output_key(title, resolution, include_audio):
+    """Storage key of a full download."""
+    audio_suffix = "" if include_audio else "_noaudio"
+    return f"{sanitize_filename(title)}_{resolution}{audio_suffix}.mp4"
+
+
+def select_video_stream(yt, resolution):
+    if resolution == "highest-available":
+        video_stream = (
+            yt.streams.filter(adaptive=True, file_extension="mp4")
+            .order_by("resolution")
+            .desc()
+            .first()
         )
-        return presigned_url
-    except NoCredentialsError:
-        logger.info("Credentials not available for S3.")
-        return None
+    elif resolution == "360p":
+        video_stream = yt.streams.filter(
+            progressive=True, file_extension="mp4", res=resolution
+        ).first()
+
+    else:
+        video_stream = yt.streams.filter(
+            adaptive=True, file_extension="mp4", res=resolution
+        ).first()
+
+    if not video_stream:
+        raise Exception(f"No video stream found for resolution {resolution}")
+    return video_stream
+
+
+def video_error_message(error):
+    """Message shown for pytubefix's video availability errors, else None."""
+    from pytubefix import exceptions
+
+    return {
+        exceptions.VideoUnavailable: "Sorry, but this video is simply not available.",
+        exceptions.AgeRestrictedError: "Oops! Looks like you're too young to watch this video.",
+        exceptions.VideoPrivate: "Sorry, you're not invited to watch this private video.",
+        exceptions.LiveStreamError: "Unfortunately, you can't download a live stream.",
+        exceptions.MembersOnly: "This video is exclusively for members only.",
+        exceptions.VideoRegionBlocked: "Sorry, this video is blocked in your region.",
+        exceptions.UnknownVideoError: "Oops! An unknown error occurred while processing the video.",
+        exceptions.RecordingUnavailable: "Sorry, the recording of this live stream is not available.",
+    }.get(type(error))
+
+
+def build_merge_cmd(video_filename, audio_filename, output_filename):
+    # merge_cmd = f"ffmpeg -y -i '{video_filename}' -i '{audio_filename}' -c:v copy -map 0:v:0 -map 1:a:0 -shortest '{output_filename}'"
+    # merge_cmd = f"ffmpeg -y -i '{video_filename}' -i '{audio_filename}' -c:v copy -c:a copy -map 0:v:0 -map 1:a:0 -shortest '{output_filename}'"
+    return f"ffmpeg -y -i '{video_filename}' -i '{audio_filename}' -c:v libx264 -preset medium -crf 23 -c:a aac -b:a 128k -map 0:v:0 -map 1:a:0 -shortest '{output_filename}'"
+
+
+def set_stage(task, stage):
+    """Persist a stage transition; these are always logged."""
+    task.stage = stage
+    task.save(update_fields=["stage"])
+    logger.info(
+        f"Task {task.id} entered stage {stage}",
+        extra={"event": "stage", "task_id": str(task.id), "stage": stage},
+    )
 
 
-def notify_progress_update(
+def progress_payload(
     stage,
     task_id,
-    channel_layer,
+    status,
     metadata=None,
     progress=None,
     download_url=None,
     error_message=None,
 ):
-    payload = {
+    """Message for the task's channel group, see DownloadProgressConsumer."""
+    return {
         "type": "progress.update",
         "stage": stage,
-        "status": DownloadTask.objects.get(id=task_id).status,
+        "status": status,
         "task_id": str(task_id),
         "progress": progress,
         "download_url": download_url,
@@ -142,21 +248,80 @@ def notify_progress_update(
         "metadata": metadata,
     }
 
-    logger.info(f"Attempting to send payload: {payload}")
+
+def notify_progress_update(
+    stage,
+    task_id,
+    channel_layer,
+    metadata=None,
+    progress=None,
+    download_url=None,
+    error_message=None,
+    status=None,
+):
+    if status is None:
+        status = DownloadTask.objects.get(id=task_id).status
+    payload = progress_payload(
+        stage, task_id, status, metadata, progress, download_url, error_message
+    )
 
     try:
         async_to_sync(channel_layer.group_send)(
             f"task_{task_id}",
             payload,
         )
-        logger.info(f"Successfully sent payload to group task_{task_id}")
+        # Sampled per task by ProgressSampleFilter; stage changes always pass
+        logger.info(
+            "Sent progress update",
+            extra={
+                "event": "progress",
+                "task_id": str(task_id),
+                "stage": stage,
+                "progress": progress,
+            },
+        )
     except Exception as e:
-        logger.info(f"Error sending payload to group: {e}")
+        logger.warning(
+            f"Error sending payload to group: {e}",
+            extra={"event": "progress", "task_id": str(task_id), "stage": stage},
+        )
+
+
+def terminate_process_tree(process, timeout=5):
+    """Stop the shell and every ffmpeg process it started."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
 
 
-def run_ffmpeg_with_progress(cmd, task, channel_layer, metadata):
+def report_download_progress(stage, task_id, channel_layer, metadata, cancel_token):
+    """pytubefix on_progress callback; raising here aborts the download."""
+
+    def callback(stream, chunk, bytes_remaining):
+        cancel_token.check()
+        notify_progress_update(
+            stage,
+            task_id,
+            channel_layer,
+            metadata,
+            progress=(100 * (stream.filesize - bytes_remaining) / stream.filesize),
+            status="in_progress",
+        )
+
+    return callback
+
+
+def run_ffmpeg_with_progress(
+    cmd, task, channel_layer, metadata, cancel_token=None, total_duration=None
+):
     """
     Run FFmpeg to merge video and audio while sending progress updates.
+    Pass ``total_duration`` when the output is shorter than the inputs.
     """
     try:
         process = subprocess.Popen(
@@ -165,11 +330,16 @@ def run_ffmpeg_with_progress(cmd, task, channel_layer, metadata):
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             universal_newlines=True,
+            # Own process group, so cancelling can kill ffmpeg along with the shell
+            start_new_session=True,
         )
 
-        total_duration = None
+        saved_at = 0.0
         for line in process.stderr:
-            if "Duration:" in line:
+            if cancel_token and cancel_token.is_cancelled():
+                terminate_process_tree(process)
+                raise TaskCancelled(f"Task {task.id} was cancelled")
+            if "Duration:" in line and total_duration is None:
                 time_str = line.split("Duration:")[1].split(",")[0].strip()
                 h, m, s = time_str.split(":")
                 total_duration = int(h) * 3600 + int(m) * 60 + float(s)
@@ -180,21 +350,30 @@ def run_ffmpeg_with_progress(cmd, task, channel_layer, metadata):
                 if total_duration:
                     progress = (current_time / total_duration) * 100
                     task.progress = progress
-                    task.save()
+                    if time.monotonic() - saved_at >= settings.PROGRESS_SAVE_INTERVAL:
+                        saved_at = time.monotonic()
+                        task.save(update_fields=["progress"])
                     notify_progress_update(
                         "merging_in_progress",
                         task.id,
                         channel_layer,
                         metadata,
                         progress=progress,
+                        status="in_progress",
                     )
 
         process.wait()
         if process.returncode != 0:
             raise subprocess.CalledProcessError(process.returncode, cmd)
         return process.returncode
+    except TaskCancelled:
+        raise
     except Exception as e:
-        logger.info(f"Error running ffmpeg: {str(e)}")
+        logger.error(
+            f"Error running ffmpeg: {str(e)}",
+            exc_info=True,
+            extra={"event": "error", "task_id": str(task.id)},
+        )
         task.status = "failed"
         task.stage = "error"
         task.save()
@@ -204,163 +383,249 @@ def run_ffmpeg_with_progress(cmd, task, channel_layer, metadata):
         raise
 
 
-@shared_task(bind=True)
+def finish_task(task, key_name, shard, file_size, channel_layer, video_metadata):
+    """Mark the task completed with its stored object and notify the clients."""
+    download_url = generate_s3_signed_url(key_name, shard)
+
+    task.status = "completed"
+    task.stage = "completed"
+    task.finished_at = timezone.now()
+    task.progress = 100.0
+    task.file.name = key_name
+    task.file_size = file_size
+    task.storage_shard = shard
+    task.save()
+    logger.info(
+        f"Task {task.id} completed",
+        extra={"event": "stage", "task_id": str(task.id), "stage": "completed"},
+    )
+
+    video_metadata.update(
+        {
+            "download_url": download_url,
+            "download_size": file_size,
+        }
+    )
+
+    notify_progress_update(
+        "completed",
+        task.id,
+        channel_layer,
+        video_metadata,
+        progress=100,
+        download_url=download_url,
+    )
+    enqueue_webhook(
+        task, "task.completed", download_url=download_url, metadata=video_metadata
+    )
+
+
+@shared_task(bind=True, acks_late=True)
 def download_video(self, task_id, original_payload):
     """
     Celery task for downloading video and audio from YouTube, merging, and uploading.
     """
-    logger.info(f"Starting to process video with ID: {task_id}")
+    # Loaded on first use so processes that only import this module stay light
+    from pytubefix.exceptions import (
+        VideoUnavailable,
+        AgeRestrictedError,
+        VideoPrivate,
+        LiveStreamError,
+        MembersOnly,
+        VideoRegionBlocked,
+        UnknownVideoError,
+        RecordingUnavailable,
+    )
+
+    logger.info(
+        f"Starting to process video with ID: {task_id}",
+        extra={"event": "stage", "task_id": str(task_id), "stage": "started"},
+    )
     task = DownloadTask.objects.get(id=task_id)
     channel_layer = get_channel_layer()
+    cancel_token = CancellationToken(task_id)
+    heartbeat = Heartbeat(task_id)
 
     # Initialize variables for cleanup
     video_filename = None
     audio_filename = None
     output_filename = None
+    clip_dir = None
 
     try:
         # --- Fetch video metadata ---
         task.status = "in_progress"
         task.stage = "fetching_metadata"
-        task.save()
-
-        yt = YouTube(
-            task.url,
-            use_oauth=True,
-            allow_oauth_cache=True,
-            token_file=os.path.join(
-                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-                "tokens.json",
-            ),
+        task.started_at = timezone.now()
+        # Only claim the task if it was not cancelled while queued
+        started = DownloadTask.objects.filter(id=task_id, status="pending").update(
+            status=task.status, stage=task.stage, started_at=task.started_at
         )
-        video_metadata = {
-            "title": yt.title,
-            "views": yt.views,
-            "channel_name": yt.author,
-            "thumbnail": yt.thumbnail_url,
-            "duration": yt.length,
-            "original_payload": original_payload,
-        }
-
-        # --- Select video quality based on resolution ---
-        resolution = original_payload["resolution"]
-        task.stage = "downloading_video"
-        task.save()
+        if not started:
+            logger.info(f"Task {task_id} is no longer pending, skipping")
+            return
+        # Lets reap_stuck_tasks tell a running task from one whose worker died
+        heartbeat.start()
 
-        if resolution == "highest-available":
-            video_stream = (
-                yt.streams.filter(adaptive=True, file_extension="mp4")
-                .order_by("resolution")
-                .desc()
-                .first()
-            )
-        elif resolution == "360p":
-            video_stream = yt.streams.filter(
-                progressive=True, file_extension="mp4", res=resolution
-            ).first()
+        yt = open_video(task.url)
+        video_metadata = describe_video(yt, original_payload)
 
-        else:
-            video_stream = yt.streams.filter(
-                adaptive=True, file_extension="mp4", res=resolution
-            ).first()
-
-        if not video_stream:
-            raise Exception(f"No video stream found for resolution {resolution}")
-
-        # --- Download video ---
-        video_filename = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-        yt.register_on_progress_callback(
-            lambda stream, chunk, bytes_remaining: notify_progress_update(
-                "downloading_video",
-                task_id,
-                channel_layer,
-                video_metadata,
-                progress=(100 * (stream.filesize - bytes_remaining) / stream.filesize),
+        # --- Generate sanitized filename with resolution ---
+        resolution = original_payload["resolution"]
+        sanitized_title = sanitize_filename(yt.title)
+        key_name = output_key(yt.title, resolution, task.include_audio)
+
+        clip = task.clip_start is not None and task.clip_end is not None
+        if clip:
+            clip_start = task.clip_start
+            clip_end = min(task.clip_end, yt.length) if yt.length else task.clip_end
+            if clip_start >= clip_end:
+                raise Exception("The requested clip starts after the end of the video")
+            key_name = (
+                f"{sanitized_title}_{resolution}"
+                f"{clip_key_suffix(clip_start, clip_end, task.frame_accurate, task.include_audio)}.mp4"
             )
-        )
-        video_stream.download(filename=video_filename)
 
-        # --- Download audio (if required) ---
-        if task.include_audio:
-            task.stage = "downloading_audio"
-            task.save()
+        # Clips and pre-warmed videos are asked for repeatedly; serve an
+        # earlier output as is. Progressive clients expect a stream to follow.
+        stored = None if task.progressive else find_stored_object(key_name)
+        if stored is not None:
+            logger.info(f"Serving {key_name} from storage for task {task_id}")
+            shard, size = stored
+            finish_task(task, key_name, shard, size, channel_layer, video_metadata)
+            return
 
-            audio_stream = yt.streams.get_audio_only()
-            audio_filename = tempfile.NamedTemporaryFile(
-                delete=False, suffix=".mp3"
+        # --- Select video quality based on resolution ---
+        cancel_token.check()
+        set_stage(task, "downloading_video")
+
+        video_stream = select_video_stream(yt, resolution)
+
+        if clip:
+            # --- Cut the window straight from the streams, see downloader.clips ---
+            set_stage(task, "merging")
+
+            audio_stream = yt.streams.get_audio_only() if task.include_audio else None
+            clip_dir = tempfile.mkdtemp(prefix="clip-")
+            heartbeat.track(clip_dir)
+            output_filename = os.path.join(clip_dir, "clip.mp4")
+            if task.frame_accurate:
+                clip_cmds = build_frame_accurate_cmds(
+                    video_stream,
+                    audio_stream,
+                    clip_start,
+                    clip_end,
+                    clip_dir,
+                    output_filename,
+                )
+            else:
+                clip_cmds = [
+                    build_keyframe_clip_cmd(
+                        video_stream,
+                        audio_stream,
+                        clip_start,
+                        clip_end,
+                        output_filename,
+                    )
+                ]
+            for clip_cmd in clip_cmds:
+                cancel_token.check()
+                run_ffmpeg_with_progress(
+                    clip_cmd,
+                    task,
+                    channel_layer,
+                    video_metadata,
+                    cancel_token,
+                    total_duration=clip_end - clip_start,
+                )
+        elif task.progressive:
+            # --- Stream both inputs into a fragmented MP4 readers can follow ---
+            set_stage(task, "merging")
+
+            audio_stream = yt.streams.get_audio_only() if task.include_audio else None
+            output_filename = scratch_path(task_id)
+            heartbeat.track(output_filename, done_marker(output_filename))
+            stream_cmd = build_stream_cmd(video_stream, audio_stream, output_filename)
+            run_ffmpeg_with_progress(
+                stream_cmd, task, channel_layer, video_metadata, cancel_token
+            )
+            open(done_marker(output_filename), "w").close()
+        else:
+            # --- Download video ---
+            video_filename = tempfile.NamedTemporaryFile(
+                delete=False, suffix=".mp4"
             ).name
+            heartbeat.track(video_filename)
             yt.register_on_progress_callback(
-                lambda stream, chunk, bytes_remaining: notify_progress_update(
-                    "downloading_audio",
+                report_download_progress(
+                    "downloading_video",
                     task_id,
                     channel_layer,
                     video_metadata,
-                    progress=(
-                        100 * (stream.filesize - bytes_remaining) / stream.filesize
-                    ),
+                    cancel_token,
                 )
             )
-            audio_stream.download(filename=audio_filename)
-
-            # --- Merge video and audio ---
-            task.stage = "merging"
-            task.save()
+            video_stream.download(filename=video_filename)
+
+            # --- Download audio (if required) ---
+            if task.include_audio:
+                set_stage(task, "downloading_audio")
+
+                audio_stream = yt.streams.get_audio_only()
+                audio_filename = tempfile.NamedTemporaryFile(
+                    delete=False, suffix=".mp3"
+                ).name
+                heartbeat.track(audio_filename)
+                yt.register_on_progress_callback(
+                    report_download_progress(
+                        "downloading_audio",
+                        task_id,
+                        channel_layer,
+                        video_metadata,
+                        cancel_token,
+                    )
+                )
+                audio_stream.download(filename=audio_filename)
 
-            output_filename = tempfile.NamedTemporaryFile(
-                delete=False, suffix=".mp4"
-            ).name
-            # merge_cmd = f"ffmpeg -y -i '{video_filename}' -i '{audio_filename}' -c:v copy -map 0:v:0 -map 1:a:0 -shortest '{output_filename}'"
-            # merge_cmd = f"ffmpeg -y -i '{video_filename}' -i '{audio_filename}' -c:v copy -c:a copy -map 0:v:0 -map 1:a:0 -shortest '{output_filename}'"
-            merge_cmd = f"ffmpeg -y -i '{video_filename}' -i '{audio_filename}' -c:v libx264 -preset medium -crf 23 -c:a aac -b:a 128k -map 0:v:0 -map 1:a:0 -shortest '{output_filename}'"
-            run_ffmpeg_with_progress(merge_cmd, task, channel_layer, video_metadata)
-        else:
-            output_filename = video_filename
+                # --- Merge video and audio ---
+                set_stage(task, "merging")
 
-        # --- Generate sanitized filename with resolution ---
-        sanitized_title = sanitize_filename(yt.title)
-        key_name = f"{sanitized_title}_{resolution}.mp4"
+                output_filename = tempfile.NamedTemporaryFile(
+                    delete=False, suffix=".mp4"
+                ).name
+                heartbeat.track(output_filename)
+                merge_cmd = build_merge_cmd(
+                    video_filename, audio_filename, output_filename
+                )
+                run_ffmpeg_with_progress(
+                    merge_cmd, task, channel_layer, video_metadata, cancel_token
+                )
+            else:
+                output_filename = video_filename
 
         # --- Upload the file with progress ---
-        task.stage = "uploading"
-        task.save()
+        cancel_token.check()
+        set_stage(task, "uploading")
+        heartbeat.track_upload(key_name, shard_for(key_name))
 
-        bucket_name = settings.CLOUDFLARE_R2_CONFIG_OPTIONS["bucket_name"]
-        storage_options = settings.CLOUDFLARE_R2_CONFIG_OPTIONS
-
-        upload_file_with_progress(
+        shard = upload_file_with_progress(
             output_filename,
-            bucket_name,
             key_name,
-            storage_options,
             task_id,
             channel_layer,
             video_metadata,
+            cancel_token,
         )
-
-        download_url = generate_s3_signed_url(key_name)
-        file_size = os.path.getsize(output_filename)
+        cancel_token.check()
 
         # --- Complete the process ---
-        task.status = "completed"
-        task.stage = "completed"
-        task.progress = 100.0
-        task.file_size = file_size
-        task.save()
-
-        video_metadata.update(
-            {
-                "download_url": download_url,
-                "download_size": file_size,
-            }
-        )
-
-        notify_progress_update(
-            "completed",
-            task_id,
+        finish_task(
+            task,
+            key_name,
+            shard,
+            os.path.getsize(output_filename),
             channel_layer,
             video_metadata,
-            progress=100,
-            download_url=download_url,
         )
 
     except (
@@ -373,22 +638,15 @@ def download_video(self, task_id, original_payload):
         UnknownVideoError,
         RecordingUnavailable,
     ) as e:
-        error_messages = {
-            VideoUnavailable: "Sorry, but this video is simply not available.",
-            AgeRestrictedError: "Oops! Looks like you're too young to watch this video.",
-            VideoPrivate: "Sorry, you're not invited to watch this private video.",
-            LiveStreamError: "Unfortunately, you can't download a live stream.",
-            MembersOnly: "This video is exclusively for members only.",
-            VideoRegionBlocked: "Sorry, this video is blocked in your region.",
-            UnknownVideoError: "Oops! An unknown error occurred while processing the video.",
-            RecordingUnavailable: "Sorry, the recording of this live stream is not available.",
-        }
-
-        error_message = error_messages.get(type(e), "An error occurred.")
+        error_message = video_error_message(e) or "An error occurred."
         task.status = "failed"
         task.stage = "error"
+        task.finished_at = timezone.now()
         task.save()
-        logger.info(f"Error downloading video msg: {error_message}")
+        logger.error(
+            f"Error downloading video msg: {error_message}",
+            extra={"event": "error", "task_id": str(task_id)},
+        )
 
         notify_progress_update(
             "error",
@@ -397,16 +655,32 @@ def download_video(self, task_id, original_payload):
             metadata=None,
             error_message=error_message,
         )
+        enqueue_webhook(task, "task.failed", error_message=error_message)
+
+    except TaskCancelled:
+        # cancel_task already updated the row and notified the clients
+        logger.info(f"Task {task_id} was cancelled, stopped processing")
 
     except Exception as e:
-        logger.info(f"Error downloading video: {str(e)}")
+        if cancel_token.is_cancelled(force=True):
+            # e.g. TaskCancelled from the upload callback, re-raised by s3transfer
+            logger.info(f"Task {task_id} was cancelled, stopped processing")
+            return
+
+        logger.error(
+            f"Error downloading video: {str(e)}",
+            exc_info=True,
+            extra={"event": "error", "task_id": str(task_id)},
+        )
         notify_progress_update(
             "error", task_id, channel_layer, metadata=None, error_message=str(e)
         )
 
         task.status = "failed"
         task.stage = "error"
+        task.finished_at = timezone.now()
         task.save()
+        enqueue_webhook(task, "task.failed", error_message=str(e))
     finally:
         # Cleanup files if they were created
         try:
@@ -416,5 +690,17 @@ def download_video(self, task_id, original_payload):
                 os.remove(audio_filename)
             if output_filename and os.path.exists(output_filename):
                 os.remove(output_filename)
+            if output_filename and os.path.exists(done_marker(output_filename)):
+                os.remove(done_marker(output_filename))
+            if clip_dir:
+                shutil.rmtree(clip_dir, ignore_errors=True)
         except Exception as cleanup_error:
             logger.info(f"Cleanup failed: {str(cleanup_error)}")
+        heartbeat.stop()
+
+        # Hand this worker slot to the next client in line
+        try:
+            fairqueue.release(task_id, task.client_id)
+            fairqueue.dispatch()
+        except Exception as e:
+            logger.info(f"Fair queue dispatch after task {task_id} failed: {e}")
@@ -0,0 +1,146 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from downloader import admission, fairqueue
+from downloader.models import DownloadTask
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def finished_task(resolution, seconds):
+    now = timezone.now()
+    return DownloadTask.objects.create(
+        url=VIDEO,
+        resolution=resolution,
+        status="completed",
+        started_at=now - timedelta(seconds=seconds),
+        finished_at=now,
+    )
+
+
+@override_settings(
+    ADMISSION_MAX_WAIT_SECONDS=600,
+    ADMISSION_MIN_RETRY_AFTER=30,
+    ADMISSION_DEFAULT_SERVICE_SECONDS=120,
+)
+class EstimateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def estimate(self, depth, slots, resolution="720p"):
+        with mock.patch.object(
+            admission, "queue_depth", return_value=depth
+        ), mock.patch.object(admission, "worker_slots", return_value=slots):
+            return admission.estimate(resolution)
+
+    def test_service_times_per_resolution(self):
+        finished_task("720p", 60)
+        finished_task("720p", 120)
+        finished_task("1080p", 300)
+
+        times = admission.service_times()
+
+        self.assertAlmostEqual(times["720p"], 90, delta=1)
+        self.assertAlmostEqual(times["1080p"], 300, delta=1)
+        self.assertAlmostEqual(times["*"], 160, delta=1)
+
+    def test_free_slot_means_no_wait(self):
+        estimate = self.estimate(depth=0, slots=4)
+        self.assertEqual(estimate.projected_wait, 0)
+        self.assertEqual(estimate.eta_seconds, 120)
+        self.assertTrue(estimate.admitted)
+
+    def test_backlog_spreads_over_slots(self):
+        for _ in range(2):
+            DownloadTask.objects.create(url=VIDEO, status="in_progress")
+
+        estimate = self.estimate(depth=10, slots=2)
+
+        # Ten queued at 120 s and two running at half of it, over two slots
+        self.assertEqual(estimate.projected_wait, (10 * 120 + 2 * 60) / 2)
+        self.assertFalse(estimate.admitted)
+        self.assertEqual(estimate.retry_after, 60)
+
+    def test_rejected_request_gets_retry_after(self):
+        with mock.patch.object(
+            admission, "queue_depth", return_value=100
+        ), mock.patch.object(admission, "worker_slots", return_value=1):
+            response = self.client.post(
+                "/start_download/",
+                data={"url": VIDEO},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], str(100 * 120 - 600))
+        self.assertFalse(DownloadTask.objects.exists())
+
+    def test_admitted_request_gets_eta(self):
+        with mock.patch.object(
+            admission, "queue_depth", return_value=0
+        ), mock.patch.object(admission, "worker_slots", return_value=4), mock.patch(
+            "downloader.views.fairqueue.enqueue"
+        ), mock.patch(
+            "downloader.views.fairqueue.dispatch"
+        ), mock.patch(
+            "downloader.views.touch"
+        ):
+            response = self.client.post(
+                "/start_download/",
+                data={"url": VIDEO, "resolution": "720p"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["eta_seconds"], 120)
+        self.assertIsNotNone(DownloadTask.objects.get().eta_at)
+
+
+@override_settings(ADMISSION_DEFAULT_WORKER_SLOTS=4, HEARTBEAT_TIMEOUT=60)
+class WorkerSlotsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch("downloader.fairqueue.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_slots_come_from_advertised_capacity(self):
+        self.redis.set(fairqueue.celery_capacity_key("celery@a"), 8)
+        self.redis.set(fairqueue.celery_capacity_key("celery@b"), 4)
+        self.redis.set(fairqueue.capacity_key("io-1"), 200)
+        with mock.patch("youtube_downloader.celery.app.control.inspect") as inspect:
+            self.assertEqual(admission.worker_slots(), 12)
+        inspect.assert_not_called()
+
+    @override_settings(DOWNLOAD_WORKER_MODE="asyncio")
+    def test_io_workers_count_in_asyncio_mode(self):
+        self.redis.set(fairqueue.celery_capacity_key("celery@a"), 8)
+        self.redis.set(fairqueue.capacity_key("io-1"), 200)
+        self.assertEqual(admission.worker_slots(), 208)
+
+    def test_default_when_no_worker_advertises(self):
+        self.assertEqual(admission.worker_slots(), 4)
+
+    def test_worker_advertises_until_shutdown(self):
+        from youtube_downloader.celery import advertise_capacity, withdraw_capacity
+
+        consumer = SimpleNamespace(
+            hostname="celery@a",
+            controller=SimpleNamespace(concurrency=6, max_concurrency=None),
+        )
+        with mock.patch.object(fairqueue.CapacityBeacon, "_run"):
+            advertise_capacity(sender=consumer)
+        key = fairqueue.celery_capacity_key("celery@a")
+        self.assertEqual(self.redis.get(key), "6")
+        self.assertEqual(self.redis.ttl(key), 60)
+
+        withdraw_capacity()
+        self.assertFalse(self.redis.exists(key))
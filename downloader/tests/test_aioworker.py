@@ -0,0 +1,111 @@
+import asyncio
+import os
+import tempfile
+
+import fakeredis
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+from channels.layers import get_channel_layer
+from django.test import TransactionTestCase, override_settings
+
+from downloader.aioworker import IOWorker, Transfer, claim
+from downloader.cancellation import TaskCancelled, cancel_key
+from downloader.ffmpegpool import process_pool, run_ffmpeg_job
+from downloader.models import DownloadTask
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+# Stands in for ffmpeg, which reports duration and position on stderr
+FAKE_FFMPEG = (
+    "printf 'Duration: 00:00:10.00, start: 0.000000\\n"
+    "frame=1 time=00:00:05.00 bitrate=1kbits/s\\n' >&2"
+)
+
+
+class FfmpegPoolTests(TransactionTestCase):
+    def test_job_runs_in_spawned_pool(self):
+        task = DownloadTask.objects.create(
+            url=VIDEO,
+            status="in_progress",
+            stage="merging",
+        )
+        with process_pool(1) as pool:
+            returncode = pool.submit(
+                run_ffmpeg_job, FAKE_FFMPEG, str(task.id), {}
+            ).result(timeout=60)
+
+        self.assertEqual(returncode, 0)
+        task.refresh_from_db()
+        self.assertEqual(task.progress, 50)
+
+
+class ClaimTests(TransactionTestCase):
+    def test_pending_task_is_started(self):
+        task = DownloadTask.objects.create(url=VIDEO, status="pending")
+        claimed, started = claim(task.id)
+        self.assertTrue(started)
+        self.assertEqual(claimed.status, "in_progress")
+        self.assertIsNotNone(claimed.started_at)
+
+    def test_task_cancelled_while_queued_is_not_started(self):
+        task = DownloadTask.objects.create(url=VIDEO, status="cancelled")
+        claimed, started = claim(task.id)
+        self.assertFalse(started)
+        self.assertEqual(claimed.status, "cancelled")
+
+
+@override_settings(IO_WORKER_RANGE_SIZE=1000, IO_WORKER_PROGRESS_INTERVAL=0)
+class FetchTests(TransactionTestCase):
+    BODY = os.urandom(2500)
+
+    def setUp(self):
+        self.requests = []
+        self.fail_next = False
+        scratch = tempfile.NamedTemporaryFile(delete=False)
+        scratch.close()
+        self.path = scratch.name
+        self.addCleanup(os.remove, self.path)
+
+    async def stream(self, request):
+        start, end = map(int, request.query["range"].split("-"))
+        self.requests.append((start, end))
+        if self.fail_next:
+            self.fail_next = False
+            return web.Response(status=503)
+        return web.Response(body=self.BODY[start : end + 1])
+
+    async def fetch(self, cancelled=False):
+        app = web.Application()
+        app.router.add_get("/videoplayback", self.stream)
+        worker = IOWorker(concurrency=1, ffmpeg_processes=1)
+        worker.redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        worker.channel_layer = get_channel_layer()
+        transfer = Transfer(DownloadTask(url=VIDEO))
+        if cancelled:
+            await worker.redis.set(cancel_key(transfer.task_id), "Cancelled by user")
+        async with TestServer(app) as server, ClientSession() as worker.session:
+            await worker.fetch(
+                transfer,
+                str(server.make_url("/videoplayback?id=1")),
+                len(self.BODY),
+                self.path,
+                "downloading_video",
+            )
+
+    def test_stream_is_fetched_in_ranges(self):
+        asyncio.run(self.fetch())
+        self.assertEqual(self.requests, [(0, 999), (1000, 1999), (2000, 2499)])
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+
+    def test_failed_range_is_retried(self):
+        self.fail_next = True
+        asyncio.run(self.fetch())
+        self.assertEqual(self.requests[:2], [(0, 999), (0, 999)])
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+
+    def test_cancelled_transfer_stops(self):
+        with self.assertRaises(TaskCancelled):
+            asyncio.run(self.fetch(cancelled=True))
+        self.assertEqual(len(self.requests), 1)
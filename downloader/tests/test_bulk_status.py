@@ -0,0 +1,74 @@
+import json
+import uuid
+from unittest import mock
+
+import fakeredis
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from downloader.cancellation import last_seen_key
+from downloader.models import DownloadTask
+from downloader.views import status_cache_key
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class BulkStatusTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch(
+            "downloader.cancellation.get_redis", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def post(self, body):
+        return self.client.post(
+            reverse("bulk_check_status"),
+            json.dumps(body),
+            content_type="application/json",
+        )
+
+    def test_statuses_in_one_query(self):
+        running = DownloadTask.objects.create(
+            url=VIDEO, status="in_progress", progress=40.0
+        )
+        done = DownloadTask.objects.create(url=VIDEO, status="completed")
+        unknown = str(uuid.uuid4())
+
+        with self.assertNumQueries(1):
+            response = self.post({"task_ids": [str(running.id), str(done.id), unknown]})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["tasks"][str(running.id)]["progress"], 40.0)
+        self.assertEqual(body["tasks"][str(done.id)]["status"], "completed")
+        self.assertEqual(body["not_found"], [unknown])
+        # Only the running task counts as watched
+        self.assertTrue(self.redis.exists(last_seen_key(running.id)))
+        self.assertFalse(self.redis.exists(last_seen_key(done.id)))
+
+    def test_only_finished_tasks_are_served_from_cache(self):
+        running = DownloadTask.objects.create(url=VIDEO, status="in_progress")
+        done = DownloadTask.objects.create(url=VIDEO, status="completed")
+        task_ids = [str(running.id), str(done.id)]
+        self.post({"task_ids": task_ids})
+
+        self.assertIsNone(cache.get(status_cache_key(running.id)))
+        self.assertIsNotNone(cache.get(status_cache_key(done.id)))
+        DownloadTask.objects.filter(id=running.id).update(progress=80.0)
+        with self.assertNumQueries(1):
+            body = self.post({"task_ids": task_ids}).json()
+        self.assertEqual(body["tasks"][str(running.id)]["progress"], 80.0)
+        self.assertEqual(body["tasks"][str(done.id)]["status"], "completed")
+
+    def test_invalid_ids_are_rejected(self):
+        self.assertEqual(self.post({"task_ids": ["nope"]}).status_code, 400)
+        self.assertEqual(self.post({"ids": []}).status_code, 400)
+
+    @override_settings(BULK_STATUS_MAX_IDS=2)
+    def test_request_size_is_capped(self):
+        task_ids = [str(uuid.uuid4()) for _ in range(3)]
+        self.assertEqual(self.post({"task_ids": task_ids}).status_code, 400)
@@ -0,0 +1,127 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from downloader.cancellation import (
+    CancellationToken,
+    TaskCancelled,
+    add_watcher,
+    cancel_abandoned_tasks,
+    cancel_key,
+    cancel_task,
+    last_seen_key,
+    remove_watcher,
+    touch,
+    watchers_key,
+)
+from downloader.models import DownloadTask
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class CancellationTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch(
+            "downloader.cancellation.get_redis", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        revoke = mock.patch("youtube_downloader.celery.app.control.revoke")
+        self.revoke = revoke.start()
+        self.addCleanup(revoke.stop)
+
+
+class CancelTaskTests(CancellationTestCase):
+    def test_running_task_is_cancelled_and_flagged(self):
+        task = DownloadTask.objects.create(url=VIDEO, status="in_progress")
+        self.assertTrue(cancel_task(task))
+        self.assertEqual(task.status, "cancelled")
+        self.assertIsNotNone(task.finished_at)
+        self.assertTrue(self.redis.exists(cancel_key(task.id)))
+        self.revoke.assert_called_once_with(str(task.id))
+
+    def test_finished_task_is_left_alone(self):
+        task = DownloadTask.objects.create(url=VIDEO, status="completed")
+        self.assertFalse(cancel_task(task))
+        task.refresh_from_db()
+        self.assertEqual(task.status, "completed")
+        self.assertFalse(self.redis.exists(cancel_key(task.id)))
+        self.revoke.assert_not_called()
+
+    def test_cancel_endpoint(self):
+        task = DownloadTask.objects.create(url=VIDEO, status="pending")
+        url = reverse("cancel_download", args=[task.id])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "cancelled")
+        self.assertEqual(self.client.post(url).status_code, 409)
+
+
+class CancellationTokenTests(CancellationTestCase):
+    def test_check_raises_once_cancelled(self):
+        token = CancellationToken("task-1", interval=0)
+        token.check()
+        self.redis.set(cancel_key("task-1"), "Cancelled by user")
+        with self.assertRaises(TaskCancelled):
+            token.check()
+
+    def test_redis_is_polled_at_most_every_interval(self):
+        token = CancellationToken("task-1", interval=60)
+        self.assertFalse(token.is_cancelled())
+        self.redis.set(cancel_key("task-1"), "Cancelled by user")
+        self.assertFalse(token.is_cancelled())
+        self.assertTrue(token.is_cancelled(force=True))
+
+
+class WatcherTests(CancellationTestCase):
+    def test_watchers_are_counted_and_touch_records_activity(self):
+        add_watcher("task-1")
+        add_watcher("task-1")
+        remove_watcher("task-1")
+        self.assertEqual(int(self.redis.get(watchers_key("task-1"))), 1)
+        touch("task-2")
+        self.assertAlmostEqual(
+            float(self.redis.get(last_seen_key("task-2"))), time.time(), delta=5
+        )
+
+
+@override_settings(ABANDON_AFTER_SECONDS=60)
+class AbandonedTaskTests(CancellationTestCase):
+    def old_task(self, **fields):
+        task = DownloadTask.objects.create(url=VIDEO, status="in_progress", **fields)
+        DownloadTask.objects.filter(id=task.id).update(
+            created_at=timezone.now() - timedelta(minutes=10)
+        )
+        return task
+
+    def test_only_unwatched_tasks_are_cancelled(self):
+        abandoned = self.old_task()
+        watched = self.old_task()
+        add_watcher(watched.id)
+        polled = self.old_task()
+        touch(polled.id)
+        self.old_task(webhook_url="https://example.com/hook")
+        self.old_task(client_id="prewarm")
+        DownloadTask.objects.create(url=VIDEO, status="pending")
+
+        self.assertEqual(cancel_abandoned_tasks(), 1)
+        self.assertEqual(
+            list(
+                DownloadTask.objects.filter(status="cancelled").values_list(
+                    "id", flat=True
+                )
+            ),
+            [abandoned.id],
+        )
+
+    def test_stale_activity_does_not_count(self):
+        task = self.old_task()
+        self.redis.set(last_seen_key(task.id), time.time() - 120)
+        self.redis.set(watchers_key(task.id), 0)
+        self.assertEqual(cancel_abandoned_tasks(), 1)
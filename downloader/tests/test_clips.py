@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from downloader.clips import (
+    build_frame_accurate_cmds,
+    build_keyframe_clip_cmd,
+    clip_key_suffix,
+    format_time,
+    frame_accurate_pieces,
+    parse_timestamp,
+)
+
+VIDEO = SimpleNamespace(url="https://video.example/v", video_codec="avc1.64001F")
+AUDIO = SimpleNamespace(url="https://video.example/a")
+
+
+class ParseTimestampTests(SimpleTestCase):
+    def test_accepted_forms(self):
+        self.assertEqual(parse_timestamp(90), 90.0)
+        self.assertEqual(parse_timestamp("90.5"), 90.5)
+        self.assertEqual(parse_timestamp("1:30"), 90.0)
+        self.assertEqual(parse_timestamp("01:01:30.25"), 3690.25)
+
+    def test_rejected_forms(self):
+        for value in (-1, "-0:01", "1:2:3:4", "abc", "", "inf", True, float("nan")):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_timestamp(value)
+
+    def test_key_suffix_per_variant(self):
+        self.assertEqual(clip_key_suffix(5, 12.5, False, True), "_clip_5-12.5s")
+        self.assertEqual(
+            clip_key_suffix(5, 12.5, True, False), "_clip_5-12.5s_exact_noaudio"
+        )
+
+
+class FrameAccurateTests(SimpleTestCase):
+    def test_pieces_meet_exactly_at_keyframes(self):
+        pieces = frame_accurate_pieces(10.0, 50.0, 12.345678, 47.000001)
+
+        self.assertEqual(
+            [(name, copy) for name, _, _, copy in pieces],
+            [("head.ts", False), ("middle.ts", True), ("tail.ts", False)],
+        )
+        self.assertEqual(format_time(pieces[0][1]), "10.000000")
+        for (_, seek, length, _), (_, next_seek, _, _) in zip(pieces, pieces[1:]):
+            self.assertEqual(format_time(seek + length), format_time(next_seek))
+        _, seek, length, _ = pieces[-1]
+        self.assertEqual(format_time(seek + length), "50.000000")
+
+    def test_edge_pieces_dropped_at_keyframe_boundaries(self):
+        pieces = frame_accurate_pieces(12.0, 48.0, 12.0, 48.0)
+        self.assertEqual([piece[0] for piece in pieces], ["middle.ts"])
+
+    def test_copy_seeks_to_the_exact_keyframe_time(self):
+        # Rounded to milliseconds, 12.3455 would seek before the keyframe and
+        # copy the previous GOP, whose frames the head piece already has
+        with mock.patch(
+            "downloader.clips.find_copy_range", return_value=(12.3455, 47.0005)
+        ):
+            commands = build_frame_accurate_cmds(
+                VIDEO, AUDIO, 10.0, 50.0, "/tmp/clip", "/tmp/clip/out.mp4"
+            )
+
+        head, middle, tail, join = commands
+        self.assertIn("-ss 10.000000 -t 2.345500 ", head)
+        self.assertIn("-ss 12.345500 -t 34.655000 ", middle)
+        self.assertIn("-c:v copy", middle)
+        self.assertIn("-ss 47.000500 -t 2.999500 ", tail)
+        self.assertIn(
+            "concat:/tmp/clip/head.ts|/tmp/clip/middle.ts|/tmp/clip/tail.ts", join
+        )
+
+    def test_reencodes_without_usable_keyframes(self):
+        with mock.patch("downloader.clips.find_copy_range", return_value=None):
+            (command,) = build_frame_accurate_cmds(
+                VIDEO, None, 10.0, 11.0, "/tmp/clip", "/tmp/clip/out.mp4"
+            )
+        self.assertIn("libx264", command)
+
+    def test_keyframe_clip_copies_video(self):
+        command = build_keyframe_clip_cmd(VIDEO, AUDIO, 10.0, 20.0, "/tmp/out.mp4")
+        self.assertIn("-ss 10.000000 -t 10.000000 -i", command)
+        self.assertIn("-c:v copy", command)
+        self.assertIn("-map 1:a:0", command)
@@ -0,0 +1,33 @@
+from celery.signals import task_postrun, task_prerun
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import SimpleTestCase
+
+import downloader.dbstats  # noqa: F401
+
+
+class Task:
+    name = "downloader.tasks.download_video"
+
+
+TASK = Task()
+
+
+class ConnectionCountTests(SimpleTestCase):
+    def run_task(self, connections):
+        task_prerun.send(sender=TASK, task_id="task-1", task=TASK)
+        for _ in range(connections):
+            connection_created.send(sender=type(connection), connection=connection)
+        with self.assertLogs("downloader.dbstats", "INFO") as logs:
+            task_postrun.send(sender=TASK, task_id="task-1", task=TASK)
+        return logs.records[0]
+
+    def test_connections_opened_by_a_task_are_logged(self):
+        record = self.run_task(2)
+        self.assertEqual(record.event, "db")
+        self.assertEqual(record.task_name, TASK.name)
+        self.assertEqual(record.connections_opened, 2)
+
+    def test_count_starts_over_for_every_task(self):
+        self.run_task(3)
+        self.assertEqual(self.run_task(0).connections_opened, 0)
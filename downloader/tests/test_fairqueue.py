@@ -0,0 +1,162 @@
+import json
+from unittest import mock
+
+import fakeredis
+from django.test import RequestFactory, TestCase, override_settings
+
+from downloader import fairqueue
+from downloader.models import DownloadTask
+
+
+class ClientIdentityTests(TestCase):
+    def request(self, **headers):
+        return RequestFactory().post(
+            "/start_download/", REMOTE_ADDR="203.0.113.7", headers=headers
+        )
+
+    @override_settings(FAIR_QUEUE_API_KEYS={"acme": "s3cret"})
+    def test_known_key_is_named(self):
+        self.assertEqual(
+            fairqueue.client_identity(self.request(x_api_key="s3cret")), "key:acme"
+        )
+
+    @override_settings(FAIR_QUEUE_API_KEYS={"acme": "s3cret"})
+    def test_unknown_key_falls_back_to_address(self):
+        self.assertEqual(
+            fairqueue.client_identity(self.request(x_api_key="made-up")),
+            "ip:203.0.113.7",
+        )
+
+    def test_visitor_address_from_cloudflare(self):
+        self.assertEqual(
+            fairqueue.client_identity(
+                self.request(
+                    cf_connecting_ip="198.51.100.1",
+                    x_forwarded_for="198.51.100.1, 172.68.0.10",
+                )
+            ),
+            "ip:198.51.100.1",
+        )
+
+    @override_settings(FAIR_QUEUE_CLIENT_IP_HEADER="", FAIR_QUEUE_PROXY_HOPS=2)
+    def test_forwarded_address_skips_trusted_proxies(self):
+        # Spoofed entry, visitor as seen by Cloudflare, edge as seen by nginx
+        self.assertEqual(
+            fairqueue.client_identity(
+                self.request(x_forwarded_for="10.0.0.1, 198.51.100.1, 172.68.0.10")
+            ),
+            "ip:198.51.100.1",
+        )
+
+    def test_visitors_behind_one_edge_get_separate_queues(self):
+        identities = {
+            fairqueue.client_identity(
+                self.request(
+                    cf_connecting_ip=visitor,
+                    x_forwarded_for=f"{visitor}, 172.68.0.10",
+                )
+            )
+            for visitor in ("198.51.100.1", "198.51.100.2")
+        }
+        self.assertEqual(identities, {"ip:198.51.100.1", "ip:198.51.100.2"})
+
+    def test_direct_request_uses_socket_address(self):
+        self.assertEqual(fairqueue.client_identity(self.request()), "ip:203.0.113.7")
+
+
+@override_settings(FAIR_QUEUE_CLIENT_CONCURRENCY=1, FAIR_QUEUE_WEIGHTS={})
+class DispatchTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patchers = [
+            mock.patch("downloader.fairqueue.get_redis", return_value=self.redis),
+            mock.patch("downloader.fairqueue._scripts", {}),
+            mock.patch("downloader.admission.service_times", return_value={"*": 10.0}),
+            mock.patch("downloader.admission.worker_slots", return_value=1),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("youtube_downloader.celery.app.send_task")
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue(self, client_id, count):
+        tasks = []
+        for _ in range(count):
+            task = DownloadTask.objects.create(
+                url="https://www.youtube.com/watch?v=dQw4w9WgXcQ", client_id=client_id
+            )
+            fairqueue.enqueue(task, {"url": task.url})
+            tasks.append(str(task.id))
+        return tasks
+
+    def run_next(self):
+        """Dispatch one task and let it finish."""
+        self.assertEqual(fairqueue.dispatch(), 1)
+        task_id = self.send_task.call_args.kwargs["task_id"]
+        client_id = DownloadTask.objects.get(id=task_id).client_id
+        fairqueue.release(task_id, client_id)
+        return client_id
+
+    def test_heavy_client_does_not_starve_others(self):
+        self.queue("ip:heavy", 3)
+        self.queue("ip:light", 1)
+
+        order = [self.run_next() for _ in range(4)]
+        self.assertEqual(order, ["ip:heavy", "ip:light", "ip:heavy", "ip:heavy"])
+        self.assertEqual(fairqueue.backlog(), 0)
+
+    def test_weight_scales_the_share(self):
+        with override_settings(FAIR_QUEUE_WEIGHTS={"key:big": 2}):
+            self.queue("key:big", 4)
+            self.queue("ip:small", 2)
+
+        order = [self.run_next() for _ in range(6)]
+        self.assertEqual(order[:3].count("key:big"), 2)
+
+    def test_only_free_slots_are_used(self):
+        self.queue("ip:a", 1)
+        self.queue("ip:b", 1)
+        self.assertEqual(fairqueue.dispatch(), 1)
+        self.assertEqual(fairqueue.dispatch(), 0)
+        self.assertEqual(fairqueue.backlog(), 1)
+
+    def test_failed_send_keeps_the_clients_place(self):
+        self.queue("ip:a", 2)
+        score = self.redis.zscore(fairqueue.CLIENTS_KEY, "ip:a")
+        self.send_task.side_effect = ConnectionError("broker down")
+
+        with self.assertRaises(ConnectionError):
+            fairqueue.dispatch()
+
+        self.assertEqual(self.redis.zscore(fairqueue.CLIENTS_KEY, "ip:a"), score)
+        self.assertEqual(self.redis.llen(fairqueue.pending_key("ip:a")), 2)
+        self.assertEqual(self.redis.scard(fairqueue.running_key("ip:a")), 0)
+
+    def test_broker_failure_after_queuing_still_answers(self):
+        self.send_task.side_effect = ConnectionError("broker down")
+        with mock.patch(
+            "downloader.cancellation.get_redis", return_value=fakeredis.FakeRedis()
+        ):
+            response = self.client.post(
+                "/start_download/",
+                data={"url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"},
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        task = DownloadTask.objects.get()
+        self.assertEqual(response.json()["task_id"], str(task.id))
+        # Parked for the beat fallback, not lost
+        self.assertEqual(fairqueue.backlog(), 1)
+        self.send_task.side_effect = None
+        self.assertEqual(fairqueue.dispatch_fair_queue(), 1)
+
+    @override_settings(DOWNLOAD_WORKER_MODE="asyncio")
+    def test_full_downloads_go_to_io_workers(self):
+        (task_id,) = self.queue("ip:a", 1)
+        self.assertEqual(fairqueue.dispatch(), 1)
+        self.send_task.assert_not_called()
+        entry = json.loads(self.redis.rpop(fairqueue.IO_QUEUE_KEY))
+        self.assertEqual(entry["task_id"], task_id)
@@ -0,0 +1,65 @@
+import json
+from io import StringIO
+from unittest import mock
+
+import fakeredis
+from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from downloader.loadtest import Subscriber, percentile
+
+
+class LoadTestHelperTests(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 51)
+        self.assertEqual(percentile(values, 0.99), 100)
+        self.assertEqual(percentile(values, 1.0), 100)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_subscriber_records_only_probe_events(self):
+        subscriber = Subscriber("task")
+        subscriber.record(json.dumps({"metadata": None}), 10.0)
+        subscriber.record(
+            json.dumps({"metadata": {"loadtest": {"seq": 3, "sent_at": 9.5}}}), 10.0
+        )
+        self.assertEqual(subscriber.received, {3})
+        self.assertEqual(subscriber.latencies, [0.5])
+
+
+class LoadTestCommandTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "downloader.cancellation.get_redis", return_value=fakeredis.FakeRedis()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # --layer=memory swaps the process-wide default layer
+        self.addCleanup(channel_layers.backends.pop, DEFAULT_CHANNEL_LAYER, None)
+
+    def test_in_process_run_delivers_every_event(self):
+        out = StringIO()
+        call_command(
+            "loadtest_progress",
+            "--tasks=2",
+            "--subscribers-per-task=2",
+            "--events-per-task=3",
+            "--rate=0",
+            "--layer=memory",
+            "--drain-timeout=2",
+            stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["connections"], 4)
+        self.assertEqual(report["connect_failures"], 0)
+        self.assertEqual(report["messages_expected"], 12)
+        self.assertEqual(report["messages_dropped"], 0)
+        self.assertIsNotNone(report["latency_ms"]["p99"])
+
+    def test_memory_layer_cannot_target_a_server(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "loadtest_progress", "--layer=memory", "--target=ws://localhost:8000"
+            )
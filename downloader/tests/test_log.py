@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from downloader.log import JsonFormatter, NonBlockingHandler, ProgressSampleFilter
+
+
+def progress_record(task_id="t1", stage="downloading_video", level=logging.INFO):
+    record = logging.LogRecord("downloader", level, __file__, 1, "progress", (), None)
+    record.event = "progress"
+    record.task_id = task_id
+    record.stage = stage
+    return record
+
+
+class ProgressSampleFilterTests(SimpleTestCase):
+    def test_samples_progress_per_task(self):
+        sample = ProgressSampleFilter(interval=5)
+        with mock.patch("downloader.log.time.monotonic", return_value=100.0):
+            self.assertTrue(sample.filter(progress_record()))
+            self.assertFalse(sample.filter(progress_record()))
+            self.assertTrue(sample.filter(progress_record(task_id="t2")))
+            # A new stage always gets through
+            self.assertTrue(sample.filter(progress_record(stage="uploading")))
+            self.assertTrue(
+                sample.filter(progress_record(stage="uploading", level=logging.WARNING))
+            )
+        with mock.patch("downloader.log.time.monotonic", return_value=105.0):
+            self.assertTrue(sample.filter(progress_record(stage="uploading")))
+
+    def test_other_records_pass(self):
+        record = logging.LogRecord(
+            "downloader", logging.INFO, __file__, 1, "x", (), None
+        )
+        sample = ProgressSampleFilter(interval=5)
+        self.assertTrue(sample.filter(record))
+        self.assertTrue(sample.filter(record))
+
+
+class JsonFormatterTests(SimpleTestCase):
+    def test_keeps_extra_fields(self):
+        entry = json.loads(JsonFormatter().format(progress_record()))
+        self.assertEqual(entry["msg"], "progress")
+        self.assertEqual(entry["task_id"], "t1")
+        self.assertEqual(entry["level"], "INFO")
+
+
+class NonBlockingHandlerTests(SimpleTestCase):
+    def test_forked_child_writes_its_records(self):
+        with tempfile.TemporaryFile("w+") as stream:
+            handler = NonBlockingHandler(stream)
+            self.addCleanup(handler.stop)
+            handler.handle(progress_record(task_id="parent"))
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    handler.handle(progress_record(task_id="child"))
+                    handler.stop()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            handler.stop()
+
+            stream.seek(0)
+            task_ids = [json.loads(line)["task_id"] for line in stream]
+        self.assertCountEqual(task_ids, ["parent", "child"])
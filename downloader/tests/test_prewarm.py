@@ -0,0 +1,112 @@
+from datetime import timedelta
+from unittest import mock
+
+import fakeredis
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from downloader.cancellation import cancel_abandoned_tasks
+from downloader.models import DownloadTask
+from downloader.prewarm import prewarm, rank_candidates, stored_output
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+OTHER_VIDEO = "https://www.youtube.com/watch?v=9bZkp7q19f0"
+
+
+def request_video(url, resolution="720p", count=1, **fields):
+    for _ in range(count):
+        DownloadTask.objects.create(url=url, resolution=resolution, **fields)
+
+
+@override_settings(
+    PREWARM_TOP_N=10, PREWARM_MIN_REQUESTS=2, PREWARM_RESOLUTIONS_PER_VIDEO=1
+)
+class RankCandidatesTests(TestCase):
+    def test_most_requested_first_with_top_resolution(self):
+        request_video(VIDEO, "720p", count=2)
+        request_video(VIDEO, "1080p", count=3)
+        request_video(OTHER_VIDEO, "360p", count=2)
+
+        self.assertEqual(
+            rank_candidates(),
+            [(VIDEO, [("1080p", True)]), (OTHER_VIDEO, [("360p", True)])],
+        )
+
+    def test_ignores_rare_clips_and_own_tasks(self):
+        request_video(VIDEO, count=1)
+        request_video(OTHER_VIDEO, count=2, clip_start=1.0, clip_end=5.0)
+        request_video(OTHER_VIDEO, count=2, client_id=settings.PREWARM_CLIENT_ID)
+
+        self.assertEqual(rank_candidates(), [])
+
+
+@override_settings(
+    PREWARM_TOP_N=10,
+    PREWARM_MIN_REQUESTS=2,
+    PREWARM_RESOLUTIONS_PER_VIDEO=1,
+    PREWARM_CPU_SECONDS=150,
+    PREWARM_BANDWIDTH_BYTES=10**12,
+)
+class PrewarmBudgetTests(TestCase):
+    def test_tasks_queued_before_the_budget_ran_out_are_dispatched(self):
+        request_video(VIDEO, count=3, status="failed")
+        request_video(OTHER_VIDEO, count=2, status="failed")
+
+        with mock.patch(
+            "downloader.prewarm.workers_idle", return_value=True
+        ), mock.patch(
+            "downloader.admission.service_times", return_value={"*": 100.0}
+        ), mock.patch(
+            "downloader.fairqueue.enqueue"
+        ) as enqueue, mock.patch(
+            "downloader.fairqueue.dispatch"
+        ) as dispatch:
+            result = prewarm()
+
+        self.assertEqual(result["skipped"], "budget")
+        self.assertEqual(result["queued"], [{"url": VIDEO, "resolution": "720p"}])
+        self.assertEqual(enqueue.call_count, 1)
+        dispatch.assert_called_once_with()
+
+
+class StoredOutputTests(TestCase):
+    def setUp(self):
+        self.task = DownloadTask.objects.create(
+            url=VIDEO,
+            resolution="720p",
+            status="completed",
+            file="video_720p.mp4",
+            storage_shard="a",
+            finished_at=timezone.now(),
+        )
+
+    def test_confirms_object_in_bucket(self):
+        with mock.patch(
+            "downloader.prewarm.find_stored_object", return_value=("b", 10)
+        ) as find:
+            task = stored_output(VIDEO, "720p", True)
+        find.assert_called_once_with("video_720p.mp4")
+        self.assertEqual(task, self.task)
+        # Served from the shard the object is on now
+        self.assertEqual(task.storage_shard, "b")
+
+    def test_missing_object_is_not_served(self):
+        with mock.patch("downloader.prewarm.find_stored_object", return_value=None):
+            self.assertIsNone(stored_output(VIDEO, "720p", True))
+
+
+@override_settings(ABANDON_AFTER_SECONDS=60)
+class AbandonedPrewarmTests(TestCase):
+    def test_prewarm_tasks_are_not_abandoned(self):
+        request_video(VIDEO, status="pending")
+        request_video(VIDEO, status="pending", client_id=settings.PREWARM_CLIENT_ID)
+        DownloadTask.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        with mock.patch(
+            "downloader.cancellation.get_redis", return_value=fakeredis.FakeRedis()
+        ), mock.patch(
+            "downloader.cancellation.cancel_task", return_value=True
+        ) as cancel:
+            self.assertEqual(cancel_abandoned_tasks(), 1)
+        self.assertEqual(cancel.call_args.args[0].client_id, "")
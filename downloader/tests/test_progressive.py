@@ -0,0 +1,141 @@
+import asyncio
+import io
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from downloader.models import DownloadTask
+from downloader.progressive import (
+    build_stream_cmd,
+    done_marker,
+    scratch_path,
+    stream_scratch_file,
+)
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class StreamCommandTests(TestCase):
+    def test_h264_is_copied_into_fragmented_mp4(self):
+        command = build_stream_cmd(
+            SimpleNamespace(url="https://v", video_codec="avc1.4d401f"),
+            SimpleNamespace(url="https://a"),
+            "/tmp/out.mp4",
+        )
+        self.assertIn("-c:v copy", command)
+        self.assertIn("empty_moov", command)
+        self.assertIn("-map 1:a:0", command)
+
+    def test_other_codecs_are_encoded(self):
+        command = build_stream_cmd(
+            SimpleNamespace(url="https://v", video_codec="vp9"), None, "/tmp/out.mp4"
+        )
+        self.assertIn("libx264", command)
+        self.assertNotIn("-map 1:a:0", command)
+
+
+@override_settings(
+    PROGRESSIVE_POLL_INTERVAL=0.01,
+    PROGRESSIVE_IDLE_TIMEOUT=5,
+    PROGRESSIVE_CHUNK_SIZE=4,
+)
+class ProgressiveStreamTests(TestCase):
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        scratch_dir = override_settings(PROGRESSIVE_SCRATCH_DIR=scratch.name)
+        scratch_dir.enable()
+        self.addCleanup(scratch_dir.disable)
+        patcher = mock.patch(
+            "downloader.cancellation.get_redis", return_value=fakeredis.FakeRedis()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.task = DownloadTask.objects.create(
+            url=VIDEO, progressive=True, status="in_progress"
+        )
+
+    def test_follows_the_file_until_the_worker_is_done(self):
+        path = scratch_path(self.task.id)
+
+        async def produce():
+            for part in (b"fragment-1", b"fragment-2"):
+                with open(path, "ab") as f:
+                    f.write(part)
+                await asyncio.sleep(0.05)
+            open(done_marker(path), "w").close()
+
+        async def consume():
+            producer = asyncio.create_task(produce())
+            received = b"".join(
+                [chunk async for chunk in stream_scratch_file(self.task.id)]
+            )
+            await producer
+            return received
+
+        self.assertEqual(async_to_sync(consume)(), b"fragment-1fragment-2")
+
+    def test_rest_is_drained_in_chunks_once_done(self):
+        path = scratch_path(self.task.id)
+        with open(path, "wb") as f:
+            f.write(b"0123456789")
+        open(done_marker(path), "w").close()
+
+        class LateFile(io.BytesIO):
+            """Looks empty on the first read, as if ffmpeg wrote right after."""
+
+            reads = []
+
+            def read(self, size=-1):
+                self.reads.append(size)
+                if len(self.reads) == 1:
+                    return b""
+                return super().read(size)
+
+        async def consume():
+            return [chunk async for chunk in stream_scratch_file(self.task.id)]
+
+        with mock.patch(
+            "downloader.progressive.open",
+            lambda *args: LateFile(b"0123456789"),
+            create=True,
+        ):
+            chunks = async_to_sync(consume)()
+        self.assertEqual(b"".join(chunks), b"0123456789")
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+        self.assertNotIn(-1, LateFile.reads)
+
+    def test_stops_when_the_task_fails(self):
+        with open(scratch_path(self.task.id), "wb") as f:
+            f.write(b"partial")
+        DownloadTask.objects.filter(id=self.task.id).update(status="failed")
+
+        async def consume():
+            return b"".join(
+                [chunk async for chunk in stream_scratch_file(self.task.id)]
+            )
+
+        self.assertEqual(async_to_sync(consume)(), b"partial")
+
+
+class ProgressiveViewTests(TestCase):
+    def test_finished_task_redirects_to_storage(self):
+        task = DownloadTask.objects.create(
+            url=VIDEO, progressive=True, status="completed", file="v.mp4"
+        )
+        with mock.patch(
+            "downloader.views.generate_s3_signed_url", return_value="https://r2/v.mp4"
+        ):
+            response = self.client.get(f"/progressive/{task.id}/")
+        self.assertRedirects(
+            response, "https://r2/v.mp4", fetch_redirect_response=False
+        )
+
+    def test_non_progressive_task_has_no_stream(self):
+        task = DownloadTask.objects.create(url=VIDEO, status="in_progress")
+        response = self.client.get(f"/progressive/{task.id}/")
+        self.assertEqual(response.status_code, 409)
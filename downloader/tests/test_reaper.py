@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase, override_settings
+
+from downloader import reaper
+from downloader.models import DownloadTask
+
+
+@override_settings(HEARTBEAT_TIMEOUT=60, REAPER_MAX_REQUEUES=1)
+class ReaperTests(TestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+        patchers = [
+            mock.patch("downloader.reaper.get_redis", return_value=self.redis),
+            mock.patch(
+                "downloader.fairqueue.get_redis",
+                return_value=fakeredis.FakeRedis(server=server, decode_responses=True),
+            ),
+            mock.patch("downloader.fairqueue._scripts", {}),
+            mock.patch("downloader.fairqueue.dispatch", return_value=0),
+            mock.patch("downloader.reaper.socket.gethostname", return_value="worker-a"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def running_task(self, host="worker-a", beat_age=120):
+        task = DownloadTask.objects.create(
+            url="https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            status="in_progress",
+            stage="downloading_video",
+        )
+        scratch = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(lambda: os.path.exists(scratch) and os.remove(scratch))
+        self.redis.zadd(reaper.HEARTBEATS_KEY, {str(task.id): time.time() - beat_age})
+        self.redis.hset(
+            reaper.worker_key(task.id),
+            mapping={"host": host, "pid": 1, "paths": json.dumps([scratch])},
+        )
+        return task, scratch
+
+    def test_requeues_then_fails(self):
+        task, scratch = self.running_task()
+
+        self.assertEqual(reaper.reap_stuck_tasks()["requeued"], 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, "pending")
+        self.assertFalse(os.path.exists(scratch))
+
+        DownloadTask.objects.filter(id=task.id).update(status="in_progress")
+        self.redis.zadd(reaper.HEARTBEATS_KEY, {str(task.id): time.time() - 120})
+        self.assertEqual(reaper.reap_stuck_tasks()["failed"], 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, "failed")
+        self.assertEqual(reaper.reaper_stats()["requeued_total"], 1)
+
+    def test_live_heartbeat_is_left_alone(self):
+        task, scratch = self.running_task(beat_age=5)
+
+        self.assertEqual(reaper.reap_stuck_tasks(), {"requeued": 0, "failed": 0})
+        task.refresh_from_db()
+        self.assertEqual(task.status, "in_progress")
+        self.assertTrue(os.path.exists(scratch))
+
+    def test_remote_scratch_files_are_left_to_their_host(self):
+        task, scratch = self.running_task(host="worker-b")
+
+        reaper.reap_stuck_tasks()
+        self.assertTrue(os.path.exists(scratch))
+        self.assertEqual(self.redis.smembers(reaper.orphans_key("worker-b")), {scratch})
+
+        with mock.patch(
+            "downloader.reaper.socket.gethostname", return_value="worker-b"
+        ):
+            self.assertEqual(reaper.sweep_orphans(), 1)
+        self.assertFalse(os.path.exists(scratch))
+        self.assertFalse(self.redis.exists(reaper.orphans_key("worker-b")))
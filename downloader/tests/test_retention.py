@@ -0,0 +1,93 @@
+import gzip
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from downloader import retention
+from downloader.models import DownloadTask
+
+VIDEO = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def aged_task(days, **fields):
+    task = DownloadTask.objects.create(url=VIDEO, **fields)
+    DownloadTask.objects.filter(pk=task.pk).update(
+        created_at=timezone.now() - timedelta(days=days)
+    )
+    return task
+
+
+@override_settings(
+    DOWNLOAD_TASK_RETENTION_DAYS=30,
+    TASK_RESULT_RETENTION_DAYS=7,
+    RETENTION_BATCH_SIZE=2,
+    RETENTION_BATCH_PAUSE=0,
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+)
+class PurgeTests(TestCase):
+    def test_archives_and_deletes_old_finished_tasks(self):
+        expired = [
+            aged_task(40, status=status) for status in retention.FINISHED_STATUSES
+        ]
+        running = aged_task(40, status="in_progress")
+        recent = aged_task(5, status="completed")
+
+        summary = retention.purge_expired_records()
+
+        self.assertEqual(summary["download_tasks"], 3)
+        self.assertCountEqual(
+            DownloadTask.objects.values_list("pk", flat=True), [running.pk, recent.pk]
+        )
+        archived = []
+        for key in self.archive_keys():
+            with default_storage.open(key) as f:
+                archived += [
+                    json.loads(line)["id"]
+                    for line in gzip.decompress(f.read()).decode().splitlines()
+                ]
+        self.assertCountEqual(archived, [str(task.pk) for task in expired])
+
+    def archive_keys(self, path=None):
+        path = path or settings.RETENTION_ARCHIVE_PREFIX
+        directories, files = default_storage.listdir(path)
+        keys = [f"{path}/{name}" for name in files]
+        for directory in directories:
+            keys += self.archive_keys(f"{path}/{directory}")
+        return keys
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning needs PostgreSQL")
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+)
+class PartitionTests(TestCase):
+    def test_partition_with_unfinished_tasks_is_kept(self):
+        aged_task(120, status="completed")
+        pending = aged_task(120, status="pending")
+        call_command("partition_download_tasks", stdout=StringIO())
+
+        name, *_ = retention.expired_partitions(timezone.now() - timedelta(days=60))
+        self.assertFalse(retention.drop_partition(name, 100))
+        self.assertEqual(DownloadTask.objects.count(), 2)
+
+        DownloadTask.objects.filter(pk=pending.pk).update(status="failed")
+        self.assertTrue(retention.drop_partition(name, 100))
+        self.assertEqual(DownloadTask.objects.count(), 0)
@@ -0,0 +1,20 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+
+class StartupCostTests(SimpleTestCase):
+    def measure(self, role):
+        out = StringIO()
+        call_command("benchmark_startup", role=[role], repeat=1, stdout=out)
+        return json.loads(out.getvalue())[role]
+
+    def test_web_does_not_load_worker_libraries(self):
+        self.assertEqual(self.measure("web")["heavy_loaded"], [])
+
+    def test_worker_preloads_them_at_startup(self):
+        heavy = self.measure("worker")["heavy_loaded"]
+        self.assertIn("boto3", heavy)
+        self.assertIn("pytubefix", heavy)
@@ -0,0 +1,173 @@
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from downloader import rebalance
+from downloader.eviction import evict, select_victims
+from downloader.models import StoredObject
+from downloader.storage import HashRing, record_access
+
+KEYS = [f"video_{i}.mp4" for i in range(5000)]
+
+
+class HashRingTests(SimpleTestCase):
+    def test_placement_follows_weights(self):
+        ring = HashRing({"a": 1, "b": 3}, vnodes=200)
+        placed = Counter(ring.locate(key) for key in KEYS)
+        self.assertAlmostEqual(placed["b"] / len(KEYS), 0.75, delta=0.05)
+
+    def test_new_shard_only_takes_keys(self):
+        before = HashRing({"a": 1, "b": 1}, vnodes=200)
+        after = HashRing({"a": 1, "b": 1, "c": 1}, vnodes=200)
+        moved = [key for key in KEYS if before.locate(key) != after.locate(key)]
+        self.assertTrue(all(after.locate(key) == "c" for key in moved))
+        self.assertAlmostEqual(len(moved) / len(KEYS), 1 / 3, delta=0.05)
+
+    def test_zero_weight_gets_nothing(self):
+        ring = HashRing({"a": 1, "old": 0}, vnodes=50)
+        self.assertEqual({ring.locate(key) for key in KEYS[:500]}, {"a"})
+        with self.assertRaises(ValueError):
+            HashRing({"old": 0})
+
+
+class RebalanceTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.clients = {}
+        patchers = [
+            mock.patch("downloader.rebalance.get_redis", return_value=self.redis),
+            mock.patch("downloader.rebalance.shard_for", return_value="b"),
+            mock.patch("downloader.rebalance.move_object"),
+            mock.patch(
+                "downloader.rebalance.shard_client", side_effect=self.fake_shard_client
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_shard_client(self, shard):
+        return self.clients.setdefault(shard, mock.Mock()), f"bucket-{shard}"
+
+    def test_moves_and_deletes_the_source(self):
+        StoredObject.objects.create(key="v.mp4", shard="a", size=10)
+
+        summary = rebalance.rebalance()
+
+        self.assertEqual(summary["moves"], {"a->b": 1})
+        self.assertEqual(StoredObject.objects.get(key="v.mp4").shard, "b")
+        self.clients["a"].delete_object.assert_called_once_with(
+            Bucket="bucket-a", Key="v.mp4"
+        )
+
+    def test_pinned_source_is_deleted_once_the_url_expired(self):
+        obj = StoredObject.objects.create(key="v.mp4", shard="a", size=10)
+        # A URL for the old copy is handed out while the copy runs
+        with mock.patch(
+            "downloader.rebalance.move_object",
+            side_effect=lambda *args: StoredObject.objects.filter(pk=obj.pk).update(
+                pinned_until=timezone.now() + timedelta(hours=1)
+            ),
+        ):
+            summary = rebalance.rebalance()
+        self.assertEqual(summary["left_behind"], ["a:v.mp4"])
+        self.assertNotIn("a", self.clients)
+
+        self.assertEqual(rebalance.rebalance()["deleted_left_behind"], 0)
+        with mock.patch(
+            "downloader.rebalance.time.time",
+            return_value=(timezone.now() + timedelta(hours=2)).timestamp(),
+        ):
+            self.assertEqual(rebalance.rebalance()["deleted_left_behind"], 1)
+        self.clients["a"].delete_object.assert_called_once_with(
+            Bucket="bucket-a", Key="v.mp4"
+        )
+        self.assertEqual(self.redis.zcard(rebalance.LEFT_BEHIND_KEY), 0)
+
+
+class RecordAccessTests(TestCase):
+    def test_counts_and_pins_tracked_objects(self):
+        StoredObject.objects.create(key="v.mp4", size=10)
+
+        record_access("v.mp4")
+
+        obj = StoredObject.objects.get(key="v.mp4")
+        self.assertEqual(obj.access_count, 1)
+        self.assertGreater(obj.pinned_until, timezone.now())
+
+    def test_untracked_key_creates_no_row(self):
+        record_access("missing.mp4")
+        self.assertFalse(StoredObject.objects.exists())
+
+
+class EvictionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.bucket = mock.Mock()
+        patcher = mock.patch(
+            "downloader.eviction.shard_client", return_value=(self.bucket, "bucket")
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored(self, key, size, idle_hours, access_count=0, pinned=False):
+        return StoredObject.objects.create(
+            key=key,
+            size=size,
+            access_count=access_count,
+            last_accessed_at=self.now - timedelta(hours=idle_hours),
+            pinned_until=self.now + timedelta(hours=1) if pinned else None,
+        )
+
+    def test_lru_evicts_cold_large_objects_first(self):
+        self.stored("cold.mp4", 100, idle_hours=48)
+        self.stored("warm.mp4", 100, idle_hours=1)
+        self.stored("pinned.mp4", 500, idle_hours=96, pinned=True)
+
+        victims, used = select_victims(650, "lru", self.now)
+
+        self.assertEqual(used, 700)
+        self.assertEqual([obj.key for obj in victims], ["cold.mp4"])
+
+    def test_lfu_prefers_rarely_used(self):
+        self.stored("popular.mp4", 100, idle_hours=48, access_count=50)
+        self.stored("rare.mp4", 100, idle_hours=1, access_count=0)
+
+        victims, _ = select_victims(150, "lfu", self.now)
+
+        self.assertEqual([obj.key for obj in victims], ["rare.mp4"])
+
+    def test_evict_deletes_rows_and_objects(self):
+        self.stored("cold.mp4", 100, idle_hours=48)
+        self.stored("warm.mp4", 100, idle_hours=1)
+
+        summary = evict(budget_bytes=150, policy="lru")
+
+        self.assertEqual(summary["evicted"], ["cold.mp4"])
+        self.assertEqual(summary["freed_bytes"], 100)
+        self.bucket.delete_object.assert_called_once_with(
+            Bucket="bucket", Key="cold.mp4"
+        )
+        self.assertEqual(
+            list(StoredObject.objects.values_list("key", flat=True)), ["warm.mp4"]
+        )
+
+    def test_failed_bucket_delete_keeps_the_row_and_moves_on(self):
+        self.stored("colder.mp4", 100, idle_hours=96)
+        self.stored("cold.mp4", 100, idle_hours=48)
+        self.stored("warm.mp4", 100, idle_hours=1)
+        self.bucket.delete_object.side_effect = [Exception("AccessDenied"), None]
+
+        summary = evict(budget_bytes=150, policy="lru")
+
+        self.assertEqual(summary["failed"], ["colder.mp4"])
+        self.assertEqual(summary["evicted"], ["cold.mp4"])
+        self.assertEqual(summary["freed_bytes"], 100)
+        self.assertEqual(
+            sorted(StoredObject.objects.values_list("key", flat=True)),
+            ["colder.mp4", "warm.mp4"],
+        )
@@ -0,0 +1,87 @@
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase, override_settings
+
+from downloader.uploads import (
+    MAX_PARTS,
+    MIN_PART_SIZE,
+    UploadPlan,
+    load_tuning,
+    next_tuning,
+    plan_upload,
+    record_upload_metrics,
+)
+
+MiB = 1024**2
+
+
+@override_settings(
+    UPLOAD_MIN_PART_SIZE=8 * MiB,
+    UPLOAD_MAX_PART_SIZE=512 * MiB,
+    UPLOAD_TARGET_PART_SECONDS=4,
+    UPLOAD_DEFAULT_THROUGHPUT=8 * MiB,
+    UPLOAD_MIN_CONCURRENCY=4,
+    UPLOAD_MAX_CONCURRENCY=32,
+)
+class UploadTuningTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("downloader.uploads.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tuning(self, **fields):
+        return {
+            "concurrency": 4,
+            "direction": 1,
+            "throughput": None,
+            "per_connection": 8 * MiB,
+            **fields,
+        }
+
+    def test_parts_take_target_seconds_per_connection(self):
+        plan = plan_upload(1024 * MiB, self.tuning())
+        self.assertEqual(plan, UploadPlan(part_size=32 * MiB, concurrency=4))
+
+    def test_small_files_use_fewer_larger_than_minimum_parts(self):
+        plan = plan_upload(10 * MiB, self.tuning())
+        self.assertEqual(plan.part_size, MIN_PART_SIZE)
+        self.assertEqual(plan.concurrency, 2)
+
+    def test_huge_files_stay_under_the_part_limit(self):
+        size = 1024**4
+        plan = plan_upload(size, self.tuning())
+        self.assertLessEqual(plan.parts(size), MAX_PARTS)
+        self.assertEqual(plan.part_size % MiB, 0)
+
+    def test_concurrency_climbs_while_throughput_improves(self):
+        plan = UploadPlan(part_size=32 * MiB, concurrency=4)
+        tuning = next_tuning(self.tuning(throughput=40 * MiB), plan, 60 * MiB)
+        self.assertEqual(tuning["concurrency"], 6)
+        self.assertEqual(tuning["throughput"], 60 * MiB)
+
+    def test_concurrency_turns_around_when_throughput_drops(self):
+        plan = UploadPlan(part_size=32 * MiB, concurrency=8)
+        tuning = next_tuning(self.tuning(throughput=60 * MiB), plan, 40 * MiB)
+        self.assertEqual(tuning["direction"], -1)
+        self.assertEqual(tuning["concurrency"], 6)
+
+    def test_noise_keeps_concurrency(self):
+        plan = UploadPlan(part_size=32 * MiB, concurrency=8)
+        tuning = next_tuning(self.tuning(throughput=60 * MiB), plan, 62 * MiB)
+        self.assertEqual(tuning["concurrency"], 8)
+
+    def test_single_part_uploads_only_update_the_rate(self):
+        plan = UploadPlan(part_size=8 * MiB, concurrency=1)
+        tuning = next_tuning(self.tuning(), plan, 18 * MiB)
+        self.assertEqual(tuning["concurrency"], 4)
+        self.assertAlmostEqual(tuning["per_connection"], 0.3 * 18 * MiB + 0.7 * 8 * MiB)
+
+    def test_metrics_are_shared_through_redis(self):
+        plan = UploadPlan(part_size=32 * MiB, concurrency=4)
+        sample = record_upload_metrics("video.mp4", 400 * MiB, 10, plan)
+        self.assertEqual(sample["throughput"], 40 * MiB)
+        tuning = load_tuning()
+        self.assertEqual(tuning["concurrency"], 6)
+        self.assertEqual(tuning["throughput"], 40 * MiB)
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import socket
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from downloader import webhooks
+from downloader.webhooks import (
+    QUEUE_KEY,
+    WebhookDispatcher,
+    enqueue_webhook,
+    sign_payload,
+    validate_webhook_url,
+)
+
+
+def resolves_to(*addresses):
+    return mock.patch(
+        "downloader.webhooks.socket.getaddrinfo",
+        return_value=[
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, 0))
+            for address in addresses
+        ],
+    )
+
+
+@override_settings(WEBHOOK_SIGNING_SECRET="hook-secret")
+class WebhookUrlTests(SimpleTestCase):
+    def test_public_host_is_accepted(self):
+        with resolves_to("93.184.216.34"):
+            validate_webhook_url("https://example.com/hook")
+
+    def test_private_and_loopback_hosts_are_rejected(self):
+        for address in ("127.0.0.1", "10.0.0.5", "169.254.169.254", "::1"):
+            with self.subTest(address=address), resolves_to("93.184.216.34", address):
+                with self.assertRaises(ValidationError):
+                    validate_webhook_url("https://example.com/hook")
+
+    def test_non_http_scheme_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            validate_webhook_url("ftp://example.com/hook")
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+    def test_private_hosts_allowed_for_development(self):
+        validate_webhook_url("http://localhost:8080/hook")
+
+    @override_settings(WEBHOOK_SIGNING_SECRET="")
+    def test_rejected_without_signing_secret(self):
+        with resolves_to("93.184.216.34"), self.assertRaises(ValidationError):
+            validate_webhook_url("https://example.com/hook")
+
+
+class SigningTests(SimpleTestCase):
+    def test_signature_covers_timestamp_and_body(self):
+        expected = hmac.new(b"s", b"1700000000.{}", hashlib.sha256).hexdigest()
+        self.assertEqual(sign_payload("{}", "1700000000", secret="s"), expected)
+
+    @override_settings(WEBHOOK_SIGNING_SECRET="")
+    def test_no_fallback_secret(self):
+        with self.assertRaises(ImproperlyConfigured):
+            sign_payload("{}", "1700000000")
+        with self.assertRaises(ImproperlyConfigured):
+            WebhookDispatcher()
+
+
+@override_settings(WEBHOOK_SIGNING_SECRET="hook-secret")
+class StartDownloadWebhookTests(TestCase):
+    def test_private_webhook_url_is_rejected(self):
+        with resolves_to("192.168.1.10"):
+            response = self.client.post(
+                "/start_download/",
+                data={
+                    "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+                    "webhook_url": "http://router.example/hook",
+                },
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("webhook", response.json()["error"])
+
+
+@override_settings(
+    WEBHOOK_SIGNING_SECRET="hook-secret", WEBHOOK_ALLOW_PRIVATE_HOSTS=True
+)
+class DeliveryTests(SimpleTestCase):
+    def test_delivers_signed_event(self):
+        task = SimpleNamespace(
+            id="t1", status="completed", stage="completed", webhook_url=None
+        )
+        received = []
+
+        async def receiver(request):
+            received.append((dict(request.headers), await request.text()))
+            return web.Response()
+
+        async def deliver():
+            app = web.Application()
+            app.router.add_post("/hook", receiver)
+            async with TestServer(app) as server:
+                task.webhook_url = str(server.make_url("/hook"))
+                enqueue_webhook(task, "task.completed", download_url="https://dl")
+                dispatcher = WebhookDispatcher(redis_url="redis://unused")
+                with mock.patch(
+                    "redis.asyncio.from_url",
+                    return_value=fakeredis.aioredis.FakeRedis(server=redis_server),
+                ):
+                    runner = asyncio.create_task(dispatcher.run())
+                    while not received:
+                        await asyncio.sleep(0.05)
+                    dispatcher.stop()
+                    await runner
+            return dispatcher
+
+        redis_server = fakeredis.FakeServer()
+        client = fakeredis.FakeRedis(server=redis_server)
+        with mock.patch.object(webhooks, "get_redis", return_value=client):
+            dispatcher = asyncio.run(asyncio.wait_for(deliver(), 10))
+
+        headers, body = received[0]
+        self.assertEqual(json.loads(body)["event"], "task.completed")
+        self.assertEqual(
+            headers["X-Webhook-Signature"],
+            f"sha256={sign_payload(body, headers['X-Webhook-Timestamp'])}",
+        )
+        self.assertEqual(dispatcher.stats["delivered"], 1)
+        # Nothing is left marked as in progress
+        self.assertEqual(client.llen(dispatcher.processing_key), 0)
+
+    def test_unfinished_items_of_a_crashed_run_are_delivered(self):
+        received = []
+
+        async def receiver(request):
+            received.append(json.loads(await request.text())["task_id"])
+            return web.Response()
+
+        async def restart():
+            app = web.Application()
+            app.router.add_post("/hook", receiver)
+            async with TestServer(app) as server:
+                dispatcher = WebhookDispatcher(redis_url="redis://unused", name="w1")
+                item = {
+                    "id": "d1",
+                    "url": str(server.make_url("/hook")),
+                    "body": json.dumps({"task_id": "t1"}),
+                    "attempt": 0,
+                }
+                # Taken off the queue by a run that died before delivering
+                client.lpush(dispatcher.processing_key, json.dumps(item))
+                with mock.patch(
+                    "redis.asyncio.from_url",
+                    return_value=fakeredis.aioredis.FakeRedis(server=redis_server),
+                ):
+                    runner = asyncio.create_task(dispatcher.run())
+                    while not received:
+                        await asyncio.sleep(0.05)
+                    dispatcher.stop()
+                    await runner
+            return dispatcher
+
+        redis_server = fakeredis.FakeServer()
+        client = fakeredis.FakeRedis(server=redis_server)
+        dispatcher = asyncio.run(asyncio.wait_for(restart(), 10))
+
+        self.assertEqual(received, ["t1"])
+        self.assertEqual(client.llen(dispatcher.processing_key), 0)
+        self.assertEqual(client.llen(webhooks.QUEUE_KEY), 0)
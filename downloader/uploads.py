@@ -0,0 +1,188 @@
+"""
+Part sizing and concurrency for multipart uploads to the bucket.
+
+Finished uploads report their throughput to Redis, so every worker process
+plans from what the others measured. Parts are sized from the per-connection
+rate. Concurrency is hill-climbed on the aggregate rate: keep moving while
+throughput improves, turn around when it drops.
+"""
+
+import json
+import math
+import time
+from dataclasses import dataclass
+
+import redis
+from django.conf import settings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * 1024**2  # S3 minimum for every part but the last
+PART_ALIGNMENT = 1024**2
+TUNING_KEY = "uploads:tuning"
+RECENT_KEY = "uploads:recent"
+RECENT_SAMPLES = 200
+# Weight of the newest measurement in the per-connection rate
+SMOOTHING = 0.3
+# Throughput changes smaller than this are treated as noise
+TOLERANCE = 0.1
+CONCURRENCY_STEP = 2
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.TASK_STATE_REDIS_URL)
+    return _redis_client
+
+
+@dataclass
+class UploadPlan:
+    part_size: int
+    concurrency: int
+
+    def parts(self, file_size):
+        return max(1, math.ceil(file_size / self.part_size))
+
+
+def clamp_concurrency(concurrency):
+    return max(
+        settings.UPLOAD_MIN_CONCURRENCY,
+        min(settings.UPLOAD_MAX_CONCURRENCY, concurrency),
+    )
+
+
+def load_tuning():
+    """Shared tuning state; defaults when nothing was measured or Redis is down."""
+    tuning = {
+        "concurrency": settings.UPLOAD_MIN_CONCURRENCY,
+        "direction": 1,
+        "throughput": None,
+        "per_connection": float(settings.UPLOAD_DEFAULT_THROUGHPUT),
+    }
+    try:
+        raw = get_redis().hgetall(TUNING_KEY)
+    except redis.RedisError as e:
+        logger.info(f"Could not load upload tuning: {e}")
+        return tuning
+    if b"concurrency" in raw:
+        tuning["concurrency"] = int(raw[b"concurrency"])
+        tuning["direction"] = int(raw[b"direction"])
+        tuning["per_connection"] = float(raw[b"per_connection"])
+    if b"throughput" in raw:
+        tuning["throughput"] = float(raw[b"throughput"])
+    return tuning
+
+
+def plan_upload(file_size, tuning=None):
+    """Part size and thread count for uploading ``file_size`` bytes."""
+    tuning = tuning or load_tuning()
+    concurrency = clamp_concurrency(tuning["concurrency"])
+
+    part_size = tuning["per_connection"] * settings.UPLOAD_TARGET_PART_SECONDS
+    part_size = max(
+        settings.UPLOAD_MIN_PART_SIZE, min(settings.UPLOAD_MAX_PART_SIZE, part_size)
+    )
+    # Enough parts to keep every connection busy...
+    part_size = min(part_size, math.ceil(file_size / concurrency))
+    # ...without going under the S3 minimum or over the part limit
+    part_size = max(part_size, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+    part_size = math.ceil(part_size / PART_ALIGNMENT) * PART_ALIGNMENT
+
+    plan = UploadPlan(part_size=part_size, concurrency=concurrency)
+    plan.concurrency = min(concurrency, plan.parts(file_size))
+    return plan
+
+
+def next_tuning(tuning, plan, throughput):
+    """
+    Tuning state after an upload at ``plan.concurrency`` reached ``throughput``
+    bytes/s. Single-part uploads only update the per-connection rate.
+    """
+    tuning = dict(tuning)
+    per_connection = throughput / plan.concurrency
+    tuning["per_connection"] = (
+        SMOOTHING * per_connection + (1 - SMOOTHING) * tuning["per_connection"]
+    )
+    if plan.concurrency < settings.UPLOAD_MIN_CONCURRENCY:
+        # Too few parts to say anything about the concurrency
+        return tuning
+
+    previous = tuning["throughput"]
+    step = CONCURRENCY_STEP
+    if previous is not None and throughput < previous * (1 - TOLERANCE):
+        tuning["direction"] = -tuning["direction"]
+    elif previous is not None and throughput <= previous * (1 + TOLERANCE):
+        step = 0
+    tuning["concurrency"] = clamp_concurrency(
+        plan.concurrency + step * tuning["direction"]
+    )
+    tuning["throughput"] = throughput
+    return tuning
+
+
+def record_upload_metrics(key, file_size, seconds, plan):
+    """Log the upload, keep it in the recent samples and retune."""
+    throughput = file_size / seconds if seconds > 0 else 0.0
+    sample = {
+        "key": key,
+        "bytes": file_size,
+        "seconds": round(seconds, 3),
+        "throughput": round(throughput),
+        "part_size": plan.part_size,
+        "parts": plan.parts(file_size),
+        "concurrency": plan.concurrency,
+        "at": time.time(),
+    }
+    logger.info(
+        f"Uploaded {key}: {file_size} bytes at {throughput / 1024**2:.1f} MiB/s",
+        extra={"event": "upload", **sample},
+    )
+    if not throughput:
+        return sample
+
+    try:
+        client = get_redis()
+        tuning = next_tuning(load_tuning(), plan, throughput)
+        pipe = client.pipeline()
+        pipe.hset(
+            TUNING_KEY,
+            mapping={k: v for k, v in tuning.items() if v is not None},
+        )
+        pipe.lpush(RECENT_KEY, json.dumps(sample))
+        pipe.ltrim(RECENT_KEY, 0, RECENT_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.info(f"Could not record upload metrics: {e}")
+    return sample
+
+
+def upload_stats():
+    """Throughput summary of the recent uploads, for dashboards."""
+    client = get_redis()
+    samples = [json.loads(raw) for raw in client.lrange(RECENT_KEY, 0, -1)]
+    rates = sorted(sample["throughput"] for sample in samples)
+
+    def percentile(q):
+        if not rates:
+            return None
+        return rates[min(len(rates) - 1, int(q * len(rates)))]
+
+    total_bytes = sum(sample["bytes"] for sample in samples)
+    total_seconds = sum(sample["seconds"] for sample in samples)
+    return {
+        "uploads": len(samples),
+        "bytes": total_bytes,
+        "throughput_mean": (
+            round(total_bytes / total_seconds) if total_seconds else None
+        ),
+        "throughput_p50": percentile(0.5),
+        "throughput_p95": percentile(0.95),
+        "parts_max": max((sample["parts"] for sample in samples), default=None),
+        "tuning": load_tuning(),
+    }
@@ -2,11 +2,17 @@ from django.urls import path
 from .views import start_download, check_status
 from .views import index
 from .views import download_file
+from .views import progressive_download
+from .views import cancel_download
+from .views import bulk_check_status
 
 urlpatterns = [
     path('', index, name='index'),  # Home page that renders the HTML template
     path('start_download/', start_download, name='start_download'),
+    path('check_status/', bulk_check_status, name='bulk_check_status'),
     path('check_status/<uuid:task_id>/', check_status, name='check_status'),
+    path('progressive/<uuid:task_id>/', progressive_download, name='progressive_download'),
+    path('cancel/<uuid:task_id>/', cancel_download, name='cancel_download'),
         path('download/<str:signed_filename>/', download_file, name='download_file'),
 
 ]
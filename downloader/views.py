@@ -1,21 +1,54 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import (
+    JsonResponse,
+    HttpResponse,
+    Http404,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from .models import DownloadTask
-from .tasks import download_video
+from . import admission, fairqueue
+from .clips import parse_timestamp
+from .cancellation import ACTIVE_STATUSES, cancel_task, touch, touch_many
+from .storage import generate_s3_signed_url
+from .prewarm import stored_output
+from .progressive import stream_scratch_file
+from .webhooks import enqueue_webhook, validate_webhook_url
+from asgiref.sync import sync_to_async
+from youtube_downloader.celery import app as celery_app
 from django.views.decorators.csrf import csrf_exempt
 from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
 import json
+import math
 import os
 import re
 import urllib.parse
+import uuid
+import redis
 import logging
 
 logger = logging.getLogger(__name__)
 signer = TimestampSigner()
 
+# Fields of a bulk status entry, the task id is the key
+BULK_STATUS_FIELDS = (
+    "id",
+    "status",
+    "stage",
+    "progress",
+    "eta_at",
+    "file",
+    "file_size",
+)
+
 
 # Utility function to validate YouTube URL
 def validate_youtube_url(url):
@@ -37,6 +70,9 @@ def start_download(request):
         url = data.get("url")
         resolution = data.get("resolution", "highest-available")
         include_audio = data.get("include_audio", True)
+        webhook_url = data.get("webhook_url")
+        progressive = bool(data.get("progressive", False))
+        frame_accurate = bool(data.get("frame_accurate", False))
 
         if not url:
             return JsonResponse({"error": "URL is required"}, status=400)
@@ -48,9 +84,31 @@ def start_download(request):
         except ValidationError:
             return JsonResponse({"error": "Invalid URL"}, status=400)
 
+        if webhook_url:
+            try:
+                validate_webhook_url(webhook_url)
+            except ValidationError as e:
+                return JsonResponse(
+                    {"error": f"Invalid webhook URL: {e.messages[0]}"}, status=400
+                )
+
+        clip_start = clip_end = None
+        if data.get("start") is not None or data.get("end") is not None:
+            try:
+                clip_start = parse_timestamp(data.get("start") or 0)
+                clip_end = parse_timestamp(data["end"])
+            except (KeyError, TypeError, ValueError):
+                return JsonResponse(
+                    {"error": "start and end must be seconds or HH:MM:SS"}, status=400
+                )
+            if clip_end <= clip_start:
+                return JsonResponse({"error": "end must be after start"}, status=400)
+            # Clips are cut in one pass, there is no fragmented output to follow
+            progressive = False
+
         # Check for existing task to prevent duplication
         existing_task = DownloadTask.objects.filter(
-            url=url, status="in_progress"
+            url=url, status="in_progress", clip_start=clip_start, clip_end=clip_end
         ).first()
         if existing_task:
             return JsonResponse(
@@ -62,12 +120,83 @@ def start_download(request):
                 }
             )
 
+        # Popular videos are pre-processed off-peak; hand out the stored copy
+        cached = (
+            stored_output(url, resolution, include_audio)
+            if clip_start is None
+            else None
+        )
+        if cached:
+            now = timezone.now()
+            task = DownloadTask.objects.create(
+                url=url,
+                resolution=resolution,
+                include_audio=include_audio,
+                webhook_url=webhook_url,
+                client_id=fairqueue.client_identity(request),
+                status="completed",
+                stage="completed",
+                progress=100.0,
+                started_at=now,
+                finished_at=now,
+                file=cached.file.name,
+                file_size=cached.file_size,
+                storage_shard=cached.storage_shard,
+            )
+            task.callback_url = (
+                f"{request.scheme}://{request.get_host()}/ws/download/{task.id}"
+            )
+            task.save(update_fields=["callback_url"])
+            download_url = generate_s3_signed_url(task.file.name, task.storage_shard)
+            enqueue_webhook(task, "task.completed", download_url=download_url)
+            logger.info(f"Task {task.id} served from storage")
+            return JsonResponse(
+                {
+                    "task_id": str(task.id),
+                    "status": task.status,
+                    "callback_url": task.callback_url,
+                    "webhook_url": task.webhook_url,
+                    "eta_seconds": 0,
+                    "download_url": download_url,
+                }
+            )
+
+        try:
+            estimate = admission.estimate(resolution)
+        except Exception as e:
+            # Admission control must never take the endpoint down with it
+            logger.error(f"Admission estimate failed: {e}", exc_info=True)
+            estimate = None
+
+        if estimate and not estimate.admitted:
+            response = JsonResponse(
+                {
+                    "error": "The download queue is full, please retry later.",
+                    "queue_depth": estimate.queue_depth,
+                    "projected_wait_seconds": math.ceil(estimate.projected_wait),
+                },
+                status=429,
+            )
+            response["Retry-After"] = str(estimate.retry_after)
+            return response
+
         task = DownloadTask.objects.create(
             url=url,
             resolution=resolution,
             include_audio=include_audio,
+            webhook_url=webhook_url,
+            client_id=fairqueue.client_identity(request),
+            progressive=progressive,
+            clip_start=clip_start,
+            clip_end=clip_end,
+            frame_accurate=frame_accurate,
             status="pending",
             stage="queued",
+            eta_at=(
+                timezone.now() + timedelta(seconds=estimate.eta_seconds)
+                if estimate
+                else None
+            ),
         )
 
         task.callback_url = (
@@ -81,15 +210,37 @@ def start_download(request):
             "include_audio": include_audio,
         }
 
-        download_video.delay(str(task.id), original_payload)
+        # Queued per client and sent to Celery by name once a worker is free,
+        # so the web process never imports the worker code
+        try:
+            fairqueue.enqueue(task, original_payload)
+        except redis.RedisError as e:
+            logger.error(f"Fair queue unavailable, sending task directly: {e}")
+            celery_app.send_task(
+                fairqueue.DOWNLOAD_TASK_NAME,
+                (str(task.id), original_payload),
+                task_id=str(task.id),
+            )
+        else:
+            # The task is parked; the beat fallback sends it if this fails
+            try:
+                fairqueue.dispatch()
+            except Exception as e:
+                logger.error(f"Fair queue dispatch failed for task {task.id}: {e}")
+        touch(task.id)
 
-        return JsonResponse(
-            {
-                "task_id": str(task.id),
-                "status": task.status,
-                "callback_url": task.callback_url,
-            }
-        )
+        response = {
+            "task_id": str(task.id),
+            "status": task.status,
+            "callback_url": task.callback_url,
+            "webhook_url": task.webhook_url,
+            "eta_seconds": estimate.eta_seconds if estimate else None,
+        }
+        if progressive:
+            response["progressive_url"] = request.build_absolute_uri(
+                reverse("progressive_download", args=[task.id])
+            )
+        return JsonResponse(response)
 
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON format"}, status=400)
@@ -106,11 +257,99 @@ def check_status(request, task_id):
         logger.error(f"Task with id {task_id} not found")
         return JsonResponse({"error": "Task not found"}, status=404)
 
+    touch(task.id)
     return JsonResponse(
         task.to_dict(),
     )
 
 
+def status_cache_key(task_id):
+    return f"task_status:{task_id}"
+
+
+@csrf_exempt
+def bulk_check_status(request):
+    """
+    Status of many tasks at once: POST {"task_ids": [...]}. Finished tasks
+    never change, so they are served from the cache as JSON serialized once;
+    everything else is read with a single query.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        task_ids = [str(uuid.UUID(str(task_id))) for task_id in data["task_ids"]]
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse(
+            {"error": "task_ids must be a list of task ids"}, status=400
+        )
+    task_ids = list(dict.fromkeys(task_ids))
+    if len(task_ids) > settings.BULK_STATUS_MAX_IDS:
+        return JsonResponse(
+            {"error": f"At most {settings.BULK_STATUS_MAX_IDS} task ids per request"},
+            status=400,
+        )
+
+    cached = cache.get_many([status_cache_key(task_id) for task_id in task_ids])
+    entries = {}
+    for task_id in task_ids:
+        entry = cached.get(status_cache_key(task_id))
+        if entry is not None:
+            entries[task_id] = entry
+
+    missing = [task_id for task_id in task_ids if task_id not in entries]
+    active = []
+    if missing:
+        finished = {}
+        rows = DownloadTask.objects.filter(id__in=missing).values_list(
+            *BULK_STATUS_FIELDS
+        )
+        for row in rows:
+            task_id = str(row[0])
+            entry = json.dumps(
+                dict(zip(BULK_STATUS_FIELDS[1:], row[1:])),
+                cls=DjangoJSONEncoder,
+                separators=(",", ":"),
+            )
+            entries[task_id] = entry
+            if row[1] in ACTIVE_STATUSES:
+                active.append(task_id)
+            else:
+                finished[status_cache_key(task_id)] = entry
+        if finished:
+            cache.set_many(finished, settings.BULK_STATUS_CACHE_TTL)
+    touch_many(active)
+
+    # Entries are already JSON, only the envelope is assembled here
+    tasks = ",".join(
+        f'"{task_id}":{entries[task_id]}' for task_id in task_ids if task_id in entries
+    )
+    not_found = [task_id for task_id in task_ids if task_id not in entries]
+    return HttpResponse(
+        f'{{"tasks":{{{tasks}}},"not_found":{json.dumps(not_found)}}}',
+        content_type="application/json",
+    )
+
+
+@csrf_exempt
+def cancel_download(request, task_id):
+    """Cancel a queued or running download task."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    task = DownloadTask.objects.filter(id=task_id).first()
+    if not task:
+        return JsonResponse({"error": "Task not found"}, status=404)
+
+    if not cancel_task(task):
+        return JsonResponse(
+            {"error": "Task has already finished", "status": task.status},
+            status=409,
+        )
+    return JsonResponse({"task_id": str(task.id), "status": task.status})
+
+
 def download_file(request, signed_filename):
     try:
         signed_filename = urllib.parse.unquote(signed_filename)
@@ -133,5 +372,36 @@ def download_file(request, signed_filename):
         return HttpResponse("Error serving file", status=500)
 
 
+async def progressive_download(request, task_id):
+    """
+    Serve a progressive task's output while the worker is still producing it,
+    and redirect to the stored object once the upload has finished.
+    """
+    task = await DownloadTask.objects.filter(id=task_id).afirst()
+    if not task:
+        return JsonResponse({"error": "Task not found"}, status=404)
+
+    if task.status == "completed" and task.file.name:
+        download_url = await sync_to_async(generate_s3_signed_url)(
+            task.file.name, task.storage_shard
+        )
+        if download_url:
+            return HttpResponseRedirect(download_url)
+
+    if not task.progressive or task.status == "failed":
+        return JsonResponse(
+            {"error": "No progressive output for this task", "status": task.status},
+            status=409,
+        )
+
+    response = StreamingHttpResponse(
+        stream_scratch_file(task.id), content_type="video/mp4"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{task.id}.mp4"'
+    response["Cache-Control"] = "no-store"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 def index(request):
     return render(request, "downloader/index.html")
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.validators import URLValidator
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "webhooks:pending"
+PROCESSING_KEY = "webhooks:processing:{name}"  # taken by a dispatcher, not done
+RETRY_KEY = "webhooks:retry"
+DEAD_KEY = "webhooks:dead"
+DEAD_LETTER_LIMIT = 10000
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.WEBHOOK_QUEUE_URL)
+    return _redis_client
+
+
+def sign_payload(body, timestamp, secret=None):
+    """HMAC-SHA256 over ``"{timestamp}.{body}"``, as sent in X-Webhook-Signature."""
+    secret = secret or settings.WEBHOOK_SIGNING_SECRET
+    if not secret:
+        raise ImproperlyConfigured("WEBHOOK_SIGNING_SECRET is not set")
+    message = f"{timestamp}.{body}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def is_public_address(address):
+    # IPv6 addresses from getaddrinfo may carry a zone, "fe80::1%eth0"
+    ip = ipaddress.ip_address(address.split("%")[0])
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_webhook_url(url):
+    """
+    Raise ValidationError unless webhooks are enabled and ``url`` is an http(s)
+    URL whose host only resolves to public addresses. Otherwise a client could
+    have the dispatcher POST to services on the internal network.
+    """
+    if not settings.WEBHOOK_SIGNING_SECRET:
+        raise ValidationError("Webhooks are not enabled on this server")
+    URLValidator(schemes=["http", "https"])(url)
+    if settings.WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return
+    try:
+        addresses = {
+            info[4][0]
+            for info in socket.getaddrinfo(
+                urlsplit(url).hostname, None, proto=socket.IPPROTO_TCP
+            )
+        }
+    except (socket.gaierror, UnicodeError):
+        raise ValidationError("Webhook host does not resolve")
+    if not all(is_public_address(address) for address in addresses):
+        raise ValidationError("Webhook host is not a public address")
+
+
+def public_resolver():
+    """
+    aiohttp resolver that drops private addresses, so a webhook host that
+    resolved to a public address when it was submitted can't be pointed at
+    the internal network later.
+    """
+    from aiohttp.resolver import DefaultResolver
+
+    class PublicResolver(DefaultResolver):
+        async def resolve(self, host, port=0, family=socket.AF_INET):
+            resolved = [
+                entry
+                for entry in await super().resolve(host, port, family)
+                if is_public_address(entry["host"])
+            ]
+            if not resolved:
+                raise OSError(f"{host} does not resolve to a public address")
+            return resolved
+
+    return PublicResolver()
+
+
+def enqueue_webhook(task, event, download_url=None, error_message=None, metadata=None):
+    """
+    Queue a task completion/failure notification for the webhook dispatcher.
+    Only a Redis LPUSH happens here, so workers never wait on the receiver.
+    """
+    if not task.webhook_url:
+        return
+    body = json.dumps(
+        {
+            "event": event,
+            "task_id": str(task.id),
+            "status": task.status,
+            "stage": task.stage,
+            "download_url": download_url,
+            "error_message": error_message,
+            "metadata": metadata,
+            "timestamp": int(time.time()),
+        },
+        default=str,
+    )
+    item = {
+        "id": str(uuid.uuid4()),
+        "url": task.webhook_url,
+        "body": body,
+        "attempt": 0,
+    }
+    try:
+        get_redis().lpush(QUEUE_KEY, json.dumps(item))
+    except redis.RedisError as e:
+        logger.error(f"Could not queue webhook for task {task.id}: {e}")
+
+
+class WebhookDispatcher:
+    """
+    Drains the webhook queue with one pooled aiohttp session.
+
+    Deliveries run concurrently up to ``concurrency``; a host that already has
+    ``per_host`` requests in flight gets its further items deferred instead of
+    occupying global slots. Failed deliveries are retried with exponential
+    backoff through a Redis sorted set and dead-lettered after ``max_attempts``.
+
+    Items are moved to this dispatcher's processing list while it works on
+    them and removed once delivered or rescheduled. Whatever a crashed run
+    left there is queued again when a dispatcher of the same ``name`` starts.
+    """
+
+    def __init__(
+        self,
+        redis_url=None,
+        concurrency=None,
+        per_host=None,
+        timeout=None,
+        max_attempts=None,
+        batch_size=100,
+        name=None,
+    ):
+        if not settings.WEBHOOK_SIGNING_SECRET:
+            raise ImproperlyConfigured("Set WEBHOOK_SIGNING_SECRET to deliver webhooks")
+        self.redis_url = redis_url or settings.WEBHOOK_QUEUE_URL
+        self.concurrency = concurrency or settings.WEBHOOK_CONCURRENCY
+        self.per_host = per_host or settings.WEBHOOK_PER_HOST_CONCURRENCY
+        self.timeout = timeout or settings.WEBHOOK_TIMEOUT
+        self.max_attempts = max_attempts or settings.WEBHOOK_MAX_ATTEMPTS
+        self.batch_size = batch_size
+        # Stable across restarts of the same container
+        self.processing_key = PROCESSING_KEY.format(name=name or socket.gethostname())
+        self.in_flight = defaultdict(int)
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.pending = set()
+        self.stopping = False
+        self.stats = defaultdict(int)
+
+    async def run(self):
+        import aiohttp
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(self.redis_url)
+        await self.requeue_unfinished()
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+            resolver=(
+                None if settings.WEBHOOK_ALLOW_PRIVATE_HOSTS else public_resolver()
+            ),
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as self.session:
+            promoter = asyncio.create_task(self.promote_retries())
+            try:
+                while not self.stopping:
+                    await self.drain_once()
+            finally:
+                promoter.cancel()
+                if self.pending:
+                    await asyncio.gather(*self.pending, return_exceptions=True)
+                await self.redis.aclose()
+
+    def stop(self):
+        self.stopping = True
+
+    async def requeue_unfinished(self):
+        """Queue again what a previous run took but never finished."""
+        requeued = 0
+        while await self.redis.lmove(self.processing_key, QUEUE_KEY, "RIGHT", "RIGHT"):
+            requeued += 1
+        if requeued:
+            logger.info(f"Requeued {requeued} unfinished webhooks")
+
+    async def drain_once(self):
+        pipe = self.redis.pipeline(transaction=False)
+        for _ in range(self.batch_size):
+            pipe.lmove(QUEUE_KEY, self.processing_key, "RIGHT", "LEFT")
+        raw_items = [raw for raw in await pipe.execute() if raw is not None]
+        if not raw_items:
+            raw = await self.redis.blmove(
+                QUEUE_KEY, self.processing_key, 1, "RIGHT", "LEFT"
+            )
+            if raw is None:
+                return
+            raw_items = [raw]
+
+        for raw in raw_items:
+            item = json.loads(raw)
+            host = urlsplit(item["url"]).netloc
+            if self.in_flight[host] >= self.per_host:
+                await self.schedule(item, delay=0.5, count_attempt=False)
+                await self.done(raw)
+                continue
+            await self.slots.acquire()
+            self.in_flight[host] += 1
+            job = asyncio.create_task(self.deliver(raw, item, host))
+            self.pending.add(job)
+            job.add_done_callback(self.pending.discard)
+
+    async def done(self, raw):
+        await self.redis.lrem(self.processing_key, 1, raw)
+
+    async def deliver(self, raw, item, host):
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "youtube-downloader-webhooks/1.0",
+            "X-Webhook-Id": item["id"],
+            "X-Webhook-Timestamp": timestamp,
+            "X-Webhook-Signature": f"sha256={sign_payload(item['body'], timestamp)}",
+        }
+        try:
+            async with self.session.post(
+                item["url"], data=item["body"], headers=headers
+            ) as response:
+                await response.read()
+                status = response.status
+        except Exception as e:
+            logger.info(f"Webhook {item['id']} to {host} failed: {e}")
+            status = None
+        finally:
+            self.in_flight[host] -= 1
+            self.slots.release()
+
+        if status is not None and 200 <= status < 300:
+            self.stats["delivered"] += 1
+        elif status is not None and 400 <= status < 500 and status not in (408, 429):
+            # The receiver rejected the payload; retrying will not help.
+            self.stats["rejected"] += 1
+            logger.info(f"Webhook {item['id']} rejected by {host} with {status}")
+        else:
+            await self.schedule(item)
+        await self.done(raw)
+
+    async def schedule(self, item, delay=None, count_attempt=True):
+        if count_attempt:
+            item["attempt"] += 1
+            if item["attempt"] >= self.max_attempts:
+                self.stats["dead"] += 1
+                await self.redis.lpush(DEAD_KEY, json.dumps(item))
+                await self.redis.ltrim(DEAD_KEY, 0, DEAD_LETTER_LIMIT - 1)
+                logger.error(
+                    f"Webhook {item['id']} dropped after {item['attempt']} attempts"
+                )
+                return
+            self.stats["retried"] += 1
+            delay = min(
+                settings.WEBHOOK_BACKOFF_BASE * 2 ** (item["attempt"] - 1),
+                settings.WEBHOOK_BACKOFF_MAX,
+            ) * random.uniform(0.8, 1.2)
+        await self.redis.zadd(RETRY_KEY, {json.dumps(item): time.time() + delay})
+
+    async def promote_retries(self):
+        """Move retries whose backoff has elapsed back onto the pending queue."""
+        while True:
+            due = await self.redis.zrangebyscore(
+                RETRY_KEY, 0, time.time(), start=0, num=self.batch_size * 10
+            )
+            for raw in due:
+                # ZREM first so two dispatchers never both requeue the same item
+                if await self.redis.zrem(RETRY_KEY, raw):
+                    await self.redis.rpush(QUEUE_KEY, raw)
+            await asyncio.sleep(0.2 if due else 1)
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_ready, worker_shutdown
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "youtube_downloader.settings")
@@ -16,6 +17,48 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
 
+@worker_init.connect
+def preload_worker_dependencies(**kwargs):
+    """
+    The web process never imports these. Workers load them once in the parent
+    so prefork children share the pages instead of importing on first task.
+    """
+    import boto3.s3.transfer  # noqa: F401
+    import pytubefix  # noqa: F401
+
+    # Per-task database connection counts, see downloader.dbstats
+    import downloader.dbstats  # noqa: F401
+
+
+@worker_init.connect
+def sweep_scratch_files(**kwargs):
+    """Scratch files of workers on this host that died, see downloader.reaper."""
+    from downloader.reaper import sweep_orphans
+
+    sweep_orphans()
+
+
+_capacity_beacon = None
+
+
+@worker_ready.connect
+def advertise_capacity(sender=None, **kwargs):
+    """Publish this worker's pool size for admission control and the fair queue."""
+    global _capacity_beacon
+    from downloader.fairqueue import CapacityBeacon
+
+    controller = sender.controller
+    slots = getattr(controller, "max_concurrency", None) or controller.concurrency
+    _capacity_beacon = CapacityBeacon(sender.hostname, slots)
+    _capacity_beacon.start()
+
+
+@worker_shutdown.connect
+def withdraw_capacity(**kwargs):
+    if _capacity_beacon is not None:
+        _capacity_beacon.stop()
+
+
 @app.task(bind=True)
 def debug_task(self):
-    print(f"Request: {self.request!r}")
\ No newline at end of file
+    print(f"Request: {self.request!r}")
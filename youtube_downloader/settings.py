@@ -1,6 +1,9 @@
 from pathlib import Path
+import json
 import os
 
+from celery.schedules import crontab
+
 try:
     from decouple import config
 except ImportError:
@@ -8,7 +11,6 @@ except ImportError:
 
 import logging
 
-logging.basicConfig()
 logger = logging.getLogger(__name__)
 
 
@@ -43,6 +45,159 @@ CELERY_TIMEZONE = "UTC"
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_BROKER_URL = f"redis://{config('REDIS_HOST', 'localhost')}:6379/0"
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+CELERY_RESULT_EXPIRES = int(config("CELERY_RESULT_EXPIRES", "86400"))
+CELERY_IMPORTS = [
+    "downloader.retention",
+    "downloader.eviction",
+    "downloader.cancellation",
+    "downloader.fairqueue",
+    "downloader.prewarm",
+    "downloader.reaper",
+]
+CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "purge-expired-download-tasks": {
+        "task": "downloader.retention.purge_expired_records",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "cancel-abandoned-tasks": {
+        "task": "downloader.cancellation.cancel_abandoned_tasks",
+        "schedule": 60.0,
+    },
+    "evict-stored-objects": {
+        "task": "downloader.eviction.evict_stored_objects",
+        "schedule": crontab(minute="*/15"),
+    },
+    "dispatch-fair-queue": {
+        "task": "downloader.fairqueue.dispatch_fair_queue",
+        "schedule": 15.0,
+    },
+    "reap-stuck-tasks": {
+        "task": "downloader.reaper.reap_stuck_tasks",
+        "schedule": 60.0,
+    },
+    "prewarm-popular-videos": {
+        "task": "downloader.prewarm.prewarm_popular_videos",
+        "schedule": crontab(hour=config("PREWARM_HOURS", "2-6"), minute="*/20"),
+    },
+}
+# Downloads run for minutes: hold only the task being executed, so queued
+# work stays in the fair queue where any free worker can take it
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Cancellation flags and client activity (socket watchers, status polls)
+TASK_STATE_REDIS_URL = config(
+    "TASK_STATE_REDIS_URL", f"redis://{config('REDIS_HOST', 'localhost')}:6379/3"
+)
+# Unfinished tasks nobody has watched or polled for this long are cancelled
+ABANDON_AFTER_SECONDS = int(config("ABANDON_AFTER_SECONDS", "300"))
+CANCEL_CHECK_INTERVAL = float(config("CANCEL_CHECK_INTERVAL", "1.0"))
+
+# Running tasks beat every HEARTBEAT_INTERVAL seconds. After HEARTBEAT_TIMEOUT
+# without a beat the reaper re-queues the task, up to REAPER_MAX_REQUEUES
+# times, then fails it. in_progress rows that never beat are reaped after
+# REAPER_UNTRACKED_AFTER seconds.
+HEARTBEAT_INTERVAL = float(config("HEARTBEAT_INTERVAL", "10"))
+HEARTBEAT_TIMEOUT = float(config("HEARTBEAT_TIMEOUT", "60"))
+REAPER_MAX_REQUEUES = int(config("REAPER_MAX_REQUEUES", "1"))
+REAPER_UNTRACKED_AFTER = int(config("REAPER_UNTRACKED_AFTER", "21600"))
+
+# Per-client fair queuing (downloader.fairqueue). Clients sending one of the
+# FAIR_QUEUE_API_KEYS ({"<name>": "<key>"}) in X-API-Key are queued as
+# "key:<name>", everyone else by address as "ip:<address>". Weights are keyed
+# by those ids, e.g. {"key:acme": 4}
+# The address is read from FAIR_QUEUE_CLIENT_IP_HEADER, which Cloudflare sets
+# to the visitor address. Without that header it is the address
+# FAIR_QUEUE_PROXY_HOPS entries from the end of X-Forwarded-For, one entry per
+# trusted proxy (Cloudflare and nginx). Everything before that entry is
+# whatever the client sent.
+FAIR_QUEUE_CLIENT_IP_HEADER = config("FAIR_QUEUE_CLIENT_IP_HEADER", "CF-Connecting-IP")
+FAIR_QUEUE_PROXY_HOPS = int(config("FAIR_QUEUE_PROXY_HOPS", "2"))
+FAIR_QUEUE_CLIENT_CONCURRENCY = int(config("FAIR_QUEUE_CLIENT_CONCURRENCY", "2"))
+FAIR_QUEUE_API_KEYS = json.loads(config("FAIR_QUEUE_API_KEYS", "{}"))
+FAIR_QUEUE_WEIGHTS = json.loads(config("FAIR_QUEUE_WEIGHTS", "{}"))
+
+# "prefork" runs every download in Celery. "asyncio" hands full downloads to
+# the I/O workers (manage.py run_io_worker, downloader.aioworker), each of
+# which runs IO_WORKER_CONCURRENCY transfers over IO_WORKER_CONNECTIONS pooled
+# connections. Set it the same on every container.
+DOWNLOAD_WORKER_MODE = config("DOWNLOAD_WORKER_MODE", "prefork")
+IO_WORKER_CONCURRENCY = int(config("IO_WORKER_CONCURRENCY", "200"))
+IO_WORKER_CONNECTIONS = int(config("IO_WORKER_CONNECTIONS", "400"))
+IO_WORKER_FFMPEG_PROCESSES = int(config("IO_WORKER_FFMPEG_PROCESSES", "4"))
+# Threads for pytubefix metadata lookups and other blocking calls
+IO_WORKER_THREADS = int(config("IO_WORKER_THREADS", "32"))
+# Bytes per stream range request, as pytubefix requests them
+IO_WORKER_RANGE_SIZE = int(config("IO_WORKER_RANGE_SIZE", str(9 * 1024**2)))
+IO_WORKER_READ_TIMEOUT = float(config("IO_WORKER_READ_TIMEOUT", "60"))
+IO_WORKER_PROGRESS_INTERVAL = float(config("IO_WORKER_PROGRESS_INTERVAL", "1.0"))
+
+# Off-peak pre-processing of popular videos (downloader.prewarm), run every
+# 20 minutes during PREWARM_HOURS (server time, crontab hour syntax). Each run
+# queues at most PREWARM_TOP_N videos and stops at the CPU budget (expected
+# processing seconds) or the bandwidth budget (expected output bytes).
+PREWARM_CLIENT_ID = "prewarm"
+PREWARM_WINDOW_HOURS = int(config("PREWARM_WINDOW_HOURS", "72"))
+PREWARM_TOP_N = int(config("PREWARM_TOP_N", "20"))
+PREWARM_MIN_REQUESTS = int(config("PREWARM_MIN_REQUESTS", "3"))
+PREWARM_RESOLUTIONS_PER_VIDEO = int(config("PREWARM_RESOLUTIONS_PER_VIDEO", "2"))
+PREWARM_CPU_SECONDS = float(config("PREWARM_CPU_SECONDS", "3600"))
+PREWARM_BANDWIDTH_BYTES = int(config("PREWARM_BANDWIDTH_BYTES", str(20 * 1024**3)))
+# Only run while fewer than this share of worker slots is busy
+PREWARM_MAX_SLOT_SHARE = float(config("PREWARM_MAX_SLOT_SHARE", "0.5"))
+# Pre-warming yields to real clients in the fair queue
+FAIR_QUEUE_WEIGHTS.setdefault(PREWARM_CLIENT_ID, 0.25)
+
+# Bulk status endpoint: finished tasks are cached as serialized JSON
+BULK_STATUS_MAX_IDS = int(config("BULK_STATUS_MAX_IDS", "1000"))
+BULK_STATUS_CACHE_TTL = int(config("BULK_STATUS_CACHE_TTL", "3600"))
+
+# Admission control in start_download: reject with 429 when the projected
+# queue wait exceeds ADMISSION_MAX_WAIT_SECONDS
+ADMISSION_QUEUE_NAME = config("ADMISSION_QUEUE_NAME", "celery")
+ADMISSION_MAX_WAIT_SECONDS = float(config("ADMISSION_MAX_WAIT_SECONDS", "900"))
+ADMISSION_MIN_RETRY_AFTER = int(config("ADMISSION_MIN_RETRY_AFTER", "30"))
+ADMISSION_DEFAULT_WORKER_SLOTS = int(config("ADMISSION_DEFAULT_WORKER_SLOTS", "4"))
+ADMISSION_DEFAULT_SERVICE_SECONDS = float(
+    config("ADMISSION_DEFAULT_SERVICE_SECONDS", "120")
+)
+ADMISSION_HISTORY_HOURS = int(config("ADMISSION_HISTORY_HOURS", "24"))
+ADMISSION_STATS_TTL = int(config("ADMISSION_STATS_TTL", "60"))
+
+# Outbound webhooks for task completion, drained by run_webhook_dispatcher
+WEBHOOK_QUEUE_URL = config(
+    "WEBHOOK_QUEUE_URL", f"redis://{config('REDIS_HOST', 'localhost')}:6379/2"
+)
+# Receivers verify deliveries with this, so it must not be SECRET_KEY. Webhooks
+# are refused until it is set.
+WEBHOOK_SIGNING_SECRET = config("WEBHOOK_SIGNING_SECRET", "")
+# Only for development; otherwise webhook URLs must resolve to public addresses
+WEBHOOK_ALLOW_PRIVATE_HOSTS = str(
+    config("WEBHOOK_ALLOW_PRIVATE_HOSTS", "False")
+).lower() in ("1", "true", "yes")
+WEBHOOK_CONCURRENCY = int(config("WEBHOOK_CONCURRENCY", "1000"))
+WEBHOOK_PER_HOST_CONCURRENCY = int(config("WEBHOOK_PER_HOST_CONCURRENCY", "20"))
+WEBHOOK_TIMEOUT = float(config("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(config("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE = float(config("WEBHOOK_BACKOFF_BASE", "2"))
+WEBHOOK_BACKOFF_MAX = float(config("WEBHOOK_BACKOFF_MAX", "600"))
+
+# Progressive delivery: workers write fragmented MP4 here while producing it.
+# Must be a volume shared by the web and worker containers.
+PROGRESSIVE_SCRATCH_DIR = config(
+    "PROGRESSIVE_SCRATCH_DIR", os.path.join(BASE_DIR, "scratch", "progressive")
+)
+PROGRESSIVE_CHUNK_SIZE = int(config("PROGRESSIVE_CHUNK_SIZE", str(256 * 1024)))
+PROGRESSIVE_POLL_INTERVAL = float(config("PROGRESSIVE_POLL_INTERVAL", "0.5"))
+PROGRESSIVE_IDLE_TIMEOUT = float(config("PROGRESSIVE_IDLE_TIMEOUT", "300"))
+
+# Retention of finished DownloadTask rows and Celery results
+DOWNLOAD_TASK_RETENTION_DAYS = int(config("DOWNLOAD_TASK_RETENTION_DAYS", "30"))
+TASK_RESULT_RETENTION_DAYS = int(config("TASK_RESULT_RETENTION_DAYS", "7"))
+RETENTION_BATCH_SIZE = int(config("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE = float(config("RETENTION_BATCH_PAUSE", "0.1"))
+RETENTION_ARCHIVE_PREFIX = config("RETENTION_ARCHIVE_PREFIX", "archives/download_tasks")
+RETENTION_PARTITION_MONTHS_AHEAD = int(config("RETENTION_PARTITION_MONTHS_AHEAD", "2"))
 
 # PostgreSQL Configuration
 DATABASES = {
@@ -53,8 +208,22 @@ DATABASES = {
         "PASSWORD": config("POSTGRES_PASSWORD", ""),
         "HOST": config("POSTGRES_HOST", "localhost"),
         "PORT": config("POSTGRES_PORT", "5432"),
+        # Workers keep their connection across tasks (set DB_CONN_MAX_AGE for
+        # them); a reused connection is checked before the next task uses it.
+        # ASGI runs each request in a fresh thread, so the web role keeps 0 and
+        # is pooled by PgBouncer instead, see docker-compose.yml.
+        "CONN_MAX_AGE": int(config("DB_CONN_MAX_AGE", "0")),
+        "CONN_HEALTH_CHECKS": True,
+        # Required behind PgBouncer in transaction pooling mode
+        "DISABLE_SERVER_SIDE_CURSORS": str(
+            config("DB_DISABLE_SERVER_SIDE_CURSORS", "False")
+        ).lower()
+        in ("1", "true", "yes"),
     }
 }
+# Worker progress is persisted at most this often; clients get every update
+# over the channel layer regardless
+PROGRESS_SAVE_INTERVAL = float(config("PROGRESS_SAVE_INTERVAL", "2.0"))
 
 # Cloudflare R2 Configuration for Storage
 CLOUDFLARE_R2_CONFIG_OPTIONS = {
@@ -67,6 +236,41 @@ CLOUDFLARE_R2_CONFIG_OPTIONS = {
     "region_name": "auto",
 }
 
+# Output files are spread over these buckets/endpoints by consistent hashing
+# on the key (downloader.storage). "default" is the bucket above; add shards
+# as JSON, e.g. {"r2-eu": {"bucket_name": ..., "endpoint_url": ...,
+# "access_key": ..., "secret_key": ..., "weight": 0.5}}, then run
+# rebalance_storage. Weight 0 drains a shard.
+STORAGE_SHARDS = {
+    "default": {
+        **CLOUDFLARE_R2_CONFIG_OPTIONS,
+        "weight": float(config("STORAGE_DEFAULT_SHARD_WEIGHT", "1")),
+    },
+    **json.loads(config("STORAGE_SHARDS", "{}")),
+}
+STORAGE_RING_VNODES = int(config("STORAGE_RING_VNODES", "1000"))
+
+# Size budget for downloaded files kept in the bucket, enforced by eviction.
+# Point CLOUDFLARE_R2_BUCKET_ENDPOINT at a local MinIO to exercise it offline.
+STORAGE_BUDGET_BYTES = int(config("STORAGE_BUDGET_BYTES", str(500 * 1024**3)))
+STORAGE_EVICTION_POLICY = config("STORAGE_EVICTION_POLICY", "lru")  # or "lfu"
+STORAGE_EVICTION_RECONCILE = str(
+    config("STORAGE_EVICTION_RECONCILE", "False")
+).lower() in ("1", "true", "yes")
+
+# Multipart uploads to the bucket, see downloader.uploads. Parts are sized so
+# one takes about UPLOAD_TARGET_PART_SECONDS at the measured per-connection
+# rate; concurrency is tuned between the bounds from observed throughput.
+UPLOAD_MIN_PART_SIZE = int(config("UPLOAD_MIN_PART_SIZE", str(8 * 1024**2)))
+UPLOAD_MAX_PART_SIZE = int(config("UPLOAD_MAX_PART_SIZE", str(512 * 1024**2)))
+UPLOAD_TARGET_PART_SECONDS = float(config("UPLOAD_TARGET_PART_SECONDS", "4"))
+UPLOAD_DEFAULT_THROUGHPUT = int(
+    config("UPLOAD_DEFAULT_THROUGHPUT", str(8 * 1024**2))
+)  # bytes/s per connection until something has been measured
+UPLOAD_MIN_CONCURRENCY = int(config("UPLOAD_MIN_CONCURRENCY", "4"))
+UPLOAD_MAX_CONCURRENCY = int(config("UPLOAD_MAX_CONCURRENCY", "32"))
+UPLOAD_PROGRESS_INTERVAL = float(config("UPLOAD_PROGRESS_INTERVAL", "1.0"))
+
 # Storage Configuration
 STORAGES = {
     "default": {
@@ -84,59 +288,36 @@ STATIC_URL = "static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
 # Logging Configuration
-# LOGGING = {
-#     "version": 1,
-#     "disable_existing_loggers": False,
-#     "formatters": {
-#         "verbose": {"format": "{levelname} {asctime} {module} {message}", "style": "{"},
-#         "simple": {"format": "{levelname} {message}", "style": "{"},
-#     },
-#     "handlers": {
-#         "console": {
-#             "level": "INFO",
-#             "class": "logging.StreamHandler",
-#             "formatter": "simple",
-#         },
-#         "file": {
-#             "level": "INFO",
-#             "class": "logging.FileHandler",
-#             "filename": os.path.join(BASE_DIR, "INFO.log"),
-#             "formatter": "verbose",
-#         },
-#         "error_file": {
-#             "level": "ERROR",
-#             "class": "logging.FileHandler",
-#             "filename": os.path.join(BASE_DIR, "error.log"),
-#             "formatter": "verbose",
-#         },
-#     },
-#     "loggers": {
-#         "django": {
-#             "handlers": ["console", "file", "error_file"],
-#             "level": "INFO",
-#             "propagate": True,
-#         },
-#         "downloader": {
-#             "handlers": ["console", "file", "error_file"],
-#             "level": "INFO",
-#             "propagate": True,
-#         },
-#         "celery": {
-#             "handlers": ["console", "file", "error_file"],
-#             "level": "INFO",
-#             "propagate": True,
-#         },
-#         "celery.task": {
-#             "handlers": ["console", "file", "error_file"],
-#             "level": "INFO",
-#             "propagate": True,
-#         },
-#     },
-#     "root": {
-#         "handlers": ["console", "file", "error_file"],
-#         "level": "INFO",
-#     },
-# }
+# JSON lines written from a background thread (see downloader.log); progress
+# records are sampled to one per task every LOG_PROGRESS_INTERVAL seconds.
+LOG_LEVEL = config("LOG_LEVEL", "INFO")
+LOG_PROGRESS_INTERVAL = float(config("LOG_PROGRESS_INTERVAL", "5"))
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "sample_progress": {
+            "()": "downloader.log.ProgressSampleFilter",
+            "interval": LOG_PROGRESS_INTERVAL,
+        },
+    },
+    "handlers": {
+        "queue": {
+            "class": "downloader.log.NonBlockingHandler",
+            "filters": ["sample_progress"],
+        },
+    },
+    "root": {
+        "handlers": ["queue"],
+        "level": LOG_LEVEL,
+    },
+    "loggers": {
+        "django": {"level": LOG_LEVEL},
+        "celery": {"level": LOG_LEVEL},
+    },
+}
+# Keep the LOGGING config above in workers instead of Celery's own setup
+CELERY_WORKER_HIJACK_ROOT_LOGGER = False
 
 # Application Definition
 INSTALLED_APPS = [